@@ -1,4 +1,5 @@
 from abc import abstractmethod
+from typing import Optional
 from veloxsearch.config import SearchConfig
 
 
@@ -8,6 +9,10 @@ class Search:
     """
 
     config: SearchConfig
+    # Whether results are sorted by decreasing weight instead of alphabetically
+    ranked: bool = False
+    # Seconds spent loading the wordlist, set by <Velox>
+    load_duration: float = 0
 
     def __init__(self, config: SearchConfig):
         self.config = config
@@ -20,8 +25,52 @@ class Search:
         raise NotImplementedError
 
     @abstractmethod
-    def complete_prefix(self, prefix: str) -> list[str]:
+    def complete_prefix(
+        self, prefix: str, limit: Optional[int] = None, after: Optional[str] = None
+    ) -> list[str]:
         """
         Return a list of words starting with the given prefix in alphabetical order
+        (by decreasing weight if <ranked>). At most <limit> words are returned,
+        <config.limit> if it is not provided. If <after> is provided, only the
+        words after it in alphabetical order are returned, to get the next page
+        of results. It must be normalized, and is not supported if <ranked>.
         """
         raise NotImplementedError
+
+    def count_prefix(self, prefix: str) -> int:
+        """
+        Return the number of words starting with the given prefix
+        """
+        raise NotImplementedError
+
+    def complete_fuzzy(
+        self, prefix: str, max_distance: int, limit: Optional[int] = None
+    ) -> list[tuple[int, str]]:
+        """
+        Return at most <limit> words (<config.limit> if it is not provided)
+        starting with a prefix at a Levenshtein distance of at most
+        <max_distance> from the given prefix, as (distance, word) pairs sorted
+        by distance then alphabetically. Only algorithms able to prune the
+        words too far from the prefix support it.
+        """
+        raise NotImplementedError
+
+    def complete_substring(
+        self, substring: str, limit: Optional[int] = None
+    ) -> list[str]:
+        """
+        Return at most <limit> words (<config.limit> if it is not provided)
+        containing the given substring anywhere, sorted by the end of the word
+        starting with it (see <substring_key>). Algorithms indexing the words
+        by prefix only do not support it.
+        """
+        raise NotImplementedError
+
+    def complete_prefixes(
+        self, prefixes: list[str], limit: Optional[int] = None
+    ) -> list[list[str]]:
+        """
+        Return the result of <complete_prefix> for each prefix, in the same
+        order. Algorithms can override it to share work between prefixes.
+        """
+        return [self.complete_prefix(prefix, limit) for prefix in prefixes]
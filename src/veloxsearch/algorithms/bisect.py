@@ -1,37 +1,54 @@
+from typing import Optional
 from . import Search
-import bisect
+from ..index import WordIndex
 
 
 class BisectSearch(Search):
     """
     Use a sorted list and a bisection algorithm
+
+    The sorted list is stored as a compact <WordIndex>: all unique words live
+    in a single bytes buffer with an offset table, instead of one Python string
+    object per word.
     """
 
-    wordlist: list[str]
+    index: WordIndex
 
     def load_wordlist(self, wordlist: str) -> None:
-        with open(wordlist, "r", errors="replace") as fd:
-            # We need the list to be sorted
-            # Transform words in lowercase because search is case insensitive
-            self.wordlist = sorted(line.strip().lower() for line in fd.readlines())
+        # The index is sorted, deduplicated and contains lowercase words
+        # because search is case insensitive
+        self.index = WordIndex.from_wordlist(wordlist)
 
-    def complete_prefix(self, prefix: str) -> list[str]:
+    def complete_prefix(
+        self, prefix: str, limit: Optional[int] = None, after: Optional[str] = None
+    ) -> list[str]:
         # Transform prefix in lowercase because search is case insensitive
         prefix_lower = prefix.lower()
 
-        # We can use bisect because wordlist is sorted
-        # bisect_left gives the index where "<prefix_lower>" would be inserted
-        # to keep <self.wordlist> sorted, meaning that all following words are >= <prefix>
-        index = bisect.bisect_left(self.wordlist, prefix_lower)
-
-        # We use a set to remove duplicates
-        words: set[str] = set()
-        while len(words) < self.config.limit and self.wordlist[index].startswith(
-            prefix_lower
-        ):
-            # We take at most <self.config.limit> unique words that starts with <prefix>
-            words.add(self.wordlist[index])
-            index += 1
-
-        # The set items need to be sorted again
-        return sorted(words)
+        # The index is sorted and deduplicated, so we bisect to the first word
+        # >= <prefix_lower> and take at most <limit> following words that
+        # start with <prefix_lower>
+        return self.index.complete(
+            prefix_lower, self.config.limit if limit is None else limit, after
+        )
+
+    def count_prefix(self, prefix: str) -> int:
+        # Transform prefix in lowercase because search is case insensitive
+        return self.index.count(prefix.lower())
+
+    def complete_fuzzy(
+        self, prefix: str, max_distance: int, limit: Optional[int] = None
+    ) -> list[tuple[int, str]]:
+        # Transform prefix in lowercase because search is case insensitive
+        return self.index.complete_fuzzy(
+            prefix.lower(), max_distance, self.config.limit if limit is None else limit
+        )
+
+    def complete_prefixes(
+        self, prefixes: list[str], limit: Optional[int] = None
+    ) -> list[list[str]]:
+        # Transform prefixes in lowercase because search is case insensitive
+        return self.index.complete_many(
+            [prefix.lower() for prefix in prefixes],
+            self.config.limit if limit is None else limit,
+        )
@@ -0,0 +1,240 @@
+from array import array
+from typing import Iterable, Optional
+from . import Search
+from ..index import WordIndex, common_prefix_length
+
+
+class _State:
+    """
+    State of the automaton during its construction
+    """
+
+    __slots__ = ("edges", "final")
+
+    # Transitions, in lexicographic order because words are added in order
+    edges: dict[str, "_State"]
+    # A state is final if the path leading to it is a word of the list
+    final: bool
+
+    def __init__(self) -> None:
+        self.edges = {}
+        self.final = False
+
+    def signature(self) -> tuple:
+        """
+        Two states with the same signature accept the same suffixes, provided
+        that their children are already minimized
+        """
+        return (
+            self.final,
+            tuple((char, id(child)) for char, child in self.edges.items()),
+        )
+
+
+class Dawg:
+    """
+    Directed acyclic word graph: a minimal deterministic automaton accepting
+    the words of the list. Unlike a prefix tree, states are shared between
+    words ending the same way, so suffixes are stored once.
+
+    The automaton is stored in flat arrays. The outgoing edges of a state are
+    contiguous and sorted: edges of state <s> are at positions
+    [first_edge[s], first_edge[s + 1]), with their char in <edge_chars> and
+    their destination state in <edge_targets>.
+    """
+
+    first_edge: array
+    edge_chars: str
+    edge_targets: array
+    final: bytearray
+    # Number of words accepted from each state
+    word_counts: array
+
+    @staticmethod
+    def from_sorted(words: Iterable[str]) -> "Dawg":
+        """
+        Build the automaton from sorted and deduplicated words, using the
+        incremental algorithm of Daciuk et al.: once a word is added, the
+        states only used by the previous word can no longer change, so they
+        are replaced by an equivalent state if one was already seen.
+        """
+        register: dict[tuple, _State] = {}
+        root = _State()
+        # States along the previous word, starting with the root
+        path = [root]
+        previous = ""
+
+        def minimize(down_to: int) -> None:
+            # Minimize states of <path> after position <down_to>, deepest first
+            for position in range(len(path) - 1, down_to, -1):
+                state = path[position]
+                signature = state.signature()
+                existing = register.get(signature)
+                if existing is None:
+                    register[signature] = state
+                else:
+                    path[position - 1].edges[previous[position - 1]] = existing
+            del path[down_to + 1 :]
+
+        for word in words:
+            common = common_prefix_length(previous, word)
+            minimize(common)
+
+            for char in word[common:]:
+                state = _State()
+                path[-1].edges[char] = state
+                path.append(state)
+            path[-1].final = True
+            previous = word
+
+        minimize(0)
+
+        return Dawg._flatten(root)
+
+    @staticmethod
+    def _flatten(root: _State) -> "Dawg":
+        """
+        Number the states and lay out their edges in flat arrays
+        """
+        numbers = {id(root): 0}
+        states = [root]
+        # <states> grows while it is iterated: each state is visited once
+        for state in states:
+            for child in state.edges.values():
+                if id(child) not in numbers:
+                    numbers[id(child)] = len(states)
+                    states.append(child)
+
+        dawg = Dawg()
+        dawg.first_edge = array("I", [0])
+        dawg.edge_targets = array("I")
+        dawg.final = bytearray(len(states))
+        chars: list[str] = []
+        for number, state in enumerate(states):
+            chars.extend(state.edges.keys())
+            dawg.edge_targets.extend(
+                numbers[id(child)] for child in state.edges.values()
+            )
+            dawg.first_edge.append(len(chars))
+            dawg.final[number] = state.final
+        dawg.edge_chars = "".join(chars)
+        dawg.word_counts = dawg._count_words()
+
+        return dawg
+
+    def _count_words(self) -> array:
+        """
+        Return the number of words accepted from each state: 1 if the state is
+        final, plus the number of words accepted from each of its children
+        """
+        first_edge, edge_targets = self.first_edge, self.edge_targets
+        counts = array("q", [-1]) * len(self)
+        # States are counted after all their children, which are shared
+        stack = [0]
+        while stack:
+            state = stack[-1]
+            targets = edge_targets[first_edge[state] : first_edge[state + 1]]
+            uncounted = [target for target in targets if counts[target] < 0]
+            if uncounted:
+                stack.extend(uncounted)
+                continue
+
+            stack.pop()
+            counts[state] = self.final[state] + sum(
+                counts[target] for target in targets
+            )
+        return array("I", counts)
+
+    def __len__(self) -> int:
+        """
+        Return the number of states
+        """
+        return len(self.final)
+
+    def _walk(self, prefix: str) -> Optional[int]:
+        """
+        Return the state reached by reading <prefix>, or None if the prefix is
+        unknown
+        """
+        state = 0
+        for char in prefix:
+            # Chars of the edges of a state are unique, so str.find locates
+            # the edge in C
+            edge = self.edge_chars.find(
+                char, self.first_edge[state], self.first_edge[state + 1]
+            )
+            if edge < 0:
+                return None
+            state = self.edge_targets[edge]
+        return state
+
+    def count_prefix(self, prefix: str) -> int:
+        """
+        Return the number of words starting with the given prefix <prefix>
+        """
+        state = self._walk(prefix)
+        return 0 if state is None else self.word_counts[state]
+
+    def complete_prefix(
+        self, prefix: str, limit: int, after: Optional[str] = None
+    ) -> list[str]:
+        """
+        Return a list of maximum <limit> words starting with the given prefix
+        <prefix> sorted by lexicographic order, after <after> if provided
+        """
+        state = self._walk(prefix)
+        if state is None:
+            # The prefix is unknown, so there is no words
+            return []
+
+        first_edge, edge_chars = self.first_edge, self.edge_chars
+        edge_targets, final = self.edge_targets, self.final
+
+        words = [prefix] if final[state] and (after is None or prefix > after) else []
+        # Iterative depth first search. Each item is the path of a state and
+        # the range of its edges left to visit.
+        stack = [[prefix, first_edge[state], first_edge[state + 1]]]
+        while stack and len(words) < limit:
+            item = stack[-1]
+            path, edge, end = item
+            if edge == end:
+                stack.pop()
+                continue
+            item[1] = edge + 1
+
+            child = edge_targets[edge]
+            child_path = path + edge_chars[edge]
+            if after is not None and child_path <= after:
+                if not after.startswith(child_path):
+                    # All the words from the child are before <after>
+                    continue
+                # Only some of them are after <after>, but not the child
+            elif final[child]:
+                words.append(child_path)
+            stack.append([child_path, first_edge[child], first_edge[child + 1]])
+
+        return words
+
+
+class DawgSearch(Search):
+    """
+    Use a directed acyclic word graph stored in flat arrays to index wordlist
+    """
+
+    def load_wordlist(self, wordlist: str) -> None:
+        # The compact index sorts and deduplicates words with a small memory
+        # footprint. Words are then decoded one at a time to build the graph.
+        index = WordIndex.from_wordlist(wordlist)
+        self.dawg = Dawg.from_sorted(index.iter_words())
+
+    def complete_prefix(
+        self, prefix: str, limit: Optional[int] = None, after: Optional[str] = None
+    ) -> list[str]:
+        # Transform prefix in lowercase because search is case insensitive
+        return self.dawg.complete_prefix(
+            prefix.lower(), self.config.limit if limit is None else limit, after
+        )
+
+    def count_prefix(self, prefix: str) -> int:
+        # Transform prefix in lowercase because search is case insensitive
+        return self.dawg.count_prefix(prefix.lower())
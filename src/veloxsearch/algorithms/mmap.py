@@ -0,0 +1,28 @@
+import logging
+from .bisect import BisectSearch
+from ..index import WordIndex, is_index_file
+
+
+class MmapSearch(BisectSearch):
+    """
+    Use a compiled index file, memory mapped and searched by bisection.
+
+    Index files are built with `veloxsearch build-index`. Loading one only
+    maps it in memory, so startup does not depend on the wordlist size and
+    all processes using the same index share the OS page cache. Queries are
+    those of <BisectSearch>, on the mapped <WordIndex>.
+    """
+
+    def load_wordlist(self, wordlist: str) -> None:
+        if is_index_file(wordlist):
+            self.index = WordIndex.open(wordlist)
+            return
+
+        # Still support raw wordlists, but they need to be compiled on
+        # every start
+        logging.warning(
+            "%s is not a compiled index, building it in memory. "
+            "Use `veloxsearch build-index` to speed up startup.",
+            wordlist,
+        )
+        super().load_wordlist(wordlist)
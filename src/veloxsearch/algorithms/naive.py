@@ -1,4 +1,7 @@
+from typing import Optional
 from . import Search
+from ..index import read_wordlist
+from ..suffix_array import substring_key
 
 
 class NaiveSearch(Search):
@@ -9,20 +12,46 @@ class NaiveSearch(Search):
     wordlist: list[str]
 
     def load_wordlist(self, wordlist: str) -> None:
-        with open(wordlist, "r", errors="replace") as fd:
-            # Transform words in lowercase because the search is case insensitive
-            self.wordlist = [word.strip().lower() for word in fd]
+        # Transform words in lowercase because the search is case insensitive
+        self.wordlist = list(read_wordlist(wordlist))
 
-    def complete_prefix(self, prefix: str) -> list[str]:
+    def complete_prefix(
+        self, prefix: str, limit: Optional[int] = None, after: Optional[str] = None
+    ) -> list[str]:
         # Transform prefix in lowercase because the search in case insensitive
         prefix_lower = prefix.lower()
 
         # 1. We compute a set of words - to avoid duplicates - that start with the
         # given prefix
         # 2. We sort this set in lexicographic order
-        # 3. We return only <self.config.limit> results
+        # 3. We return only <limit> results
         matching = sorted(
-            set(word for word in self.wordlist if word.startswith(prefix_lower))
+            set(
+                word
+                for word in self.wordlist
+                if word.startswith(prefix_lower) and (after is None or word > after)
+            )
         )
 
-        return matching[: self.config.limit]
+        return matching[: self.config.limit if limit is None else limit]
+
+    def count_prefix(self, prefix: str) -> int:
+        # Transform prefix in lowercase because the search in case insensitive
+        prefix_lower = prefix.lower()
+
+        # Duplicated words are only counted once
+        return len(set(word for word in self.wordlist if word.startswith(prefix_lower)))
+
+    def complete_substring(
+        self, substring: str, limit: Optional[int] = None
+    ) -> list[str]:
+        # Transform substring in lowercase because the search in case insensitive
+        substring_lower = substring.lower()
+
+        # Duplicated words are only returned once
+        matching = sorted(
+            set(word for word in self.wordlist if substring_lower in word),
+            key=lambda word: (substring_key(word, substring_lower), word),
+        )
+
+        return matching[: self.config.limit if limit is None else limit]
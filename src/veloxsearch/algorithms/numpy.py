@@ -0,0 +1,111 @@
+from typing import Any, Optional
+from . import Search
+from ..index import WordIndex
+
+# Optional dependency, see <NumpySearch>. None if it is not installed.
+np: Any
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Number of words copied at once to the matrix of <NumpySearch>
+_CHUNK_ROWS = 1 << 16
+
+
+class NumpySearch(Search):
+    """
+    Use a sorted NumPy array of fixed-width byte strings, searched with
+    <numpy.searchsorted>
+
+    Both bounds of the words starting with a prefix are found by bisection in
+    C: the first word >= <prefix>, and the first word >= <prefix> + 0xff, as
+    0xff never appears in UTF-8. A batch of prefixes is resolved by a single
+    call for all the lower bounds and a single call for all the upper bounds,
+    only the returned words being handled in Python.
+
+    Every word takes the size of the longest one, so a few very long words
+    make the array much larger than the <BisectSearch> index. Requires numpy
+    (`pip install veloxsearch[numpy]`).
+    """
+
+    # Sorted and deduplicated words, padded with NUL bytes
+    words: Any
+
+    def load_wordlist(self, wordlist: str) -> None:
+        if np is None:
+            raise NotImplementedError("The numpy algorithm requires numpy")
+
+        # The index is sorted, deduplicated and contains lowercase words
+        # because search is case insensitive
+        index = WordIndex.from_wordlist(wordlist)
+        blob = np.frombuffer(index.blob, dtype=np.uint8)
+        offsets = np.asarray(index.offsets, dtype=np.int64)
+        lengths = np.diff(offsets)
+        width = max(int(lengths.max(initial=0)), 1)
+
+        # Copy the words of each length to the start of their row of a matrix
+        # with one row per word, then view each row as a single string. Rows
+        # are copied by chunks, so that the gathered positions (8 bytes per
+        # byte of the blob) stay small next to the matrix.
+        matrix = np.zeros((len(lengths), width), dtype=np.uint8)
+        for length in np.unique(lengths):
+            columns = np.arange(length)
+            rows = np.flatnonzero(lengths == length)
+            for start in range(0, len(rows), _CHUNK_ROWS):
+                chunk = rows[start : start + _CHUNK_ROWS]
+                matrix[chunk, :length] = blob[offsets[chunk, None] + columns]
+        self.words = matrix.view(f"S{width}").ravel()
+
+    def _bounds(self, prefixes: list[str]) -> tuple[Any, Any]:
+        """
+        Return the arrays of the first index of the words starting with each
+        prefix, and of the index following the last one. <prefixes> must
+        already be normalized.
+        """
+        encoded = np.array([prefix.encode() for prefix in prefixes], dtype=bytes)
+        lower = self.words.searchsorted(encoded)
+        upper = self.words.searchsorted(np.char.add(encoded, b"\xff"))
+        return lower, upper
+
+    def _decode(self, start: int, end: int) -> list[str]:
+        """
+        Return the words in [<start>, <end>) as strings
+        """
+        return [word.decode() for word in self.words[start:end].tolist()]
+
+    def complete_prefix(
+        self, prefix: str, limit: Optional[int] = None, after: Optional[str] = None
+    ) -> list[str]:
+        if limit is None:
+            limit = self.config.limit
+
+        # Transform prefix in lowercase because search is case insensitive
+        lower, upper = self._bounds([prefix.lower()])
+        start = int(lower[0])
+        if after is not None:
+            # Strings are compared as if padded with NUL bytes, so the words
+            # after <after> are the ones on its right
+            start = max(start, int(self.words.searchsorted(after.encode(), "right")))
+        return self._decode(start, min(start + limit, int(upper[0])))
+
+    def count_prefix(self, prefix: str) -> int:
+        # Transform prefix in lowercase because search is case insensitive
+        lower, upper = self._bounds([prefix.lower()])
+        return int(upper[0] - lower[0])
+
+    def complete_prefixes(
+        self, prefixes: list[str], limit: Optional[int] = None
+    ) -> list[list[str]]:
+        if not prefixes:
+            return []
+        if limit is None:
+            limit = self.config.limit
+
+        # Transform prefixes in lowercase because search is case insensitive
+        lower, upper = self._bounds([prefix.lower() for prefix in prefixes])
+        ends = np.minimum(upper, lower + limit)
+        return [
+            self._decode(start, end)
+            for start, end in zip(lower.tolist(), ends.tolist())
+        ]
@@ -0,0 +1,156 @@
+from itertools import groupby, islice
+import logging
+import sys
+import time
+from typing import Optional
+from . import Search
+from ..config import SearchConfig
+from ..index import WordIndex, load_index
+
+
+class PrecomputedSearch(Search):
+    """
+    Answer short prefixes from a table of precomputed answers, and delegate
+    longer prefixes to another search algorithm.
+
+    Short prefixes match the most words, so they are the most expensive ones
+    for most algorithms, but there are few of them: the answers of all the
+    prefixes up to <config.precompute_length> chars are computed once at load
+    time, and such queries become a single dict lookup.
+    """
+
+    backend: Search
+    # Precomputed answers, by prefix
+    table: dict[str, tuple[str, ...]]
+    # All the prefixes up to this length are in <table>
+    length: int
+
+    def __init__(self, config: SearchConfig, backend: Search):
+        super().__init__(config)
+        self.backend = backend
+        self.table = {}
+        self.length = -1
+
+    def load_wordlist(self, wordlist: str) -> None:
+        self.backend.load_wordlist(wordlist)
+
+        start = time.perf_counter()
+        # Sorted, deduplicated and normalized words, from the index of the
+        # backend if it has one rather than reading the wordlist again
+        index = getattr(self.backend, "index", None)
+        if not isinstance(index, WordIndex):
+            index = load_index(wordlist)
+
+        self.table = {}
+        self.length = -1
+        stored_words = 0
+        # Words of the answers, so that the answers of all prefix lengths share
+        # the same strings. Words are decoded one at a time and only the
+        # stored ones are kept.
+        strings: dict[str, str] = {}
+        for length in range(self.config.precompute_length + 1):
+            # Words are sorted, so the words starting with a given prefix are
+            # contiguous and already in the order of the answer. Words shorter
+            # than <length> have no prefix of this length.
+            level = {
+                prefix: tuple(
+                    strings.setdefault(word, word)
+                    for word in islice(group, self.config.limit)
+                )
+                for prefix, group in groupby(
+                    (word for word in index.iter_words() if len(word) >= length),
+                    key=lambda word: word[:length],
+                )
+            }
+
+            level_words = sum(len(answer) for answer in level.values())
+            if stored_words + level_words > self.config.precompute_max_words:
+                logging.warning(
+                    "Precomputing prefixes of length %d would exceed "
+                    "search.precompute_max_words (%d), stopping at length %d",
+                    length,
+                    self.config.precompute_max_words,
+                    self.length,
+                )
+                break
+
+            self.table.update(level)
+            self.length = length
+            stored_words += level_words
+
+        # Approximation of the memory used by the table: the dict, the tuples
+        # and the strings referenced by the tuples
+        size = (
+            sys.getsizeof(self.table)
+            + sum(sys.getsizeof(answer) for answer in self.table.values())
+            + sum(
+                sys.getsizeof(word)
+                for word in set(
+                    word for answer in self.table.values() for word in answer
+                )
+            )
+        )
+        logging.info(
+            "Precomputed %d prefixes up to length %d (%d words, ~%d KiB) in %.3fs",
+            len(self.table),
+            self.length,
+            stored_words,
+            size // 1024,
+            time.perf_counter() - start,
+        )
+
+    def complete_prefix(
+        self, prefix: str, limit: Optional[int] = None, after: Optional[str] = None
+    ) -> list[str]:
+        # Transform prefix in lowercase because search is case insensitive
+        prefix_lower = prefix.lower()
+
+        if (limit is not None and limit > self.config.limit) or after is not None:
+            # The table only holds the first <config.limit> words
+            return self.backend.complete_prefix(prefix, limit, after)
+
+        if len(prefix_lower) <= self.length:
+            # All the prefixes of this length matching at least one word are in
+            # the table
+            return list(self.table.get(prefix_lower, ())[:limit])
+
+        return self.backend.complete_prefix(prefix, limit)
+
+    def count_prefix(self, prefix: str) -> int:
+        return self.backend.count_prefix(prefix)
+
+    def complete_fuzzy(
+        self, prefix: str, max_distance: int, limit: Optional[int] = None
+    ) -> list[tuple[int, str]]:
+        # Only exact prefixes are precomputed
+        return self.backend.complete_fuzzy(prefix, max_distance, limit)
+
+    def complete_substring(
+        self, substring: str, limit: Optional[int] = None
+    ) -> list[str]:
+        # Only prefixes are precomputed
+        return self.backend.complete_substring(substring, limit)
+
+    def complete_prefixes(
+        self, prefixes: list[str], limit: Optional[int] = None
+    ) -> list[list[str]]:
+        if limit is not None and limit > self.config.limit:
+            # The table only holds the first <config.limit> words
+            return self.backend.complete_prefixes(prefixes, limit)
+
+        results: list[list[str]] = []
+        # Prefixes that are not precomputed, by position in <prefixes>
+        missing: dict[int, str] = {}
+        for position, prefix in enumerate(prefixes):
+            prefix_lower = prefix.lower()
+            if len(prefix_lower) <= self.length:
+                results.append(list(self.table.get(prefix_lower, ())[:limit]))
+            else:
+                results.append([])
+                missing[position] = prefix
+
+        missing_results = self.backend.complete_prefixes(list(missing.values()), limit)
+        for position, words in zip(missing, missing_results):
+            results[position] = words
+
+        return results
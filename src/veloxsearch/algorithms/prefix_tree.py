@@ -1,24 +1,240 @@
+from array import array
+import hashlib
+import logging
+import os
+import struct
+import sys
 from typing import Optional
+import zlib
+
 from . import Search
+from ..fuzzy import fuzzy_complete
+from ..index import common_prefix_length, read_wordlist
+
+# Snapshot file layout (all integers are little-endian):
+#
+#   +-------+---------+----------+--------+-------+-------+-------------+
+#   | magic | version | checksum | digest | mtime | count | labels_size |
+#   +-------+---------+----------+--------+-------+-------+-------------+
+#   | first_child: (count + 1) x uint32                                 |
+#   | counts: count x uint32                                            |
+#   | leaves: count x uint8                                             |
+#   | labels: UTF-8 encoded chars, one per node                         |
+#   +-------------------------------------------------------------------+
+#
+# Nodes are numbered in breadth first order, the root being node 0, so the
+# children of node <i> are the nodes [first_child[i], first_child[i + 1]),
+# in lexicographic order. The label of a node is the char leading to it from
+# its parent (a NUL char for the root). <digest> (SHA-256) and <mtime> (in
+# nanoseconds) identify the wordlist the tree was built from. The checksum is
+# the CRC32 of everything after the header.
+SNAPSHOT_MAGIC = b"VLXTRIE\x00"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct("<8sII32sqQQ")
 
 
 class Node:
+    __slots__ = ("children", "is_leaf", "count")
+
     children: dict[str, "Node"]
     # A node is a leaf if it represents a word in the list
     is_leaf: bool
+    # Number of leaves under this node, itself included
+    count: int
 
     def __init__(self):
         self.children = {}
         self.is_leaf = False
+        self.count = 0
 
     def __str__(self) -> str:
         children = (f"{key}:{value}" for key, value in self.children.items())
         return f"Node(is_leaf={self.is_leaf},children={{{','.join(children)}}})"
 
 
+class SnapshotNode(Node):
+    """
+    Node of a tree loaded from a snapshot. Its children are only created
+    when they are first visited, from the arrays of the snapshot.
+
+    With several workers, each worker creates the nodes it visits in its own
+    memory: unlike the snapshot arrays, they are not shared between the
+    workers.
+    """
+
+    __slots__ = ("snapshot", "number", "_children")
+
+    snapshot: "TreeSnapshot"
+    # Number of the node in the snapshot
+    number: int
+    # Children, None until they are first visited
+    _children: Optional[dict[str, Node]]
+
+    def __init__(self, snapshot: "TreeSnapshot", number: int):
+        self.snapshot = snapshot
+        self.number = number
+        self.is_leaf = bool(snapshot.leaves[number])
+        self.count = snapshot.counts[number]
+        self._children = None
+
+    @property
+    def children(self) -> dict[str, Node]:  # type: ignore[override]
+        children = self._children
+        if children is None:
+            snapshot = self.snapshot
+            children = self._children = {
+                snapshot.labels[child]: SnapshotNode(snapshot, child)
+                for child in range(
+                    snapshot.first_child[self.number],
+                    snapshot.first_child[self.number + 1],
+                )
+            }
+        return children
+
+
+class TreeSnapshot:
+    """
+    Prefix tree stored in flat arrays, to be written to a file and read back
+    in bulk instead of inserting the words again (see SNAPSHOT_HEADER for the
+    layout)
+    """
+
+    first_child: array
+    counts: array
+    leaves: bytes
+    labels: str
+
+    def __init__(self, first_child: array, counts: array, leaves: bytes, labels: str):
+        self.first_child = first_child
+        self.counts = counts
+        self.leaves = leaves
+        self.labels = labels
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    @staticmethod
+    def from_tree(tree: "Tree") -> "TreeSnapshot":
+        """
+        Number the nodes of <tree> in breadth first order
+        """
+        nodes = [tree.root]
+        first_child = array("I", [1])
+        counts = array("I")
+        leaves = bytearray()
+        labels = ["\x00"]
+        # <nodes> grows while it is walked
+        for node in nodes:
+            counts.append(node.count)
+            leaves.append(node.is_leaf)
+            for char, child in sorted(node.children.items()):
+                labels.append(char)
+                nodes.append(child)
+            first_child.append(len(nodes))
+
+        return TreeSnapshot(first_child, counts, bytes(leaves), "".join(labels))
+
+    @staticmethod
+    def wordlist_key(wordlist: str) -> tuple[bytes, int]:
+        """
+        Return the SHA-256 digest and the modification time of <wordlist>,
+        which identify the snapshots of its tree
+        """
+        mtime = os.stat(wordlist).st_mtime_ns
+        with open(wordlist, "rb") as fd:
+            digest = hashlib.file_digest(fd, "sha256").digest()
+        return digest, mtime
+
+    @staticmethod
+    def read(path: str, key: tuple[bytes, int]) -> "TreeSnapshot":
+        """
+        Read the snapshot file <path>. Raise a ValueError if it is invalid or
+        was not built from the wordlist of key <key>.
+        """
+        with open(path, "rb") as fd:
+            data = fd.read()
+
+        if len(data) < SNAPSHOT_HEADER.size:
+            raise ValueError(f"Invalid snapshot {path}: file is truncated")
+
+        magic, version, checksum, digest, mtime, count, labels_size = (
+            SNAPSHOT_HEADER.unpack_from(data)
+        )
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"Invalid snapshot {path}: bad magic number")
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot version {version} in {path}")
+        if (digest, mtime) != key:
+            raise ValueError(f"Outdated snapshot {path}: the wordlist changed")
+
+        first_child_start = SNAPSHOT_HEADER.size
+        counts_start = first_child_start + 4 * (count + 1)
+        leaves_start = counts_start + 4 * count
+        labels_start = leaves_start + count
+        if len(data) != labels_start + labels_size:
+            raise ValueError(f"Invalid snapshot {path}: unexpected file size")
+
+        view = memoryview(data)
+        if zlib.crc32(view[first_child_start:]) != checksum:
+            raise ValueError(f"Invalid snapshot {path}: checksum mismatch")
+
+        first_child = array("I")
+        first_child.frombytes(view[first_child_start:counts_start])
+        counts = array("I")
+        counts.frombytes(view[counts_start:leaves_start])
+        if sys.byteorder != "little":
+            first_child.byteswap()
+            counts.byteswap()
+        labels = data[labels_start:].decode()
+        if len(labels) != count:
+            raise ValueError(f"Invalid snapshot {path}: unexpected labels size")
+
+        return TreeSnapshot(
+            first_child, counts, data[leaves_start:labels_start], labels
+        )
+
+    def write(self, path: str, key: tuple[bytes, int]) -> None:
+        """
+        Write the snapshot to <path>, for the wordlist of key <key>. The file
+        is replaced atomically.
+        """
+        first_child = array("I", self.first_child)
+        counts = array("I", self.counts)
+        if sys.byteorder != "little":
+            first_child.byteswap()
+            counts.byteswap()
+        payload = [
+            first_child.tobytes(),
+            counts.tobytes(),
+            self.leaves,
+            self.labels.encode(),
+        ]
+
+        checksum = 0
+        for part in payload:
+            checksum = zlib.crc32(part, checksum)
+        digest, mtime = key
+        header = SNAPSHOT_HEADER.pack(
+            SNAPSHOT_MAGIC,
+            SNAPSHOT_VERSION,
+            checksum,
+            digest,
+            mtime,
+            len(self),
+            len(payload[-1]),
+        )
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as fd:
+            fd.write(header)
+            for part in payload:
+                fd.write(part)
+        os.replace(tmp_path, path)
+
+
 class Tree:
-    def __init__(self) -> None:
-        self.root = Node()
+    def __init__(self, root: Optional[Node] = None) -> None:
+        self.root = Node() if root is None else root
 
     def __str__(self) -> str:
         return f"Tree({str(self.root)})"
@@ -28,38 +244,61 @@ class Tree:
         Insert a word in the tree
         """
         node = self.root
+        path = [node]
         for char in word:
             if char not in node.children:
                 # A node does not exist yet for this char
                 node.children[char] = Node()
             node = node.children[char]
+            path.append(node)
 
-        node.is_leaf = True
+        if not node.is_leaf:
+            node.is_leaf = True
+            # The word is new, so there is one more leaf under each node of
+            # its path
+            for ancestor in path:
+                ancestor.count += 1
 
-    def _find_prefix_node(self, prefix: str) -> Optional[Node]:
+    def _find_prefix_node(
+        self, prefix: str, path: Optional[list[Node]] = None
+    ) -> Optional[Node]:
         """
         Try to find the node that represents the prefix
         Return None if the prefix is unknown, return the node otherwise
+
+        <path> holds the nodes already reached while reading <prefix>: the
+        node representing prefix[:i] is path[i]. The walk starts from its last
+        node, and it is extended with the nodes reached.
         """
-        node = self.root
-        for char in prefix:
+        if path is None:
+            path = [self.root]
+
+        node = path[-1]
+        for char in prefix[len(path) - 1 :]:
             if char not in node.children:
                 return None
             node = node.children[char]
+            path.append(node)
         return node
 
     def _collect_all_words(
-        self, node: Node, current_word: str, words: list, limit: int
+        self,
+        node: Node,
+        current_word: str,
+        words: list,
+        limit: int,
+        after: Optional[str] = None,
     ) -> None:
         """
         Fill the <words> list by doing a depth first search starting with node <node>.
-        At most <limit> words will be taken, sorted in lexicographic order
+        At most <limit> words will be taken, sorted in lexicographic order, and
+        only the ones after <after> if provided
         """
         if len(words) >= limit:
             return
 
         # If the current node is a leaf, we add current word to <words>
-        if node.is_leaf:
+        if node.is_leaf and (after is None or current_word > after):
             words.append(current_word)
 
         # Recursively call for each child node, in lexicographic order
@@ -68,12 +307,20 @@ class Tree:
             if len(words) >= limit:
                 return
 
-            self._collect_all_words(child_node, current_word + char, words, limit)
+            child_word = current_word + char
+            if after is None or after.startswith(child_word):
+                # Only a part of the words under the child are after <after>
+                self._collect_all_words(child_node, child_word, words, limit, after)
+            elif child_word > after:
+                # All the words under the child are after <after>
+                self._collect_all_words(child_node, child_word, words, limit)
 
-    def complete_prefix(self, prefix: str, limit: int) -> list[str]:
+    def complete_prefix(
+        self, prefix: str, limit: int, after: Optional[str] = None
+    ) -> list[str]:
         """
         Return a list of maximum <limit> words starting with the given prefix <prefix>
-        sorted by lexicographic order
+        sorted by lexicographic order, after <after> if provided
         """
         # Find the node corresponding to the prefix
         start_node = self._find_prefix_node(prefix)
@@ -84,10 +331,64 @@ class Tree:
 
         # Retrieve words under <start_node>
         words: list[str] = []
-        self._collect_all_words(start_node, prefix, words, limit)
+        self._collect_all_words(start_node, prefix, words, limit, after)
 
         return words
 
+    def count_prefix(self, prefix: str) -> int:
+        """
+        Return the number of words starting with the given prefix <prefix>
+        """
+        node = self._find_prefix_node(prefix)
+        return 0 if node is None else node.count
+
+    def complete_fuzzy(
+        self, prefix: str, max_distance: int, limit: int
+    ) -> list[tuple[int, str]]:
+        """
+        Return a list of maximum <limit> (distance, word) pairs, for the words
+        starting with a prefix at most <max_distance> edits away from
+        <prefix>, sorted by distance then lexicographic order
+        """
+
+        def collect(node: Node, path: str, limit: int) -> list[str]:
+            words: list[str] = []
+            self._collect_all_words(node, path, words, limit)
+            return words
+
+        return fuzzy_complete(
+            prefix,
+            max_distance,
+            limit,
+            self.root,
+            lambda node: node.children.items(),
+            collect,
+        )
+
+    def complete_prefixes(self, prefixes: list[str], limit: int) -> list[list[str]]:
+        """
+        Same as <complete_prefix> for several prefixes, returned in the same
+        order.
+
+        Prefixes are handled in sorted order, and the walk down the tree for a
+        prefix resumes from the deepest node shared with the previous prefix.
+        """
+        results: list[list[str]] = [[] for _ in prefixes]
+        path = [self.root]
+        previous = ""
+        for position in sorted(range(len(prefixes)), key=prefixes.__getitem__):
+            prefix = prefixes[position]
+
+            # Go back up to the deepest node shared with the previous prefix
+            del path[common_prefix_length(previous, prefix) + 1 :]
+
+            start_node = self._find_prefix_node(prefix, path)
+            if start_node is not None:
+                self._collect_all_words(start_node, prefix, results[position], limit)
+            previous = prefix
+
+        return results
+
 
 class PrefixTreeSearch(Search):
     """
@@ -95,12 +396,65 @@ class PrefixTreeSearch(Search):
     """
 
     def load_wordlist(self, wordlist: str) -> None:
-        self.tree = Tree()
-        with open(wordlist, "r", errors="replace") as fd:
-            for word in fd:
-                # Transform words in lowercase because search is case insensitive
-                self.tree.insert(word.strip().lower())
+        if not self.config.snapshot_dir:
+            self.tree = self._build_tree(wordlist)
+            return
+
+        # Snapshots are named after the wordlist content, so that the indexes
+        # of different wordlists can share the directory
+        key = TreeSnapshot.wordlist_key(wordlist)
+        path = os.path.join(self.config.snapshot_dir, f"{key[0].hex()}.trie")
+        try:
+            self.tree = Tree(SnapshotNode(TreeSnapshot.read(path, key), 0))
+            return
+        except FileNotFoundError:
+            pass
+        except ValueError as error:
+            logging.warning("%s, building the tree again", error)
+
+        self.tree = self._build_tree(wordlist)
+        try:
+            os.makedirs(self.config.snapshot_dir, exist_ok=True)
+            TreeSnapshot.from_tree(self.tree).write(path, key)
+        except OSError as error:
+            logging.error("Failed to write snapshot %s: %s", path, error)
 
-    def complete_prefix(self, prefix: str) -> list[str]:
+    @staticmethod
+    def _build_tree(wordlist: str) -> Tree:
+        """
+        Build the tree by inserting the words of <wordlist> one by one
+        """
+        tree = Tree()
+        # Transform words in lowercase because search is case insensitive
+        for word in read_wordlist(wordlist):
+            tree.insert(word)
+        return tree
+
+    def complete_prefix(
+        self, prefix: str, limit: Optional[int] = None, after: Optional[str] = None
+    ) -> list[str]:
+        # Transform prefix in lowercase because search is case insensitive
+        return self.tree.complete_prefix(
+            prefix.lower(), self.config.limit if limit is None else limit, after
+        )
+
+    def count_prefix(self, prefix: str) -> int:
+        # Transform prefix in lowercase because search is case insensitive
+        return self.tree.count_prefix(prefix.lower())
+
+    def complete_fuzzy(
+        self, prefix: str, max_distance: int, limit: Optional[int] = None
+    ) -> list[tuple[int, str]]:
         # Transform prefix in lowercase because search is case insensitive
-        return self.tree.complete_prefix(prefix.lower(), self.config.limit)
+        return self.tree.complete_fuzzy(
+            prefix.lower(), max_distance, self.config.limit if limit is None else limit
+        )
+
+    def complete_prefixes(
+        self, prefixes: list[str], limit: Optional[int] = None
+    ) -> list[list[str]]:
+        # Transform prefixes in lowercase because search is case insensitive
+        return self.tree.complete_prefixes(
+            [prefix.lower() for prefix in prefixes],
+            self.config.limit if limit is None else limit,
+        )
@@ -0,0 +1,242 @@
+from bisect import bisect_left
+from itertools import groupby
+from operator import itemgetter
+import sys
+from typing import Optional
+from . import Search
+from ..index import common_prefix_length, read_wordlist
+
+
+class Node:
+    """
+    Node of a radix tree. Each edge to a child node is labelled with a string
+    instead of a single char, single-child chains being merged.
+    """
+
+    __slots__ = ("labels", "children", "is_leaf", "count")
+
+    # Edge labels, sorted. Two labels never start with the same char.
+    labels: list[str]
+    # Child nodes, in the same order as <labels>
+    children: list["Node"]
+    # A node is a leaf if it represents a word in the list
+    is_leaf: bool
+    # Number of leaves under this node, itself included
+    count: int
+
+    def __init__(self, is_leaf: bool = False):
+        self.labels = []
+        self.children = []
+        self.is_leaf = is_leaf
+        self.count = int(is_leaf)
+
+    def __str__(self) -> str:
+        children = (
+            f"{label}:{child}" for label, child in zip(self.labels, self.children)
+        )
+        return f"Node(is_leaf={self.is_leaf},children={{{','.join(children)}}})"
+
+
+# Leaf nodes without children are all the same, so they share a single
+# instance
+_LEAF = Node(is_leaf=True)
+
+# Greater than any char of a word
+_MAX_CHAR = chr(sys.maxunicode)
+
+
+class RadixTree:
+    def __init__(self) -> None:
+        self.root = Node()
+
+    def __str__(self) -> str:
+        return f"RadixTree({str(self.root)})"
+
+    @staticmethod
+    def from_sorted(words: list[str]) -> "RadixTree":
+        """
+        Build a tree from sorted and deduplicated words.
+
+        Each node covers a range of the sorted list, whose words all start with
+        the path of the node. The range is split by bisection into one child
+        per next char, so children are created in lexicographic order and never
+        need to be sorted.
+        """
+        tree = RadixTree()
+        # Nodes left to build: node, range of words under it, length of its path
+        stack = [(tree.root, 0, len(words), 0)]
+        while stack:
+            node, low, high, depth = stack.pop()
+            # The words of the range are the leaves under the node
+            node.count = high - low
+            if low < high and len(words[low]) == depth:
+                # The first word of the range is the path of the node itself
+                node.is_leaf = True
+                low += 1
+
+            labels, children = node.labels, node.children
+            while low < high:
+                first = words[low]
+                # End of the words sharing the next char of <first>
+                end = bisect_left(words, first[: depth + 1] + _MAX_CHAR, low, high)
+                if end - low == 1:
+                    # A single word: the rest of the word is a leaf edge
+                    labels.append(first[depth:])
+                    children.append(_LEAF)
+                else:
+                    # The first and last words of a sorted range have the
+                    # shortest common prefix of the range
+                    common = common_prefix_length(first, words[end - 1])
+                    child = Node()
+                    labels.append(first[depth:common])
+                    children.append(child)
+                    stack.append((child, low, end, common))
+                low = end
+
+        return tree
+
+    def _find_prefix_node(
+        self, prefix: str, path: Optional[list[tuple[int, Node]]] = None
+    ) -> Optional[tuple[Node, str]]:
+        """
+        Try to find the first node whose path starts with the prefix.
+        Return None if the prefix is unknown, return the node and its path
+        otherwise.
+
+        <path> holds the nodes already reached while reading <prefix>, with
+        the number of chars read to reach them. The walk starts from its last
+        node, and it is extended with the nodes reached.
+        """
+        if path is None:
+            path = [(0, self.root)]
+        position, node = path[-1]
+
+        while position < len(prefix):
+            index = bisect_left(node.labels, prefix[position])
+            if index == len(node.labels):
+                return None
+
+            label = node.labels[index]
+            if prefix.startswith(label, position):
+                # The whole edge matches
+                position += len(label)
+                node = node.children[index]
+                path.append((position, node))
+            elif label.startswith(prefix[position:]):
+                # The prefix ends in the middle of the edge
+                return node.children[index], prefix[:position] + label
+            else:
+                return None
+
+        return node, prefix
+
+    def _collect_words(
+        self, node: Node, path: str, limit: int, after: Optional[str] = None
+    ) -> list[str]:
+        """
+        Return at most <limit> words under <node>, whose path is <path>, sorted
+        by lexicographic order, and after <after> if provided
+        """
+        words = [path] if node.is_leaf and (after is None or path > after) else []
+
+        # Iterative depth first search, with a stack of iterators over the
+        # children of the nodes being visited. Children are already sorted,
+        # and the paths of unvisited children are never built.
+        stack = [(path, zip(node.labels, node.children))]
+        while stack and len(words) < limit:
+            path, children = stack[-1]
+            for label, child in children:
+                child_path = path + label
+                if after is not None and child_path <= after:
+                    if not after.startswith(child_path):
+                        # All the words under the child are before <after>
+                        continue
+                    # Only some of them are after <after>, but not the child
+                elif child.is_leaf:
+                    words.append(child_path)
+                stack.append((child_path, zip(child.labels, child.children)))
+                break
+            else:
+                # All children have been visited
+                stack.pop()
+
+        return words
+
+    def complete_prefix(
+        self, prefix: str, limit: int, after: Optional[str] = None
+    ) -> list[str]:
+        """
+        Return a list of maximum <limit> words starting with the given prefix
+        <prefix> sorted by lexicographic order, after <after> if provided
+        """
+        found = self._find_prefix_node(prefix)
+        if found is None:
+            # The prefix is unknown, so there is no words
+            return []
+
+        return self._collect_words(*found, limit, after)
+
+    def count_prefix(self, prefix: str) -> int:
+        """
+        Return the number of words starting with the given prefix <prefix>
+        """
+        found = self._find_prefix_node(prefix)
+        return 0 if found is None else found[0].count
+
+    def complete_prefixes(self, prefixes: list[str], limit: int) -> list[list[str]]:
+        """
+        Same as <complete_prefix> for several prefixes, returned in the same
+        order.
+
+        Prefixes are handled in sorted order, and the walk down the tree for a
+        prefix resumes from the deepest node shared with the previous prefix.
+        """
+        results: list[list[str]] = [[] for _ in prefixes]
+        path = [(0, self.root)]
+        previous = ""
+        for position in sorted(range(len(prefixes)), key=prefixes.__getitem__):
+            prefix = prefixes[position]
+
+            # Go back up to the deepest node shared with the previous prefix
+            common = common_prefix_length(previous, prefix)
+            while path[-1][0] > common:
+                path.pop()
+
+            found = self._find_prefix_node(prefix, path)
+            if found is not None:
+                results[position] = self._collect_words(*found, limit)
+            previous = prefix
+
+        return results
+
+
+class RadixTreeSearch(Search):
+    """
+    Use a radix tree (compressed prefix tree) to index wordlist
+    """
+
+    def load_wordlist(self, wordlist: str) -> None:
+        # The tree is built from sorted and deduplicated words
+        words = list(map(itemgetter(0), groupby(sorted(read_wordlist(wordlist)))))
+        self.tree = RadixTree.from_sorted(words)
+
+    def complete_prefix(
+        self, prefix: str, limit: Optional[int] = None, after: Optional[str] = None
+    ) -> list[str]:
+        # Transform prefix in lowercase because search is case insensitive
+        return self.tree.complete_prefix(
+            prefix.lower(), self.config.limit if limit is None else limit, after
+        )
+
+    def count_prefix(self, prefix: str) -> int:
+        # Transform prefix in lowercase because search is case insensitive
+        return self.tree.count_prefix(prefix.lower())
+
+    def complete_prefixes(
+        self, prefixes: list[str], limit: Optional[int] = None
+    ) -> list[list[str]]:
+        # Transform prefixes in lowercase because search is case insensitive
+        return self.tree.complete_prefixes(
+            [prefix.lower() for prefix in prefixes],
+            self.config.limit if limit is None else limit,
+        )
@@ -0,0 +1,151 @@
+from array import array
+from heapq import heappop, heappush
+from typing import Optional
+from . import Search
+from ..index import WordIndex, is_index_file, read_weighted_wordlist
+
+
+class RankedIndex:
+    """
+    Sorted words with their weight, and a segment tree giving the position of
+    the heaviest word of any range of words.
+
+    The words starting with a prefix form a range of the sorted words. Its
+    heaviest word is the best completion, then the next best one is the
+    heaviest word of one of the two ranges on each side of it, and so on: a
+    best-first search over ranges returns the <limit> heaviest words in
+    O(<limit> * log(n)), whatever the number of words matching the prefix.
+    """
+
+    index: WordIndex
+    # Weight of each word of <index>
+    weights: array
+    # tree[n + i] is i, and tree[i] is the position of the heaviest of the
+    # words of its children. The lowest position wins ties, so that words of
+    # equal weight are in alphabetical order.
+    tree: array
+
+    def __init__(self, index: WordIndex, weights: array):
+        self.index = index
+        self.weights = weights
+
+        n = len(index)
+        tree = array("L", bytes(2 * n * array("L").itemsize))
+        for i in range(n):
+            tree[n + i] = i
+        for i in range(n - 1, 0, -1):
+            left, right = tree[2 * i], tree[2 * i + 1]
+            tree[i] = left if weights[left] >= weights[right] else right
+        self.tree = tree
+
+    @staticmethod
+    def from_weighted_words(words: dict[str, float]) -> "RankedIndex":
+        """
+        Build the index of normalized words with their weight
+        """
+        index = WordIndex.from_words(words)
+        # The index is sorted, so its words are in the order of sorted(words)
+        weights = array("d", (words[word] for word in sorted(words)))
+        return RankedIndex(index, weights)
+
+    def heaviest(self, low: int, high: int) -> int:
+        """
+        Return the position of the heaviest word in [<low>, <high>), which must
+        not be empty
+        """
+        tree, weights = self.tree, self.weights
+        best = -1
+        low += len(self.index)
+        high += len(self.index)
+        while low < high:
+            if low & 1:
+                candidate = tree[low]
+                if (
+                    best < 0
+                    or weights[candidate] > weights[best]
+                    or (weights[candidate] == weights[best] and candidate < best)
+                ):
+                    best = candidate
+                low += 1
+            if high & 1:
+                high -= 1
+                candidate = tree[high]
+                if (
+                    best < 0
+                    or weights[candidate] > weights[best]
+                    or (weights[candidate] == weights[best] and candidate < best)
+                ):
+                    best = candidate
+            low >>= 1
+            high >>= 1
+        return best
+
+    def complete(self, prefix: str, limit: int) -> list[str]:
+        """
+        Return at most <limit> words starting with <prefix>, by decreasing
+        weight. <prefix> must already be normalized.
+        """
+        prefix_bytes = prefix.encode()
+        low, high = self.index.prefix_range(prefix_bytes)
+        low = self.index.lower_bound(prefix_bytes, low, high)
+        # 0xff never appears in UTF-8, so every word starting with <prefix> is
+        # < <prefix> + 0xff
+        high = self.index.lower_bound(prefix_bytes + b"\xff", low, high)
+        if low >= high or limit <= 0:
+            return []
+
+        weights = self.weights
+        best = self.heaviest(low, high)
+        # Ranges of words left to visit, by their heaviest word
+        heap = [(-weights[best], best, low, high)]
+        positions: list[int] = []
+        while heap and len(positions) < limit:
+            _, best, low, high = heappop(heap)
+            positions.append(best)
+            if low < best:
+                left = self.heaviest(low, best)
+                heappush(heap, (-weights[left], left, low, best))
+            if best + 1 < high:
+                right = self.heaviest(best + 1, high)
+                heappush(heap, (-weights[right], right, best + 1, high))
+
+        return [self.index[position].decode() for position in positions]
+
+
+class RankedSearch(Search):
+    """
+    Return the heaviest completions of a prefix, using the weights of the
+    wordlist
+    """
+
+    ranked = True
+    index: RankedIndex
+
+    def load_wordlist(self, wordlist: str) -> None:
+        if is_index_file(wordlist):
+            raise ValueError(
+                f"{wordlist} is a compiled index, which has no weights. "
+                "The ranked algorithm requires a wordlist text file."
+            )
+
+        # Duplicated words keep their highest weight
+        weights: dict[str, float] = {}
+        for word, weight in read_weighted_wordlist(wordlist):
+            if word not in weights or weight > weights[word]:
+                weights[word] = weight
+        self.index = RankedIndex.from_weighted_words(weights)
+
+    def complete_prefix(
+        self, prefix: str, limit: Optional[int] = None, after: Optional[str] = None
+    ) -> list[str]:
+        if after is not None:
+            # Pages would have to resume from a weight, not from a word
+            raise NotImplementedError("Pagination is not supported by ranked search")
+        # Transform prefix in lowercase because search is case insensitive
+        return self.index.complete(
+            prefix.lower(), self.config.limit if limit is None else limit
+        )
+
+    def count_prefix(self, prefix: str) -> int:
+        # Transform prefix in lowercase because search is case insensitive
+        return self.index.index.count(prefix.lower())
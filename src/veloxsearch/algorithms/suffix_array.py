@@ -0,0 +1,27 @@
+from typing import Optional
+from .bisect import BisectSearch
+from ..suffix_array import SuffixArray
+
+
+class SuffixArraySearch(BisectSearch):
+    """
+    Use a suffix array of the words to also find the words containing a
+    substring anywhere, not only at their start
+
+    Prefix completions use the sorted index of <BisectSearch>, which the suffix
+    array is built from.
+    """
+
+    suffix_array: SuffixArray
+
+    def load_wordlist(self, wordlist: str) -> None:
+        super().load_wordlist(wordlist)
+        self.suffix_array = SuffixArray.from_index(self.index)
+
+    def complete_substring(
+        self, substring: str, limit: Optional[int] = None
+    ) -> list[str]:
+        # Transform substring in lowercase because search is case insensitive
+        return self.suffix_array.complete(
+            substring.lower(), self.config.limit if limit is None else limit
+        )
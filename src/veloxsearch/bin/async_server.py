@@ -0,0 +1,278 @@
+import asyncio
+from http import HTTPStatus
+import logging
+import socket
+import threading
+from typing import Optional
+
+from ..metrics import Metrics
+from ..velox import Velox
+from .routes import MAX_BODY_SIZE, Response, handle_request
+
+# Maximum size of the request line and of each header line
+MAX_LINE_SIZE = 64 * 1024
+# Maximum number of headers of a request
+MAX_HEADERS = 100
+
+
+class RequestError(Exception):
+    """
+    Raised when a request can not be read. The connection is answered with
+    <status> and closed.
+    """
+
+    def __init__(self, status: HTTPStatus) -> None:
+        super().__init__(status.phrase)
+        self.status = status
+
+
+class AsyncHTTPServer:
+    """
+    HTTP/1.1 server running on a single asyncio event loop
+
+    Connections are persistent (keep-alive) and pipelined requests are served
+    in order. At most <max_connections> connections are served at the same
+    time: the others are accepted, then closed if no connection frees its
+    slot within <keep_alive_timeout> seconds. Connections are closed as well
+    when they are idle, or when a request is not entirely received, for
+    <keep_alive_timeout> seconds.
+    """
+
+    velox: Velox
+    metrics: Optional[Metrics]
+    socket: socket.socket
+    server_address: tuple[str, int]
+    max_connections: int
+    keep_alive_timeout: float
+
+    def __init__(
+        self,
+        velox: Velox,
+        server_address: tuple[str, int],
+        max_connections: int = 1024,
+        keep_alive_timeout: float = 5,
+        reuse_port: bool = False,
+        metrics: Optional[Metrics] = None,
+    ) -> None:
+        self.velox = velox
+        self.metrics = metrics
+        self.max_connections = max_connections
+        self.keep_alive_timeout = keep_alive_timeout
+
+        # The socket is bound right away, like socketserver does, so that the
+        # listening address is known before serve_forever is called
+        family = socket.AF_INET6 if ":" in server_address[0] else socket.AF_INET
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            # Several processes listen on the same port
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.socket.bind(server_address)
+        self.socket.listen(socket.SOMAXCONN)
+        self.server_address = self.socket.getsockname()[:2]
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop: Optional[asyncio.Event] = None
+        self._started = threading.Event()
+        self._stopped = threading.Event()
+
+    def serve_forever(self) -> None:
+        """
+        Serve requests until shutdown() is called
+        """
+        self._stopped.clear()
+        try:
+            asyncio.run(self._serve())
+        finally:
+            self._stopped.set()
+
+    def shutdown(self) -> None:
+        """
+        Stop serve_forever and wait for it to return. Must be called from
+        another thread.
+        """
+        if not self._started.wait(timeout=5):
+            return
+        loop, stop = self._loop, self._stop
+        if loop is not None and stop is not None and not loop.is_closed():
+            try:
+                loop.call_soon_threadsafe(stop.set)
+            except RuntimeError:
+                # The loop was closed in the meantime
+                pass
+        self._stopped.wait()
+
+    def server_close(self) -> None:
+        """
+        Close the listening socket
+        """
+        self.socket.close()
+
+    async def _serve(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.max_connections)
+        self._connections: set[asyncio.Task[None]] = set()
+
+        # The event loop closes the sockets it serves on, it gets a duplicate
+        # so that the listening socket outlives serve_forever
+        server = await asyncio.start_server(
+            self._accept, sock=self.socket.dup(), limit=MAX_LINE_SIZE
+        )
+        self._started.set()
+        try:
+            await self._stop.wait()
+        finally:
+            self._started.clear()
+            server.close()
+            for task in self._connections:
+                task.cancel()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+
+    async def _accept(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        task = asyncio.current_task()
+        assert task is not None
+        # Responses are written at once, there is no need to delay them
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._connections.add(task)
+        try:
+            try:
+                async with asyncio.timeout(self.keep_alive_timeout):
+                    await self._slots.acquire()
+            except TimeoutError:
+                # Every slot is taken, the client may try again later
+                return
+            try:
+                await self._handle_connection(reader, writer)
+            finally:
+                self._slots.release()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            logging.error("Unexpected error on connection: %s", e)
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        client = writer.get_extra_info("peername")
+        while True:
+            try:
+                # The whole request is read within the timeout, so that a slow
+                # client can not hold its slot forever
+                async with asyncio.timeout(self.keep_alive_timeout):
+                    request_line = await reader.readline()
+                    if not request_line:
+                        # Connection closed by the client
+                        return
+                    method, target, headers, body = await self._read_request(
+                        request_line, reader
+                    )
+            except TimeoutError:
+                return
+            except ValueError:
+                # Request line longer than the stream limit
+                await self._write(
+                    writer, Response(HTTPStatus.REQUEST_URI_TOO_LONG), keep_alive=False
+                )
+                return
+            except RequestError as e:
+                await self._write(writer, Response(e.status), keep_alive=False)
+                return
+
+            keep_alive = headers["connection"] == "keep-alive"
+            response = handle_request(
+                self.velox,
+                method,
+                target,
+                body,
+                client,
+                headers.get("authorization"),
+                self.metrics,
+            )
+            await self._write(writer, response, keep_alive)
+            if not keep_alive:
+                return
+
+    async def _read_request(
+        self, request_line: bytes, reader: asyncio.StreamReader
+    ) -> tuple[str, str, dict[str, str], bytes]:
+        """
+        Read a request following its <request_line>. Return its method, target,
+        headers (names in lowercase) and body. The connection header is set to
+        keep-alive or close.
+        """
+        try:
+            method, target, version = request_line.decode("latin-1").split()
+        except ValueError:
+            raise RequestError(HTTPStatus.BAD_REQUEST)
+
+        if version not in ("HTTP/1.0", "HTTP/1.1"):
+            raise RequestError(HTTPStatus.HTTP_VERSION_NOT_SUPPORTED)
+
+        headers: dict[str, str] = {}
+        while True:
+            try:
+                line = await reader.readline()
+            except ValueError:
+                # Line longer than the stream limit
+                raise RequestError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+            if not line:
+                raise asyncio.IncompleteReadError(line, None)
+            if line in (b"\r\n", b"\n"):
+                break
+            if len(headers) >= MAX_HEADERS:
+                raise RequestError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+            name, sep, value = line.decode("latin-1").partition(":")
+            if not sep:
+                raise RequestError(HTTPStatus.BAD_REQUEST)
+            headers[name.strip().lower()] = value.strip()
+
+        connection = headers.get("connection", "").lower()
+        if version == "HTTP/1.1":
+            keep_alive = connection != "close"
+        else:
+            keep_alive = connection == "keep-alive"
+        headers["connection"] = "keep-alive" if keep_alive else "close"
+
+        if "transfer-encoding" in headers:
+            # Chunked bodies are not supported, clients send small bodies
+            raise RequestError(HTTPStatus.NOT_IMPLEMENTED)
+
+        body = b""
+        if "content-length" in headers:
+            try:
+                length = int(headers["content-length"])
+            except ValueError:
+                raise RequestError(HTTPStatus.BAD_REQUEST)
+            if length < 0:
+                raise RequestError(HTTPStatus.BAD_REQUEST)
+            if length > MAX_BODY_SIZE:
+                raise RequestError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+            body = await reader.readexactly(length)
+        elif method == "POST":
+            raise RequestError(HTTPStatus.LENGTH_REQUIRED)
+
+        return method, target, headers, body
+
+    async def _write(
+        self, writer: asyncio.StreamWriter, response: Response, keep_alive: bool
+    ) -> None:
+        headers = [
+            f"HTTP/1.1 {response.status.value} {response.status.phrase}",
+            f"Content-Length: {len(response.body)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        if response.content_type is not None:
+            headers.append(f"Content-Type: {response.content_type}")
+        headers.extend(f"{name}: {value}" for name, value in response.headers.items())
+        writer.write(
+            "\r\n".join(headers).encode("latin-1") + b"\r\n\r\n" + response.body
+        )
+        await writer.drain()
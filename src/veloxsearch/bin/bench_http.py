@@ -0,0 +1,508 @@
+from collections import Counter
+from dataclasses import dataclass, field, replace
+from http.client import HTTPConnection, HTTPException
+import argparse
+import itertools
+import json
+import logging
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from typing import Optional
+import urllib.parse
+
+from ..config import Config
+from ..index import read_wordlist
+from ..velox import Velox
+
+# Upper bounds of the buckets of the latency histogram, in milliseconds
+HISTOGRAM_BOUNDS = [0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+
+
+class QueryDistribution:
+    """
+    Paths of the requests sent by the load generator clients
+
+    Paths are either drawn at random, with the given weights (uniformly if
+    there are none), or replayed in order, cycling back to the first one once
+    all of them are sent.
+    """
+
+    paths: list[str]
+    # Cumulated weights of <paths>, None if they are drawn uniformly
+    cum_weights: Optional[list[float]]
+    replay: bool
+
+    def __init__(
+        self,
+        paths: list[str],
+        weights: Optional[list[float]] = None,
+        replay: bool = False,
+    ):
+        if not paths:
+            raise ValueError("No query to send")
+
+        self.paths = paths
+        self.cum_weights = None
+        if weights is not None:
+            self.cum_weights = list(itertools.accumulate(weights))
+        self.replay = replay
+        self._cycle = itertools.cycle(paths)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def uniform(paths: list[str]) -> "QueryDistribution":
+        return QueryDistribution(paths)
+
+    @staticmethod
+    def zipf(paths: list[str], exponent: float) -> "QueryDistribution":
+        """
+        Draw the path of rank <i> (from 1) with a probability proportional to
+        1 / <i> ** <exponent>, like the popularity of real queries
+        """
+        return QueryDistribution(
+            paths, [1 / rank**exponent for rank in range(1, len(paths) + 1)]
+        )
+
+    @staticmethod
+    def from_file(path: str, route: str, params: dict[str, str]) -> "QueryDistribution":
+        """
+        Replay the queries of a file, one per line. Lines starting with a
+        slash are sent as is, the others are queries of <route>.
+        """
+        with open(path, errors="replace") as fd:
+            lines = [line.rstrip("\r\n") for line in fd]
+        return QueryDistribution(
+            [
+                line if line.startswith("/") else request_path(route, line, params)
+                for line in lines
+                if line
+            ],
+            replay=True,
+        )
+
+    def next(self, generator: random.Random) -> str:
+        """
+        Return the path of the next request, drawn with <generator>
+        """
+        if self.replay:
+            with self._lock:
+                return next(self._cycle)
+        if self.cum_weights is None:
+            return generator.choice(self.paths)
+        return generator.choices(self.paths, cum_weights=self.cum_weights)[0]
+
+
+def request_path(route: str, query: str, params: dict[str, str]) -> str:
+    """
+    Return the path of the request of <query> to <route>, with the additional
+    query string parameters <params>
+    """
+    return f"{route}?{urllib.parse.urlencode({'query': query, **params})}"
+
+
+def random_prefixes(wordlist: str, count: int, generator: random.Random) -> list[str]:
+    """
+    Return <count> distinct prefixes of 1 to 6 chars of random words of
+    <wordlist> (less if it does not have enough of them), in random order
+    """
+    words = list(read_wordlist(wordlist))
+    prefixes: dict[str, None] = {}
+    # Bounded, for small wordlists
+    for _ in range(count * 10):
+        if len(prefixes) == count or not words:
+            break
+        word = generator.choice(words)
+        prefixes[word[: generator.randint(1, 6)]] = None
+    return list(prefixes)
+
+
+@dataclass
+class LoadResult:
+    # Seconds between the start of the first client and the end of the last one
+    duration: float = 0
+    # Latency of each answered request, in nanoseconds
+    latencies: list[int] = field(default_factory=list)
+    # Number of answers by HTTP status
+    statuses: Counter = field(default_factory=Counter)
+    # Number of failed requests (no answer) by exception name
+    failures: Counter = field(default_factory=Counter)
+
+    @property
+    def requests(self) -> int:
+        return len(self.latencies) + self.failures.total()
+
+    @property
+    def errors(self) -> int:
+        """
+        Number of requests without answer or answered with an error status
+        """
+        return self.failures.total() + sum(
+            count for status, count in self.statuses.items() if status >= 400
+        )
+
+    def latency_percentile(self, percent: int) -> float:
+        """
+        Return the <percent>-th percentile of the latencies, in milliseconds
+        """
+        if not self.latencies:
+            return 0
+        if len(self.latencies) == 1:
+            return self.latencies[0] / 1e6
+        return (
+            statistics.quantiles(self.latencies, n=100, method="inclusive")[percent - 1]
+            / 1e6
+        )
+
+    def histogram(self) -> list[tuple[float, int]]:
+        """
+        Return the number of latencies up to each bound of HISTOGRAM_BOUNDS
+        (and above the last one, with an infinite bound), in milliseconds
+        """
+        counts = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+        for latency in self.latencies:
+            bucket = 0
+            while bucket < len(HISTOGRAM_BOUNDS) and (
+                latency > HISTOGRAM_BOUNDS[bucket] * 1e6
+            ):
+                bucket += 1
+            counts[bucket] += 1
+        return list(zip(HISTOGRAM_BOUNDS + [float("inf")], counts))
+
+    def report(self) -> dict:
+        """
+        Return the summary of the run, as a JSON serializable dict
+        """
+        return {
+            "requests": self.requests,
+            "duration": self.duration,
+            "requests_per_second": (
+                self.requests / self.duration if self.duration else 0
+            ),
+            "errors": self.errors,
+            "error_rate": self.errors / self.requests if self.requests else 0,
+            "statuses": {str(status): count for status, count in self.statuses.items()},
+            "failures": dict(self.failures),
+            "latency_ms": {
+                "p50": self.latency_percentile(50),
+                "p90": self.latency_percentile(90),
+                "p99": self.latency_percentile(99),
+                "max": max(self.latencies, default=0) / 1e6,
+            },
+            "histogram_ms": [
+                [bound if bound != float("inf") else None, count]
+                for bound, count in self.histogram()
+            ],
+        }
+
+
+def run_load(
+    host: str,
+    port: int,
+    distribution: QueryDistribution,
+    clients: int,
+    duration: Optional[float] = None,
+    requests: Optional[int] = None,
+    timeout: float = 10,
+    seed: int = 0,
+) -> LoadResult:
+    """
+    Send requests to the server with <clients> concurrent clients, each one
+    using a persistent connection (reopened when the server closes it), until
+    <duration> seconds have passed or <requests> requests have been sent
+    """
+    if duration is None and requests is None:
+        raise ValueError("Either a duration or a number of requests is required")
+
+    results = [LoadResult() for _ in range(clients)]
+    # Requests left to send by all the clients
+    remaining = itertools.count(requests, -1) if requests is not None else None
+    remaining_lock = threading.Lock()
+    deadline = None
+
+    def client(result: LoadResult, generator: random.Random) -> None:
+        connection = HTTPConnection(host, port, timeout=timeout)
+        while True:
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+            if remaining is not None:
+                with remaining_lock:
+                    if next(remaining) <= 0:
+                        break
+
+            path = distribution.next(generator)
+            start = time.perf_counter_ns()
+            try:
+                connection.request("GET", path)
+                response = connection.getresponse()
+                response.read()
+            except (HTTPException, OSError) as error:
+                result.failures[type(error).__name__] += 1
+                connection.close()
+                continue
+            result.latencies.append(time.perf_counter_ns() - start)
+            result.statuses[response.status] += 1
+        connection.close()
+
+    threads = [
+        threading.Thread(target=client, args=(result, random.Random(seed + number)))
+        for number, result in enumerate(results)
+    ]
+    start = time.perf_counter()
+    if duration is not None:
+        deadline = start + duration
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    total = LoadResult(duration=time.perf_counter() - start)
+    for result in results:
+        total.latencies.extend(result.latencies)
+        total.statuses.update(result.statuses)
+        total.failures.update(result.failures)
+    return total
+
+
+def format_report(report: dict, clients: int) -> str:
+    """
+    Return the human readable summary of a report returned by
+    <LoadResult.report>
+    """
+    latency = report["latency_ms"]
+    lines = [
+        f"Requests:   {report['requests']} in {report['duration']:.2f} s with "
+        f"{clients} client(s), {report['requests_per_second']:.1f} req/s",
+        f"Errors:     {report['errors']} ({report['error_rate']:.2%})",
+        "Statuses:   "
+        + ", ".join(
+            f"{status}: {count}" for status, count in sorted(report["statuses"].items())
+        ),
+    ]
+    if report["failures"]:
+        lines.append(
+            "Failures:   "
+            + ", ".join(
+                f"{name}: {count}" for name, count in report["failures"].items()
+            )
+        )
+    lines.append(
+        f"Latency:    p50 {latency['p50']:.3f} ms, p90 {latency['p90']:.3f} ms, "
+        f"p99 {latency['p99']:.3f} ms, max {latency['max']:.3f} ms"
+    )
+
+    lines.append("Histogram:")
+    answered = sum(count for _, count in report["histogram_ms"])
+    for bound, count in report["histogram_ms"]:
+        if not count:
+            continue
+        label = (
+            f"<= {bound:g} ms"
+            if bound is not None
+            else f"> {HISTOGRAM_BOUNDS[-1]:g} ms"
+        )
+        share = count / answered
+        lines.append(f"  {label:>12} {share:7.2%} {'#' * round(share * 50)}".rstrip())
+    return "\n".join(lines)
+
+
+def port_in_use(host: str, port: int) -> bool:
+    """
+    Return whether a server already accepts connections on <port>
+    """
+    try:
+        socket.create_connection((host, port), timeout=1).close()
+        return True
+    except OSError:
+        return False
+
+
+def wait_for_port(
+    host: str, port: int, timeout: float, process: subprocess.Popen
+) -> None:
+    """
+    Wait until the server started as <process> accepts connections on <port>.
+    Raise RuntimeError if it exits, and TimeoutError if it does not listen
+    within <timeout> seconds.
+    """
+    deadline = time.monotonic() + timeout
+    while not port_in_use(host, port):
+        status = process.poll()
+        if status is not None:
+            raise RuntimeError(f"Server exited with status {status}")
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"Server not listening on {host}:{port}")
+        time.sleep(0.1)
+
+
+def main():
+    """
+    Entrypoint of the HTTP load generator
+    """
+    parser = argparse.ArgumentParser(
+        description="Measure the throughput and latency of a Velox Search server"
+    )
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="Base URL of a running server")
+    target.add_argument(
+        "-c", "--config", help="Start a server with this config file (in toml)"
+    )
+    parser.add_argument(
+        "--in-process",
+        action="store_true",
+        help="Run the started server in a thread of the load generator, on a "
+        "free port, instead of in its own process",
+    )
+    parser.add_argument(
+        "--clients", type=int, default=16, help="Concurrent clients (default: 16)"
+    )
+    stop = parser.add_mutually_exclusive_group()
+    stop.add_argument(
+        "--duration", type=float, help="Seconds to send requests for (default: 10)"
+    )
+    stop.add_argument("--requests", type=int, help="Number of requests to send")
+    parser.add_argument(
+        "--distribution",
+        choices=["uniform", "zipf"],
+        default="zipf",
+        help="Distribution of the prefixes drawn from the wordlist (default: zipf)",
+    )
+    parser.add_argument(
+        "--zipf-exponent",
+        type=float,
+        default=1.1,
+        help="Exponent of the Zipf distribution (default: 1.1)",
+    )
+    parser.add_argument(
+        "--wordlist",
+        help="Wordlist to draw the prefixes from (default: the wordlist of the config)",
+    )
+    parser.add_argument(
+        "--prefixes",
+        type=int,
+        default=10000,
+        help="Distinct prefixes drawn from the wordlist (default: 10000)",
+    )
+    parser.add_argument(
+        "--replay",
+        help="Replay the queries of this file (one per line, or a path starting "
+        "with /) instead of drawing prefixes",
+    )
+    parser.add_argument(
+        "--route", default="/autocomplete", help="Default: /autocomplete"
+    )
+    parser.add_argument(
+        "--param",
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="Additional query string parameter, for instance index=starwars. "
+        "Can be repeated.",
+    )
+    parser.add_argument("--timeout", type=float, default=10, help="Default: 10")
+    parser.add_argument("--seed", type=int, default=0, help="Default: 0")
+    parser.add_argument("--output", help="Also write the report to this JSON file")
+    args = parser.parse_args()
+    if args.duration is None and args.requests is None:
+        args.duration = 10
+
+    logging.basicConfig(level=logging.INFO)
+    params = dict(param.partition("=")[::2] for param in args.param)
+
+    config = None
+    if args.config is not None:
+        config = Config.load(args.config)
+        # The server logs are not part of the measure
+        config = replace(config, logging=replace(config.logging, level="WARNING"))
+
+    if args.replay is not None:
+        distribution = QueryDistribution.from_file(args.replay, args.route, params)
+    else:
+        wordlist = args.wordlist or (config.search.wordlist if config else None)
+        if wordlist is None:
+            parser.error("--wordlist or --replay is required with --url")
+        prefixes = random_prefixes(wordlist, args.prefixes, random.Random(args.seed))
+        paths = [request_path(args.route, prefix, params) for prefix in prefixes]
+        if args.distribution == "zipf":
+            distribution = QueryDistribution.zipf(paths, args.zipf_exponent)
+        else:
+            distribution = QueryDistribution.uniform(paths)
+
+    process = None
+    httpd = None
+    if args.url is not None:
+        url = urllib.parse.urlsplit(args.url)
+        host, port = url.hostname or "127.0.0.1", url.port or 80
+    elif args.in_process:
+        # Imported here, as the server imports the routes and their handlers
+        from .http_server import http_server
+
+        assert config is not None
+        config = replace(config, http_server=replace(config.http_server, listen_port=0))
+        httpd = http_server(config, Velox(config))
+        host, port = httpd.server_address[:2]  # type: ignore[attr-defined]
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    else:
+        assert config is not None
+        host = config.http_server.listen_addr
+        port = config.http_server.listen_port
+        if port_in_use(host, port):
+            # Another server would be measured instead
+            parser.error(f"A server already listens on {host}:{port}")
+        process = subprocess.Popen(
+            [
+                sys.executable,
+                "-c",
+                "from veloxsearch.bin.http_server import main; main()",
+                "--config",
+                args.config,
+                "--log-level",
+                config.logging.level,
+            ]
+        )
+
+    try:
+        if process is not None:
+            logging.info("Waiting for the server to load its index")
+            try:
+                wait_for_port(host, port, 600, process)
+            except (RuntimeError, TimeoutError) as error:
+                parser.exit(1, f"{error}\n")
+
+        logging.info(
+            "Sending %s to %s:%d with %d client(s)",
+            (
+                f"{args.requests} requests"
+                if args.requests is not None
+                else f"requests for {args.duration:g} s"
+            ),
+            host,
+            port,
+            args.clients,
+        )
+        result = run_load(
+            host,
+            port,
+            distribution,
+            args.clients,
+            duration=args.duration,
+            requests=args.requests,
+            timeout=args.timeout,
+            seed=args.seed,
+        )
+    finally:
+        if httpd is not None:
+            httpd.shutdown()
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    report = result.report()
+    print(format_report(report, args.clients))
+    if args.output is not None:
+        with open(args.output, "w") as fd:
+            json.dump(report, fd, indent=2)
@@ -0,0 +1,36 @@
+import argparse
+import logging
+import time
+
+from ..index import build_index
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Register the arguments of the build-index command
+    """
+    parser.add_argument("wordlist", help="Wordlist text file to compile")
+    parser.add_argument("output", help="Path of the index file to write")
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes sorting the wordlist, worth it for wordlists "
+        "of hundreds of MiB (default: 1, in this process)",
+    )
+
+
+def run(args: argparse.Namespace) -> None:
+    """
+    Compile a wordlist into an index file that can be loaded by the `mmap`
+    search algorithm
+    """
+    start = time.perf_counter()
+    index = build_index(args.wordlist, args.output, args.workers)
+    logging.info(
+        "Wrote index of %d words to %s in %.3fs",
+        len(index),
+        args.output,
+        time.perf_counter() - start,
+    )
@@ -1,19 +1,24 @@
 from http import HTTPStatus
 from http.server import (
     BaseHTTPRequestHandler,
-    HTTPServer,
     ThreadingHTTPServer,
 )
 import logging
 import argparse
-import json
+from dataclasses import replace
+import threading
 from socketserver import BaseRequestHandler
-from typing import Any, Callable, Self
+from typing import Any, Callable, Optional, Protocol, Self
 import typing
-import urllib.parse
 
+from ..metrics import Metrics
 from ..velox import Velox
-from ..config import Config
+from ..config import LOG_LEVELS, Config, HttpServerMode, LoggingConfig
+from . import build_index
+from .async_server import AsyncHTTPServer
+from .prefork import PreforkServer
+from .reload import install_reload_triggers
+from .routes import MAX_BODY_SIZE, Response, handle_request, new_metrics
 
 
 class VeloxHTTPRequestHandler(BaseHTTPRequestHandler):
@@ -21,66 +26,54 @@ class VeloxHTTPRequestHandler(BaseHTTPRequestHandler):
         """
         Serve a GET request
         """
-        try:
-            url = urllib.parse.urlparse(self.path)
-        except Exception as e:
-            logging.warning(
-                "Received invalid url from %s: %s. %s",
-                self.client_address,
-                self.path,
-                e,
-            )
-            self.send_response(HTTPStatus.BAD_REQUEST)
-            self.flush_headers()
-            return
-
-        if url.path != "/autocomplete":
-            self.send_response(HTTPStatus.NOT_FOUND)
-            self.flush_headers()
-            return
+        self._handle(b"")
 
+    def do_POST(self):
+        """
+        Serve a POST request
+        """
         try:
-            query_params = urllib.parse.parse_qs(url.query)
-        except Exception as e:
-            logging.warning(
-                "Received invalid query from %s: %s. %s",
-                self.client_address,
-                url.query,
-                e,
-            )
-            self.send_response(HTTPStatus.BAD_REQUEST)
-            self.flush_headers()
+            length = int(self.headers.get("Content-Length", ""))
+        except ValueError:
+            self._send(Response(HTTPStatus.LENGTH_REQUIRED))
             return
 
-        query = query_params.get("query")
-        if query is None or len(query) > 1:
-            # Missing argument
-            self.send_response(HTTPStatus.UNPROCESSABLE_CONTENT)
-            self.flush_headers()
+        if length > MAX_BODY_SIZE:
+            self._send(Response(HTTPStatus.REQUEST_ENTITY_TOO_LARGE))
             return
 
-        prefix = query[0]
-        # self.server is typed as a ThredingHTTPServer, but it is a VeloxHTTPServer
-        velox = typing.cast(VeloxHTTPServer, self.server).velox_instance
-        logging.info("Compute word list for prefix %s", prefix)
-
-        try:
-            words = velox.complete_prefix(prefix)
-        except Exception as e:
-            logging.error("Failed to fetch words with prefix `%s`: %s", prefix, e)
-            self.send_response(HTTPStatus.INTERNAL_SERVER_ERROR)
-            self.flush_headers()
-            return
+        self._handle(self.rfile.read(length))
 
-        self.send_response(HTTPStatus.OK)
-        self.send_header("Content-type", "application/json")
+    def _handle(self, body: bytes) -> None:
+        # self.server is typed as a ThredingHTTPServer, but it is a VeloxHTTPServer
+        server = typing.cast(VeloxHTTPServer, self.server)
+        self._send(
+            handle_request(
+                server.velox_instance,
+                self.command,
+                self.path,
+                body,
+                self.client_address,
+                self.headers.get("Authorization"),
+                server.metrics,
+            )
+        )
+
+    def _send(self, response: Response) -> None:
+        self.send_response(response.status)
+        if response.content_type is not None:
+            self.send_header("Content-type", response.content_type)
+        for name, value in response.headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(response.body)))
         self.end_headers()
-        self.wfile.write(json.dumps(words).encode())
+        self.wfile.write(response.body)
 
 
 class VeloxHTTPServer(ThreadingHTTPServer):
     """
-    This subclass is used to inject <velox_instance> in HTTP server
+    This subclass is used to inject <velox_instance> and <metrics> in HTTP
+    server
     """
 
     def __init__(
@@ -92,23 +85,64 @@ class VeloxHTTPServer(ThreadingHTTPServer):
         ),
         RequestHandlerClass: Callable[[Any, Any, Self], BaseRequestHandler],
         bind_and_activate: bool = True,
+        reuse_port: bool = False,
+        metrics: Optional[Metrics] = None,
     ) -> None:
         self.velox_instance = velox_instance
+        self.metrics = metrics
+        # Several processes listen on the same port
+        self.allow_reuse_port = reuse_port
         super().__init__(server_address, RequestHandlerClass, bind_and_activate)
 
 
-def http_server(config: Config, velox: Velox) -> HTTPServer:
+class Server(Protocol):
     """
-    Instantiates the VeloxSearch HTTP Server
+    Interface shared by the HTTP servers
     """
-    # FIXME: Python http.server is not recommended for production
-    # https://docs.python.org/3/library/http.server.html
-    # Replace it with something else, for example uvicorn
-    return VeloxHTTPServer(
-        velox,
-        (config.http_server.listen_addr, config.http_server.listen_port),
-        VeloxHTTPRequestHandler,
-    )
+
+    def serve_forever(self) -> None: ...
+
+    def shutdown(self) -> None: ...
+
+
+def http_server(
+    config: Config,
+    velox: Velox,
+    reuse_port: bool = False,
+    metrics: Optional[Metrics] = None,
+) -> Server:
+    """
+    Instantiates the VeloxSearch HTTP Server. With <reuse_port>, the listening
+    port can be shared with other processes. Requests are counted in
+    <metrics>, new ones if not provided.
+    """
+    if metrics is None:
+        metrics = new_metrics()
+    address = (config.http_server.listen_addr, config.http_server.listen_port)
+
+    match config.http_server.mode:
+        case HttpServerMode.Asyncio:
+            return AsyncHTTPServer(
+                velox,
+                address,
+                max_connections=config.http_server.max_connections,
+                keep_alive_timeout=config.http_server.keep_alive_timeout,
+                reuse_port=reuse_port,
+                metrics=metrics,
+            )
+        case HttpServerMode.Threaded:
+            # Python http.server is not recommended for production, prefer the
+            # asyncio mode
+            # https://docs.python.org/3/library/http.server.html
+            return VeloxHTTPServer(
+                velox,
+                address,
+                VeloxHTTPRequestHandler,
+                reuse_port=reuse_port,
+                metrics=metrics,
+            )
+        case _:
+            raise NotImplementedError
 
 
 def main():
@@ -117,18 +151,68 @@ def main():
     """
     parser = argparse.ArgumentParser()
     parser.add_argument("-c", "--config", help="Config file (in toml)")
+    parser.add_argument(
+        "--log-level",
+        type=str.upper,
+        choices=LOG_LEVELS,
+        help="Override the logging.level of the config",
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("serve", help="Run the HTTP server (default)")
+    build_index.add_arguments(
+        subparsers.add_parser(
+            "build-index", help="Compile a wordlist into an index file"
+        )
+    )
     args = parser.parse_args()
 
+    if args.command == "build-index":
+        # Building an index does not require any configuration file
+        logging.basicConfig(level=logging.INFO)
+        build_index.run(args)
+        return
+
     config = Config.load(args.config)
+    if args.log_level is not None:
+        config = replace(config, logging=LoggingConfig(level=args.log_level))
 
     logging.basicConfig(level=config.logging.level)
     logging.debug("Loaded configuration: %s", config)
 
     velox = Velox(config)
-
-    httpd = http_server(config, velox)
+    # Created before forking the workers, which share it, with a spare slot
+    # for the rolling restarts (see PreforkServer)
+    workers = config.http_server.workers
+    metrics = new_metrics(workers + 1 if workers > 1 else 1)
+
+    def worker_server(config: Config, velox: Velox, reuse_port: bool) -> Server:
+        if config.http_server.workers == 1:
+            # Several workers are reloaded by their supervisor
+            install_reload_triggers(velox, args.config)
+        if config.http_server.workers > 1 and config.cache.max_entries > 0:
+            # Any worker serves the cache statistics of all of them
+            threading.Thread(
+                target=metrics.publish_cache_forever, args=(velox,), daemon=True
+            ).start()
+        return http_server(config, velox, reuse_port, metrics)
+
+    httpd: Server
+    if config.http_server.workers > 1:
+        # Workers are forked once the index is loaded, to share its memory
+        httpd = PreforkServer(
+            config,
+            velox,
+            config.http_server.workers,
+            worker_server,
+            args.config,
+            metrics,
+        )
+    else:
+        httpd = worker_server(config, velox, False)
     logging.info(
-        "HTTP Server listening on %s:%d",
+        "HTTP Server (%s, %d worker(s)) listening on %s:%d",
+        config.http_server.mode,
+        config.http_server.workers,
         config.http_server.listen_addr,
         config.http_server.listen_port,
     )
@@ -137,3 +221,6 @@ def main():
         httpd.serve_forever()
     except KeyboardInterrupt:
         logging.info("Shutdown HTTP Server")
+
+    if velox.cache is not None and config.http_server.workers == 1:
+        logging.info("Cache statistics: %s", velox.cache.stats())
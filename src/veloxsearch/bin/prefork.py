@@ -0,0 +1,322 @@
+import gc
+import logging
+import os
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from ..config import Config
+from ..metrics import Metrics
+from ..velox import Velox
+from .reload import WordlistWatcher, reload_config
+
+# Workers exiting sooner than this after being started are restarted with a
+# delay, so that a worker failing at startup does not make the supervisor spin
+MIN_WORKER_UPTIME = 1
+# Seconds between two checks of the supervisor for exited workers and reloads
+SUPERVISOR_INTERVAL = 0.1
+# Seconds a new worker is given to listen during a rolling restart
+WORKER_START_TIMEOUT = 10
+
+
+class PreforkServer:
+    """
+    Supervisor of <workers> HTTP server processes
+
+    The index is loaded once by the supervisor, before forking the workers, so
+    that they share its memory: the flat structures (sorted bytes blob, mmapped
+    index file, DAWG arrays) are never written to and stay shared copy-on-write
+    between all the workers. Each worker binds the listening port with
+    SO_REUSEPORT and the kernel balances the connections between them.
+
+    Each worker writes its metrics to a slot of <metrics> of its own, which a
+    restarted worker takes over. <metrics> has a spare slot, for the rolling
+    restarts. Crashed workers are restarted. SIGTERM and SIGINT stop all the
+    workers.
+
+    Only the supervisor reloads the wordlists, on SIGHUP or when they change
+    (search.reload_interval): a worker reloading its own index would hold a
+    private copy of it. Once reloaded, the workers are replaced one at a time
+    by workers forked from the supervisor, sharing the new index. Each new
+    worker listens before the worker it replaces is stopped, so queries are
+    served all along.
+    """
+
+    config: Config
+    velox: Velox
+    workers: int
+    # Started workers by pid, with their start time
+    pids: dict[int, float]
+    # Metrics slot of the started workers, by pid
+    slots: dict[int, int]
+
+    def __init__(
+        self,
+        config: Config,
+        velox: Velox,
+        workers: int,
+        make_server: Callable[[Config, Velox, bool], Any],
+        config_file: Optional[str] = None,
+        metrics: Optional[Metrics] = None,
+    ) -> None:
+        if not hasattr(socket, "SO_REUSEPORT"):
+            raise NotImplementedError("http_server.workers requires SO_REUSEPORT")
+
+        self.config = config
+        self.velox = velox
+        self.workers = workers
+        self.make_server = make_server
+        self.config_file = config_file
+        self.metrics = metrics
+        self.pids = {}
+        self.slots = {}
+        self.stopping = False
+        self.reload_requested = False
+        self.watchers: list[tuple[WordlistWatcher, float]] = []
+
+    def serve_forever(self) -> None:
+        """
+        Start the workers and restart them until shutdown() is called
+        """
+        # Objects allocated so far (the index) are moved out of the reach of
+        # the garbage collector, whose passes would otherwise write to their
+        # pages in every worker and unshare them
+        gc.collect()
+        gc.freeze()
+        self._watch_wordlists()
+
+        previous_handlers = {
+            signum: signal.signal(signum, self._handle_signal)
+            for signum in (signal.SIGTERM, signal.SIGINT)
+        }
+        previous_handlers[signal.SIGHUP] = signal.signal(
+            signal.SIGHUP, self._handle_sighup
+        )
+        try:
+            for _ in range(self.workers):
+                self._spawn_worker()
+
+            while self.pids:
+                if not self.stopping and self._reload():
+                    self._restart_workers()
+                try:
+                    pid, status = os.waitpid(-1, os.WNOHANG)
+                except ChildProcessError:
+                    break
+                if pid == 0:
+                    time.sleep(SUPERVISOR_INTERVAL)
+                    continue
+
+                started = self.pids.pop(pid, None)
+                self._release_slot(pid)
+                if started is None or self.stopping:
+                    continue
+
+                logging.warning(
+                    "Worker %d exited unexpectedly (%s), restarting it",
+                    pid,
+                    _describe_status(status),
+                )
+                if time.monotonic() - started < MIN_WORKER_UPTIME:
+                    time.sleep(MIN_WORKER_UPTIME)
+                if not self.stopping:
+                    self._spawn_worker()
+        finally:
+            self.shutdown()
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+            gc.unfreeze()
+
+    def shutdown(self) -> None:
+        """
+        Stop all the workers and wait for them to exit
+        """
+        self.stopping = True
+        for pid in list(self.pids):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                self.pids.pop(pid)
+
+        while self.pids:
+            try:
+                pid, _ = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            self.pids.pop(pid, None)
+
+    def _handle_signal(self, signum: int, _frame) -> None:
+        logging.info("Received %s, stopping workers", signal.Signals(signum).name)
+        self.stopping = True
+        for pid in self.pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def _handle_sighup(self, _signum: int, _frame) -> None:
+        # Reloaded by the main loop, as the workers are restarted afterwards
+        logging.info("Received SIGHUP, reloading")
+        self.reload_requested = True
+
+    def _watch_wordlists(self) -> None:
+        """
+        Start watching the wordlists of the indexes whose reload_interval is
+        set, with the time of their next check
+        """
+        self.watchers = [
+            (WordlistWatcher(index), time.monotonic())
+            for index in (self.velox, *self.velox.indexes.values())
+            if index.config.search.reload_interval > 0
+        ]
+
+    def _reload(self) -> bool:
+        """
+        Reload the wordlists on SIGHUP, and the changed ones. Return whether a
+        wordlist was reloaded.
+        """
+        reloaded = False
+        if self.reload_requested:
+            self.reload_requested = False
+            reloaded = reload_config(self.velox, self.config_file)
+            if reloaded:
+                # Named indexes may have been added or removed
+                self._watch_wordlists()
+
+        now = time.monotonic()
+        for i, (watcher, next_check) in enumerate(self.watchers):
+            if now >= next_check:
+                reloaded |= watcher.check()
+                interval = watcher.index.config.search.reload_interval
+                self.watchers[i] = (watcher, now + interval)
+        return reloaded
+
+    def _restart_workers(self) -> None:
+        """
+        Replace the workers one at a time by workers sharing the index of the
+        supervisor
+        """
+        # Like the first index, the reloaded one is moved out of the reach of
+        # the garbage collector
+        gc.collect()
+        gc.freeze()
+        for pid in list(self.pids):
+            if self.stopping:
+                return
+            if pid not in self.pids:
+                # Exited in the meantime, already restarted
+                continue
+            if not self._spawn_worker(wait=True):
+                logging.error("New worker failed to start, keeping worker %d", pid)
+                continue
+            # No longer restarted when it exits
+            del self.pids[pid]
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+            self._release_slot(pid)
+        logging.info("Restarted the workers with the reloaded index")
+
+    def _spawn_worker(self, wait: bool = False) -> bool:
+        """
+        Fork a worker. If <wait>, wait until it listens and return whether it
+        does, a worker failing to start being stopped.
+        """
+        # The first slot left by an exited worker
+        slot = min(set(range(self.workers + 1)) - set(self.slots.values()))
+        ready_read, ready_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_read)
+            os._exit(self._run_worker(slot, ready_write))
+
+        os.close(ready_write)
+        logging.info("Started worker %d", pid)
+        self.pids[pid] = time.monotonic()
+        self.slots[pid] = slot
+        try:
+            if not wait:
+                return True
+            # The worker writes a byte once it listens, and closes the pipe
+            # when it exits
+            readable, _, _ = select.select([ready_read], [], [], WORKER_START_TIMEOUT)
+            if readable and os.read(ready_read, 1):
+                return True
+        finally:
+            os.close(ready_read)
+
+        del self.pids[pid]
+        try:
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+        except (ProcessLookupError, ChildProcessError):
+            pass
+        self._release_slot(pid)
+        return False
+
+    def _release_slot(self, pid: int) -> None:
+        """
+        Free the metrics slot of the exited worker <pid>
+        """
+        slot = self.slots.pop(pid, None)
+        if slot is not None and self.metrics is not None:
+            self.metrics.release_slot(slot)
+
+    def _run_worker(self, slot: int, ready: int) -> int:
+        """
+        Body of a worker process, writing to <slot> of the metrics. A byte is
+        written to the pipe <ready> once it listens. Return its exit code.
+        """
+        if self.metrics is not None:
+            self.metrics.select_slot(slot)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, _exit_worker)
+        # Reloads are made by the supervisor
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        # Workers must not outlive the supervisor, even if it is killed
+        threading.Thread(
+            target=_watch_parent, args=(os.getppid(),), daemon=True
+        ).start()
+        try:
+            server = self.make_server(self.config, self.velox, True)
+            try:
+                os.write(ready, b"\x01")
+            except OSError:
+                # Not waited for
+                pass
+            os.close(ready)
+            server.serve_forever()
+        except SystemExit as e:
+            return e.code if isinstance(e.code, int) else 0
+        except Exception as e:
+            logging.error("Worker %d failed: %s", os.getpid(), e)
+            return 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        return 0
+
+
+def _exit_worker(_signum: int, _frame) -> None:
+    raise SystemExit(0)
+
+
+def _watch_parent(ppid: int) -> None:
+    while os.getppid() == ppid:
+        time.sleep(1)
+    logging.warning("Supervisor %d exited, stopping worker %d", ppid, os.getpid())
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+def _describe_status(status: int) -> str:
+    if os.WIFSIGNALED(status):
+        return f"killed by {signal.Signals(os.WTERMSIG(status)).name}"
+    return f"exit code {os.waitstatus_to_exitcode(status)}"
@@ -0,0 +1,97 @@
+import logging
+import os
+import signal
+import threading
+import time
+from typing import Optional
+
+from ..config import Config
+from ..velox import Velox
+
+
+def reload_config(velox: Velox, config_file: Optional[str]) -> bool:
+    """
+    Load the configuration file again and reload the wordlists of all the
+    indexes with its [search] section. Other sections require a restart.
+    Return whether the wordlists were reloaded.
+    """
+    try:
+        config = Config.load(config_file)
+    except Exception as e:
+        logging.error("Failed to reload configuration, keeping the current one: %s", e)
+        return False
+
+    return velox.reload(config.search)
+
+
+class WordlistWatcher:
+    """
+    Reload the wordlist of <index> when its modification time differs from
+    the one of the loaded wordlist. The file must not have changed since the
+    previous check, so that a wordlist being written is not loaded.
+    """
+
+    index: Velox
+    # Modification time of the wordlist at the previous check
+    previous: Optional[int]
+
+    def __init__(self, index: Velox) -> None:
+        self.index = index
+        self.previous = None
+
+    def check(self) -> bool:
+        """
+        Reload the wordlist if it changed, and return whether it was reloaded
+        """
+        wordlist = self.index.config.search.wordlist
+        try:
+            mtime: Optional[int] = os.stat(wordlist).st_mtime_ns
+        except OSError:
+            mtime = None
+
+        previous, self.previous = self.previous, mtime
+        if mtime is None or mtime == self.index.wordlist_mtime or mtime != previous:
+            return False
+
+        logging.info("Wordlist %s changed", wordlist)
+        if not self.index.reload():
+            # Not retried until the file changes again
+            self.index.wordlist_mtime = mtime
+            return False
+        return True
+
+
+def watch_wordlist(velox: Velox, interval: float) -> None:
+    """
+    Check the wordlist of <velox> every <interval> seconds, and reload it
+    when it changed (see <WordlistWatcher>). Never returns.
+    """
+    watcher = WordlistWatcher(velox)
+    while True:
+        time.sleep(interval)
+        watcher.check()
+
+
+def install_reload_triggers(velox: Velox, config_file: Optional[str]) -> None:
+    """
+    Reload the wordlists in a background thread on SIGHUP (with the [search]
+    section of the configuration file) and, for each index whose
+    reload_interval is set, whenever its wordlist file changes. Must be
+    called from the main thread.
+    """
+
+    def handle_sighup(_signum: int, _frame) -> None:
+        logging.info("Received SIGHUP, reloading")
+        threading.Thread(
+            target=reload_config, args=(velox, config_file), daemon=True
+        ).start()
+
+    signal.signal(signal.SIGHUP, handle_sighup)
+
+    for index in (velox, *velox.indexes.values()):
+        # Each index only reloads its own wordlist
+        interval = index.config.search.reload_interval
+        if interval > 0:
+            threading.Thread(
+                target=watch_wordlist, args=(index, interval), daemon=True
+            ).start()
@@ -0,0 +1,447 @@
+from collections import OrderedDict
+from dataclasses import replace
+import argparse
+import json
+import logging
+import math
+import re
+import time
+from typing import Iterator, Optional
+import urllib.parse
+
+from ..cache import LRUCache
+from ..config import Config, SearchAlgorithm
+from ..index import load_index
+from ..velox import Velox
+
+# Start of an access log entry, in the common log format written by the
+# threaded server as well as by most reverse proxies: host, identity, user and
+# date
+ACCESS_LOG_ENTRY = re.compile(r"\S+ \S+ \S+ \[[^\]]*\] ")
+# Request line of an access log entry
+REQUEST_LINE = re.compile(r'"(?:GET|HEAD) (\S+) HTTP/[0-9.]+"')
+# Formats of the query logs, "auto" detecting it from the first line
+LOG_FORMATS = ["auto", "access", "prefixes"]
+
+
+def detect_format(path: str) -> str:
+    """
+    Return "access" if the first non blank line of <path> is an access log
+    entry, "prefixes" otherwise
+    """
+    with open(path, errors="replace") as fd:
+        for line in fd:
+            if line.strip():
+                return "access" if ACCESS_LOG_ENTRY.match(line) else "prefixes"
+    return "prefixes"
+
+
+def iter_queries(
+    path: str, index: Optional[str] = None, log_format: str = "auto"
+) -> Iterator[str]:
+    """
+    Stream the prefixes of the first page completions of <path>, in order.
+
+    <path> is either an access log, whose `/autocomplete` requests of the
+    index <index> (the default index if None) are kept, or a file with one
+    prefix per line, as told by <log_format> (one of LOG_FORMATS). Fuzzy,
+    substring and paginated queries are skipped: their results are never
+    cached. So are the other requests and the lines of an access log that are
+    not requests, such as the errors of malformed requests.
+    """
+    if log_format == "auto":
+        log_format = detect_format(path)
+    with open(path, errors="replace") as fd:
+        for line in fd:
+            if log_format == "prefixes":
+                prefix = line.strip()
+                if prefix:
+                    yield prefix
+                continue
+
+            request = REQUEST_LINE.search(line)
+            if request is None:
+                continue
+            route, _, query = request.group(1).partition("?")
+            if route != "/autocomplete":
+                continue
+            params = urllib.parse.parse_qs(query, keep_blank_values=True)
+            queries = params.get("query", [])
+            if (
+                len(queries) != 1
+                or not queries[0]
+                or params.get("index", [None])[0] != index
+                or params.get("fuzzy", ["0"])[0] != "0"
+                or params.get("mode", ["prefix"])[0] != "prefix"
+                or "cursor" in params
+            ):
+                continue
+            yield queries[0]
+
+
+class LatencyHistogram:
+    """
+    Distribution of latencies, in nanoseconds, in constant memory
+
+    Latencies are rounded down to their 6 most significant bits, so that
+    percentiles are exact to within 1/32 whatever the number of samples.
+    """
+
+    def __init__(self):
+        # Number of latencies by rounded value
+        self.buckets: dict[int, int] = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, latency: int) -> None:
+        shift = max(latency.bit_length() - 6, 0)
+        bucket = latency >> shift << shift
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += latency
+        self.max = max(self.max, latency)
+
+    def percentile(self, percent: float) -> int:
+        """
+        Return the latency below which <percent> % of the latencies are
+        """
+        rank = math.ceil(percent / 100 * self.count)
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return bucket
+        return self.max
+
+    def report(self) -> dict:
+        """
+        Return the summary of the distribution, in milliseconds
+        """
+        return {
+            "queries": self.count,
+            "total": self.total / 1e9,
+            "mean": self.total / self.count / 1e6 if self.count else 0,
+            **{
+                f"p{percent:g}": self.percentile(percent) / 1e6
+                for percent in [50, 90, 99, 99.9]
+            },
+            "max": self.max / 1e6,
+        }
+
+
+class CacheSimulator:
+    """
+    Count the hits of a result cache policy on a sequence of queries, without
+    storing the results
+    """
+
+    name: str
+    # Number of cached results
+    size: int
+
+    def __init__(self):
+        self.hits = 0
+        self.queries = 0
+
+    def access(self, key: str) -> None:
+        self.queries += 1
+        if self._lookup(key):
+            self.hits += 1
+
+    def _lookup(self, key: str) -> bool:
+        """
+        Return whether the result of <key> is cached, then cache it if the
+        policy does
+        """
+        raise NotImplementedError
+
+    def report(self) -> dict:
+        return {
+            "policy": self.name,
+            "size": self.size,
+            "queries": self.queries,
+            "hits": self.hits,
+            "hit_ratio": self.hits / self.queries if self.queries else 0,
+        }
+
+
+class LRUSimulator(CacheSimulator):
+    """
+    The result cache of the server, <LRUCache>, whose LRU order is per shard
+    """
+
+    name = "lru"
+
+    def __init__(self, size: int):
+        super().__init__()
+        self.size = size
+        self.cache: LRUCache[str, bool] = LRUCache(size)
+
+    def _lookup(self, key: str) -> bool:
+        if self.cache.get(key) is not None:
+            return True
+        self.cache.put(key, True)
+        return False
+
+
+class LFUSimulator(CacheSimulator):
+    """
+    Evict the least frequently requested entry, the least recently used one
+    among those of the same frequency. Frequencies are only counted while the
+    entry is cached, so memory is bounded by <size>.
+    """
+
+    name = "lfu"
+
+    def __init__(self, size: int):
+        super().__init__()
+        self.size = size
+        # Number of requests of each cached key
+        self.frequencies: dict[str, int] = {}
+        # Cached keys by frequency, least recently used first
+        self.by_frequency: dict[int, OrderedDict[str, None]] = {}
+        self.min_frequency = 0
+
+    def _lookup(self, key: str) -> bool:
+        frequency = self.frequencies.get(key)
+        if frequency is not None:
+            keys = self.by_frequency[frequency]
+            del keys[key]
+            if not keys:
+                del self.by_frequency[frequency]
+                if self.min_frequency == frequency:
+                    self.min_frequency += 1
+            self.frequencies[key] = frequency + 1
+            self.by_frequency.setdefault(frequency + 1, OrderedDict())[key] = None
+            return True
+
+        if self.size <= 0:
+            return False
+        if len(self.frequencies) >= self.size:
+            keys = self.by_frequency[self.min_frequency]
+            evicted, _ = keys.popitem(last=False)
+            if not keys:
+                del self.by_frequency[self.min_frequency]
+            del self.frequencies[evicted]
+        self.frequencies[key] = 1
+        self.by_frequency.setdefault(1, OrderedDict())[key] = None
+        self.min_frequency = 1
+        return False
+
+
+class PrecomputedSimulator(CacheSimulator):
+    """
+    The precomputed answers of search.precompute_length: every prefix up to
+    <length> chars is a hit, the others are never cached
+    """
+
+    name = "precomputed"
+
+    def __init__(self, length: int, size: int = 0):
+        """
+        <size> is the number of precomputed prefixes, only reported
+        """
+        super().__init__()
+        self.length = length
+        self.size = size
+
+    def _lookup(self, key: str) -> bool:
+        return len(key) <= self.length
+
+    def report(self) -> dict:
+        return {**super().report(), "length": self.length}
+
+
+def count_prefixes(wordlist: str, max_length: int) -> list[int]:
+    """
+    Return the number of distinct prefixes of the words of <wordlist> up to
+    each length from 0 to <max_length>, that is the number of answers
+    precomputed with each search.precompute_length
+    """
+    prefixes: list[set[str]] = [set() for _ in range(max_length + 1)]
+    for word in load_index(wordlist).iter_words():
+        for length in range(min(len(word), max_length) + 1):
+            prefixes[length].add(word[:length])
+    counts = []
+    total = 0
+    for level in prefixes:
+        total += len(level)
+        counts.append(total)
+    return counts
+
+
+def replay(
+    velox: Velox, queries: Iterator[str], max_queries: Optional[int] = None
+) -> LatencyHistogram:
+    """
+    Complete every prefix of <queries> with <velox> and return the
+    distribution of the completion times
+    """
+    histogram = LatencyHistogram()
+    for number, prefix in enumerate(queries):
+        if max_queries is not None and number >= max_queries:
+            break
+        start = time.perf_counter_ns()
+        velox.complete_prefix(prefix)
+        histogram.add(time.perf_counter_ns() - start)
+    return histogram
+
+
+def simulate(
+    simulators: list[CacheSimulator],
+    queries: Iterator[str],
+    max_queries: Optional[int] = None,
+) -> None:
+    """
+    Run every prefix of <queries> through <simulators>. Keys are lowercase,
+    like the ones of the server cache.
+    """
+    for number, prefix in enumerate(queries):
+        if max_queries is not None and number >= max_queries:
+            break
+        key = prefix.lower()
+        for simulator in simulators:
+            simulator.access(key)
+
+
+def format_table(rows: list[list[str]]) -> str:
+    """
+    Return <rows> as a text table, the first one being the header
+    """
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+    return "\n".join(
+        "  ".join(cell.rjust(width) for cell, width in zip(row, widths)).rstrip()
+        for row in rows
+    )
+
+
+def main():
+    """
+    Entrypoint of the query log replay tool
+    """
+    parser = argparse.ArgumentParser(
+        description="Replay a query log against the search algorithms and "
+        "simulate result cache policies, without the HTTP layer"
+    )
+    parser.add_argument(
+        "log",
+        help="Access log, or file with one prefix per line. Read once per "
+        "algorithm plus once for the cache simulation, line by line.",
+    )
+    parser.add_argument("-c", "--config", help="Config file (in toml)")
+    parser.add_argument(
+        "--format",
+        default="auto",
+        choices=LOG_FORMATS,
+        help="Format of the log: access log in the common log format, or one "
+        "prefix per line. Default: detected from the first line.",
+    )
+    parser.add_argument(
+        "-a",
+        "--algorithm",
+        action="append",
+        choices=list(SearchAlgorithm),
+        help="Algorithm to replay the log with. Can be repeated. "
+        "Default: the algorithm of the config.",
+    )
+    parser.add_argument(
+        "--index",
+        help="Replay the queries of this index of the access log, and search "
+        "with its config. Default: the default index.",
+    )
+    parser.add_argument(
+        "--cache-sizes",
+        default="1000,10000,100000",
+        help="Comma separated cache sizes to simulate with the lru and lfu "
+        "policies (default: 1000,10000,100000). Empty to skip them.",
+    )
+    parser.add_argument(
+        "--precompute-lengths",
+        default="1,2,3",
+        help="Comma separated search.precompute_length values to simulate "
+        "(default: 1,2,3). Empty to skip them.",
+    )
+    parser.add_argument("--max-queries", type=int, help="Stop after this many")
+    parser.add_argument("--output", help="Also write the report to this JSON file")
+    args = parser.parse_args()
+
+    config = Config.load(args.config)
+    logging.basicConfig(level=config.logging.level)
+    search_config = config.search
+    if args.index is not None:
+        if args.index not in search_config.indexes:
+            parser.error(f"Unknown index `{args.index}`")
+        search_config = search_config.indexes[args.index]
+    # The engine is measured, not the result cache
+    config = replace(
+        config,
+        search=replace(search_config, indexes={}, reload_interval=0),
+        cache=replace(config.cache, max_entries=0),
+    )
+    cache_sizes = [int(size) for size in args.cache_sizes.split(",") if size]
+    lengths = [int(length) for length in args.precompute_lengths.split(",") if length]
+
+    report: dict = {"algorithms": {}, "caches": []}
+    rows = [["algorithm", "queries", "mean", "p50", "p90", "p99", "p99.9", "max"]]
+    for algorithm in args.algorithm or [search_config.algorithm]:
+        algorithm_config = replace(
+            config, search=replace(config.search, algorithm=SearchAlgorithm(algorithm))
+        )
+        start = time.perf_counter()
+        try:
+            velox = Velox(algorithm_config)
+        except NotImplementedError as error:
+            logging.warning("Skipping %s: %s", algorithm, error)
+            continue
+        logging.info(
+            "Loaded %s in %.1f s, replaying %s",
+            algorithm,
+            time.perf_counter() - start,
+            args.log,
+        )
+
+        latencies = replay(
+            velox, iter_queries(args.log, args.index, args.format), args.max_queries
+        ).report()
+        report["algorithms"][algorithm] = latencies
+        rows.append(
+            [algorithm, str(latencies["queries"])]
+            + [
+                f"{latencies[column]:.3f}"
+                for column in ["mean", "p50", "p90", "p99", "p99.9", "max"]
+            ]
+        )
+        del velox
+    print("Completion time (ms)")
+    print(format_table(rows))
+
+    simulators: list[CacheSimulator] = []
+    for size in cache_sizes:
+        simulators += [LRUSimulator(size), LFUSimulator(size)]
+    if lengths:
+        counts = count_prefixes(config.search.wordlist, max(lengths))
+        simulators += [
+            PrecomputedSimulator(length, counts[length]) for length in lengths
+        ]
+    if simulators:
+        simulate(
+            simulators,
+            iter_queries(args.log, args.index, args.format),
+            args.max_queries,
+        )
+        rows = [["policy", "size", "hit ratio"]]
+        for simulator in simulators:
+            simulation = simulator.report()
+            report["caches"].append(simulation)
+            policy = simulator.name
+            if isinstance(simulator, PrecomputedSimulator):
+                policy += f" (length {simulator.length})"
+            rows.append([policy, str(simulator.size), f"{simulation['hit_ratio']:.2%}"])
+        print()
+        print("Result cache")
+        print(format_table(rows))
+
+    if args.output is not None:
+        with open(args.output, "w") as fd:
+            json.dump(report, fd, indent=2)
@@ -0,0 +1,403 @@
+import base64
+import binascii
+from dataclasses import dataclass, field
+import hmac
+from http import HTTPStatus
+import json
+import logging
+import time
+from typing import Any, Callable, Optional
+import urllib.parse
+
+from ..metrics import Metrics
+from ..velox import Velox
+
+# Maximum size of the body of a POST request
+MAX_BODY_SIZE = 1024 * 1024
+
+# Maximum edit distance of fuzzy completions. The number of words to look at
+# grows very fast with it.
+MAX_FUZZY_DISTANCE = 2
+
+# Values of the mode parameter of /autocomplete: words starting with the query,
+# or containing it anywhere
+COMPLETION_MODES = ("prefix", "substring")
+
+# Path of the metrics, in the Prometheus text format
+METRICS_PATH = "/metrics"
+
+
+@dataclass
+class EngineTime:
+    """
+    Time spent by a request searching an index
+    """
+
+    # In nanoseconds
+    duration: int
+    algorithm: str
+    # Length of the searched prefix, None for several prefixes
+    prefix_length: Optional[int]
+
+
+@dataclass
+class Response:
+    """
+    Response to an HTTP request, independent of the HTTP server serving it
+    """
+
+    status: HTTPStatus
+    body: bytes = b""
+    content_type: Optional[str] = None
+    headers: dict[str, str] = field(default_factory=dict)
+    # Set by the routes searching an index, for the metrics
+    engine: Optional[EngineTime] = None
+
+    @staticmethod
+    def json(data: Any) -> "Response":
+        return Response(HTTPStatus.OK, json.dumps(data).encode(), "application/json")
+
+
+def _encode_cursor(word: str) -> str:
+    """
+    Return the opaque cursor of the page following <word>
+    """
+    return base64.urlsafe_b64encode(word.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> Optional[str]:
+    """
+    Return the last word of the previous page, None for the first page
+    (empty cursor). Raise ValueError if the cursor is invalid.
+    """
+    if not cursor:
+        return None
+    try:
+        # Padding is stripped from cursors
+        return base64.b64decode(
+            cursor + "=" * (-len(cursor) % 4), altchars=b"-_", validate=True
+        ).decode()
+    except (binascii.Error, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor `{cursor}`") from e
+
+
+def autocomplete(velox: Velox, query: str, _body: bytes, client: Any) -> Response:
+    """
+    GET /autocomplete?query=<prefix>[&fuzzy=<max distance>][&cursor=<cursor>]
+    GET /autocomplete?query=<substring>&mode=substring
+
+    Like every route, it also takes an optional index=<name> parameter.
+
+    With a cursor (empty for the first page), the response is an object with
+    the words of the page and the cursor of the next page.
+    """
+    try:
+        # The cursor of the first page is empty
+        query_params = urllib.parse.parse_qs(query, keep_blank_values=True)
+    except Exception as e:
+        logging.warning("Received invalid query from %s: %s. %s", client, query, e)
+        return Response(HTTPStatus.BAD_REQUEST)
+
+    queries = query_params.get("query")
+    if queries is None or len(queries) > 1 or not queries[0]:
+        # Missing argument
+        return Response(HTTPStatus.UNPROCESSABLE_CONTENT)
+
+    fuzzy = query_params.get("fuzzy", ["0"])
+    if len(fuzzy) > 1 or fuzzy[0] not in map(str, range(MAX_FUZZY_DISTANCE + 1)):
+        return Response(HTTPStatus.UNPROCESSABLE_CONTENT)
+    max_distance = int(fuzzy[0])
+
+    modes = query_params.get("mode", [COMPLETION_MODES[0]])
+    if len(modes) > 1 or modes[0] not in COMPLETION_MODES:
+        return Response(HTTPStatus.UNPROCESSABLE_CONTENT)
+    substring = modes[0] == "substring"
+
+    cursors = query_params.get("cursor")
+    if substring and (max_distance > 0 or cursors is not None):
+        # Substring matches are neither fuzzy nor paginated
+        return Response(HTTPStatus.UNPROCESSABLE_CONTENT)
+
+    after = None
+    if cursors is not None:
+        if len(cursors) > 1 or max_distance > 0:
+            # Fuzzy completions are not paginated
+            return Response(HTTPStatus.UNPROCESSABLE_CONTENT)
+        try:
+            after = _decode_cursor(cursors[0])
+        except ValueError as e:
+            logging.warning("Received invalid cursor from %s: %s", client, e)
+            return Response(HTTPStatus.UNPROCESSABLE_CONTENT)
+
+    prefix = queries[0]
+    logging.debug(
+        "Compute word list for %s %s (max distance %d)",
+        modes[0],
+        prefix,
+        max_distance,
+    )
+
+    start = time.perf_counter_ns()
+    try:
+        if substring:
+            words = velox.complete_substring(prefix)
+        elif max_distance > 0:
+            words = velox.complete_fuzzy(prefix, max_distance)
+        else:
+            words = velox.complete_prefix(prefix, after)
+    except NotImplementedError:
+        # The search algorithm does not support substrings, fuzzy completion
+        # or pagination
+        return Response(HTTPStatus.NOT_IMPLEMENTED)
+    except Exception as e:
+        logging.error("Failed to fetch words with prefix `%s`: %s", prefix, e)
+        return Response(HTTPStatus.INTERNAL_SERVER_ERROR)
+    engine = EngineTime(
+        time.perf_counter_ns() - start, velox.config.search.algorithm, len(prefix)
+    )
+
+    if cursors is None:
+        response = Response.json(words)
+    else:
+        # A shorter page is the last one
+        next_cursor = None
+        if words and len(words) == velox.config.search.limit:
+            next_cursor = _encode_cursor(words[-1])
+        response = Response.json({"words": words, "next_cursor": next_cursor})
+    response.engine = engine
+    return response
+
+
+def count(velox: Velox, query: str, _body: bytes, client: Any) -> Response:
+    """
+    GET /count?query=<prefix>
+    """
+    try:
+        query_params = urllib.parse.parse_qs(query)
+    except Exception as e:
+        logging.warning("Received invalid query from %s: %s. %s", client, query, e)
+        return Response(HTTPStatus.BAD_REQUEST)
+
+    queries = query_params.get("query")
+    if queries is None or len(queries) > 1:
+        # Missing argument
+        return Response(HTTPStatus.UNPROCESSABLE_CONTENT)
+
+    prefix = queries[0]
+    logging.debug("Count words for prefix %s", prefix)
+
+    start = time.perf_counter_ns()
+    try:
+        word_count = velox.count_prefix(prefix)
+    except NotImplementedError:
+        return Response(HTTPStatus.NOT_IMPLEMENTED)
+    except Exception as e:
+        logging.error("Failed to count words with prefix `%s`: %s", prefix, e)
+        return Response(HTTPStatus.INTERNAL_SERVER_ERROR)
+
+    response = Response.json({"count": word_count})
+    response.engine = EngineTime(
+        time.perf_counter_ns() - start, velox.config.search.algorithm, len(prefix)
+    )
+    return response
+
+
+def autocomplete_batch(velox: Velox, _query: str, body: bytes, client: Any) -> Response:
+    """
+    POST /autocomplete/batch, with a JSON array of prefixes as body
+    """
+    try:
+        prefixes = json.loads(body)
+    except Exception as e:
+        logging.warning("Received invalid batch body from %s: %s", client, e)
+        return Response(HTTPStatus.BAD_REQUEST)
+
+    if not isinstance(prefixes, list) or not all(
+        isinstance(prefix, str) for prefix in prefixes
+    ):
+        # The body must be an array of prefixes
+        return Response(HTTPStatus.UNPROCESSABLE_CONTENT)
+
+    logging.debug("Compute word lists for %d prefixes", len(prefixes))
+
+    start = time.perf_counter_ns()
+    try:
+        results = velox.complete_prefixes(prefixes)
+    except Exception as e:
+        logging.error("Failed to fetch words for a batch of prefixes: %s", e)
+        return Response(HTTPStatus.INTERNAL_SERVER_ERROR)
+
+    response = Response.json(dict(zip(prefixes, results)))
+    response.engine = EngineTime(
+        time.perf_counter_ns() - start, velox.config.search.algorithm, None
+    )
+    return response
+
+
+def words(velox: Velox, _query: str, body: bytes, client: Any) -> Response:
+    """
+    POST /words, with a JSON object {"add": [<word>, ...], "remove": [...]}
+    as body. Removals are applied after additions.
+    """
+    try:
+        changes = json.loads(body)
+    except Exception as e:
+        logging.warning("Received invalid words body from %s: %s", client, e)
+        return Response(HTTPStatus.BAD_REQUEST)
+
+    if not isinstance(changes, dict) or not set(changes) <= {"add", "remove"}:
+        return Response(HTTPStatus.UNPROCESSABLE_CONTENT)
+
+    added = changes.get("add", [])
+    removed = changes.get("remove", [])
+    for changed in (added, removed):
+        if not isinstance(changed, list) or not all(
+            isinstance(word, str) and word.strip() and "\n" not in word
+            for word in changed
+        ):
+            return Response(HTTPStatus.UNPROCESSABLE_CONTENT)
+
+    logging.info(
+        "Adding %d words and removing %d words for %s",
+        len(added),
+        len(removed),
+        client,
+    )
+    try:
+        for word in added:
+            velox.add_word(word)
+        for word in removed:
+            velox.remove_word(word)
+    except NotImplementedError:
+        return Response(HTTPStatus.NOT_IMPLEMENTED)
+
+    return Response(HTTPStatus.NO_CONTENT)
+
+
+# Route handlers by path and method
+ROUTES: dict[str, dict[str, Callable[[Velox, str, bytes, Any], Response]]] = {
+    "/autocomplete": {"GET": autocomplete},
+    "/autocomplete/batch": {"POST": autocomplete_batch},
+    "/count": {"GET": count},
+    "/words": {"POST": words},
+}
+
+# Paths requiring the writes.token, as a bearer token
+AUTHENTICATED_PATHS = {"/words"}
+
+
+def new_metrics(slots: int = 1) -> Metrics:
+    """
+    Return the metrics of the routes, for <slots> server processes
+    """
+    return Metrics([*ROUTES, METRICS_PATH], slots)
+
+
+def _authenticate(velox: Velox, authorization: Optional[str]) -> Optional[Response]:
+    """
+    Return the error response if <authorization> does not hold the token
+    """
+    token = velox.config.writes.token
+    if not token:
+        # Writes are disabled
+        return Response(HTTPStatus.FORBIDDEN)
+
+    scheme, _, credentials = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(
+        credentials.strip().encode(), token.encode()
+    ):
+        return Response(HTTPStatus.UNAUTHORIZED, headers={"WWW-Authenticate": "Bearer"})
+
+    return None
+
+
+def handle_request(
+    velox: Velox,
+    method: str,
+    target: str,
+    body: bytes,
+    client: Any,
+    authorization: Optional[str] = None,
+    metrics: Optional[Metrics] = None,
+) -> Response:
+    """
+    Route a request to its handler and return the response.
+    <target> is the request target (path and query string), <client> the
+    address of the client, used in logs, and <authorization> the value of the
+    Authorization header. The request is counted in <metrics>, which are
+    served on METRICS_PATH, if provided.
+    """
+    if metrics is None:
+        return _route_request(velox, method, target, body, client, authorization)
+
+    start = time.perf_counter_ns()
+    path = target.partition("?")[0]
+    if path != METRICS_PATH:
+        response = _route_request(velox, method, target, body, client, authorization)
+    elif method != "GET":
+        response = Response(HTTPStatus.METHOD_NOT_ALLOWED)
+    else:
+        response = Response(
+            HTTPStatus.OK,
+            metrics.render(velox).encode(),
+            "text/plain; version=0.0.4; charset=utf-8",
+        )
+
+    engine = response.engine
+    if engine is None:
+        metrics.record(path, response.status, time.perf_counter_ns() - start)
+    else:
+        metrics.record(
+            path,
+            response.status,
+            time.perf_counter_ns() - start,
+            engine.duration,
+            engine.algorithm,
+            engine.prefix_length,
+        )
+    return response
+
+
+def _route_request(
+    velox: Velox,
+    method: str,
+    target: str,
+    body: bytes,
+    client: Any,
+    authorization: Optional[str],
+) -> Response:
+    try:
+        url = urllib.parse.urlparse(target)
+    except Exception as e:
+        logging.warning("Received invalid url from %s: %s. %s", client, target, e)
+        return Response(HTTPStatus.BAD_REQUEST)
+
+    handlers = ROUTES.get(url.path)
+    if handlers is None:
+        return Response(HTTPStatus.NOT_FOUND)
+
+    handler = handlers.get(method)
+    if handler is None:
+        return Response(HTTPStatus.METHOD_NOT_ALLOWED)
+
+    if url.path in AUTHENTICATED_PATHS:
+        error = _authenticate(velox, authorization)
+        if error is not None:
+            return error
+
+    # Every route serves the named index given by the index parameter, or the
+    # index of [search] without it
+    try:
+        names = urllib.parse.parse_qs(url.query).get("index")
+    except Exception as e:
+        logging.warning("Received invalid query from %s: %s. %s", client, url.query, e)
+        return Response(HTTPStatus.BAD_REQUEST)
+    if names is not None:
+        if len(names) > 1:
+            return Response(HTTPStatus.UNPROCESSABLE_CONTENT)
+        try:
+            velox = velox.index(names[0])
+        except KeyError:
+            return Response(HTTPStatus.NOT_FOUND)
+
+    return handler(velox, url.query, body, client)
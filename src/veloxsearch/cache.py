@@ -0,0 +1,135 @@
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+import threading
+import time
+from typing import Generic, Hashable, Optional, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    # Entries removed to make room for new ones
+    evictions: int = 0
+    # Entries removed because their lifetime was over
+    expirations: int = 0
+    # Number of entries currently in the cache
+    entries: int = 0
+
+
+class _Shard(Generic[K, V]):
+    """
+    Part of a LRU cache, protected by its own lock
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        # Values with their expiration date, least recently used first
+        self.entries: OrderedDict[K, tuple[float, V]] = OrderedDict()
+        self.stats = CacheStats()
+
+
+class LRUCache(Generic[K, V]):
+    """
+    Thread-safe cache evicting the least recently used entries.
+
+    The cache is split into shards, each with its own lock and its own LRU
+    order, and a key always goes to the same shard. Concurrent requests on
+    different keys seldom wait for each other, so a single lock does not
+    become a bottleneck.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl: float = 0,
+        shards: int = 16,
+        stats: Optional[CacheStats] = None,
+    ):
+        """
+        <max_entries> is the total number of entries of the cache, <ttl> the
+        lifetime in seconds of an entry (0 for no expiration). The counters of
+        <stats>, the statistics of a cache this one replaces, are carried
+        over.
+        """
+        shards = max(1, min(shards, max_entries))
+        self.ttl = ttl
+        self.previous_stats = replace(stats, entries=0) if stats else CacheStats()
+        self.shards: list[_Shard[K, V]] = [
+            # Distribute <max_entries> among shards
+            _Shard(max_entries // shards + (i < max_entries % shards))
+            for i in range(shards)
+        ]
+
+    def _shard(self, key: K) -> _Shard[K, V]:
+        return self.shards[hash(key) % len(self.shards)]
+
+    def get(self, key: K) -> Optional[V]:
+        """
+        Return the value cached for <key>, or None if there is none
+        """
+        shard = self._shard(key)
+        with shard.lock:
+            entry = shard.entries.get(key)
+            if entry is None:
+                shard.stats.misses += 1
+                return None
+
+            expires_at, value = entry
+            if self.ttl and expires_at <= time.monotonic():
+                del shard.entries[key]
+                shard.stats.expirations += 1
+                shard.stats.misses += 1
+                return None
+
+            shard.entries.move_to_end(key)
+            shard.stats.hits += 1
+            return value
+
+    def put(self, key: K, value: V) -> None:
+        """
+        Cache <value> for <key>, evicting the least recently used entry if
+        needed
+        """
+        expires_at = time.monotonic() + self.ttl if self.ttl else 0
+        shard = self._shard(key)
+        with shard.lock:
+            shard.entries[key] = (expires_at, value)
+            shard.entries.move_to_end(key)
+            if len(shard.entries) > shard.max_entries:
+                shard.entries.popitem(last=False)
+                shard.stats.evictions += 1
+
+    def delete(self, key: K) -> None:
+        """
+        Remove the entry of <key>, if any
+        """
+        shard = self._shard(key)
+        with shard.lock:
+            shard.entries.pop(key, None)
+
+    def clear(self) -> None:
+        """
+        Remove all the entries. Statistics are kept.
+        """
+        for shard in self.shards:
+            with shard.lock:
+                shard.entries.clear()
+
+    def stats(self) -> CacheStats:
+        """
+        Return the statistics of the cache, summed over all shards
+        """
+        stats = replace(self.previous_stats)
+        for shard in self.shards:
+            with shard.lock:
+                stats.hits += shard.stats.hits
+                stats.misses += shard.stats.misses
+                stats.evictions += shard.stats.evictions
+                stats.expirations += shard.stats.expirations
+                stats.entries += len(shard.entries)
+        return stats
@@ -1,11 +1,12 @@
 from abc import abstractmethod
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import StrEnum, auto
 import tomllib
 from typing import Any, Optional, Type
 import sys
 
 DEFAULT_CONFIG_PATH = "/etc/veloxsearch.conf.toml"
+LOG_LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
 
 # TODO: Could be simplified a lot using a library such as pydantic
 
@@ -27,15 +28,13 @@ class LoggingConfig(ConfigLoader):
 
     @staticmethod
     def load(data: dict[str, Any]) -> "LoggingConfig":
-        valid_levels = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
-
         if not isinstance(data.get("level"), str):
             raise ValueError("Missing or invalid value logging.level")
 
         level = data["level"].upper()
-        if not level in valid_levels:
+        if not level in LOG_LEVELS:
             raise ValueError(
-                f"Invalid logging.level `{level}`. Valid levels are: {', '.join(valid_levels)}"
+                f"Invalid logging.level `{level}`. Valid levels are: {', '.join(LOG_LEVELS)}"
             )
 
         return LoggingConfig(level=level)
@@ -45,12 +44,30 @@ class SearchAlgorithm(StrEnum):
     Naive = auto()
     Bisect = auto()
     PrefixTree = auto()
+    Mmap = auto()
+    RadixTree = auto()
+    Dawg = auto()
+    Ranked = auto()
+    SuffixArray = auto()
+    Numpy = auto()
+
+
+class HttpServerMode(StrEnum):
+    Threaded = auto()
+    Asyncio = auto()
 
 
 @dataclass
 class HttpServerConfig(ConfigLoader):
     listen_addr: str
     listen_port: int
+    mode: HttpServerMode = HttpServerMode.Threaded
+    # Maximum number of connections served at the same time (asyncio mode)
+    max_connections: int = 1024
+    # Seconds an idle persistent connection is kept open (asyncio mode)
+    keep_alive_timeout: float = 5
+    # Number of server processes sharing the listening port (1 to disable)
+    workers: int = 1
 
     @staticmethod
     def load(data: dict[str, Any]) -> "HttpServerConfig":
@@ -60,8 +77,38 @@ class HttpServerConfig(ConfigLoader):
         if not isinstance(data.get("listen_port"), int):
             raise ValueError("Missing or invalid value http_server.listen_port")
 
+        mode = data.get("mode", HttpServerMode.Threaded.value)
+        try:
+            mode = HttpServerMode(mode.lower())
+        except:
+            raise ValueError(
+                f"Invalid http_server.mode `{mode}`. Valid modes are: "
+                f"{', '.join((mode.value for mode in HttpServerMode))}"
+            )
+
+        max_connections = data.get("max_connections", 1024)
+        if not isinstance(max_connections, int) or max_connections < 1:
+            raise ValueError("Invalid value http_server.max_connections")
+
+        keep_alive_timeout = data.get("keep_alive_timeout", 5)
+        if (
+            not isinstance(keep_alive_timeout, (int, float))
+            or isinstance(keep_alive_timeout, bool)
+            or keep_alive_timeout <= 0
+        ):
+            raise ValueError("Invalid value http_server.keep_alive_timeout")
+
+        workers = data.get("workers", 1)
+        if not isinstance(workers, int) or workers < 1:
+            raise ValueError("Invalid value http_server.workers")
+
         return HttpServerConfig(
-            listen_addr=data["listen_addr"], listen_port=data["listen_port"]
+            listen_addr=data["listen_addr"],
+            listen_port=data["listen_port"],
+            mode=mode,
+            max_connections=max_connections,
+            keep_alive_timeout=keep_alive_timeout,
+            workers=workers,
         )
 
 
@@ -70,38 +117,133 @@ class SearchConfig(ConfigLoader):
     wordlist: str
     algorithm: SearchAlgorithm
     limit: int
+    # Answers of prefixes up to this length are precomputed (0 to disable)
+    precompute_length: int = 0
+    # Maximum number of words stored in the precomputed answers
+    precompute_max_words: int = 1_000_000
+    # Seconds between checks of the wordlist modification time, to reload it
+    # when it changes (0 to disable)
+    reload_interval: float = 0
+    # Directory of the snapshots of the built prefix trees, loaded instead of
+    # building the tree again when the wordlist is unchanged (empty to disable)
+    snapshot_dir: str = ""
+    # Other indexes served by the same process, by name
+    indexes: dict[str, "SearchConfig"] = field(default_factory=dict)
 
     @staticmethod
     def load(data: dict[str, Any]) -> "SearchConfig":
+        config = SearchConfig._load(data, "search")
+
+        indexes = data.get("indexes", {})
+        if not isinstance(indexes, dict):
+            raise ValueError("Invalid value search.indexes")
+
+        # Named indexes default to the values of [search]
+        defaults = {key: value for key, value in data.items() if key != "indexes"}
+        for name, index_data in indexes.items():
+            section = f"search.indexes.{name}"
+            if not isinstance(index_data, dict) or "indexes" in index_data:
+                raise ValueError(f"Invalid value {section}")
+            config.indexes[name] = SearchConfig._load(defaults | index_data, section)
+
+        return config
+
+    @staticmethod
+    def _load(data: dict[str, Any], section: str) -> "SearchConfig":
+        """
+        Load the config of a single index, from the table <section>
+        """
         if not isinstance(data.get("wordlist"), str):
-            raise ValueError("Missing or invalid value search.wordlist")
+            raise ValueError(f"Missing or invalid value {section}.wordlist")
 
         if not isinstance(data.get("algorithm"), str):
-            raise ValueError("Missing or invalid value search.algorithm")
+            raise ValueError(f"Missing or invalid value {section}.algorithm")
 
         try:
             algorithm = SearchAlgorithm(data["algorithm"].lower())
         except:
             raise ValueError(
-                f"Invalid search.algorithm `{data['algorithm']}`. Valid algorithms are: "
+                f"Invalid {section}.algorithm `{data['algorithm']}`. Valid algorithms are: "
                 f"{', '.join((algorithm.value for algorithm in SearchAlgorithm))}"
             )
 
         if not isinstance(data.get("limit"), int):
-            raise ValueError("Missing or invalid value search.limit")
+            raise ValueError(f"Missing or invalid value {section}.limit")
+
+        precompute_length = data.get("precompute_length", 0)
+        if not isinstance(precompute_length, int) or precompute_length < 0:
+            raise ValueError(f"Invalid value {section}.precompute_length")
+
+        precompute_max_words = data.get("precompute_max_words", 1_000_000)
+        if not isinstance(precompute_max_words, int) or precompute_max_words < 0:
+            raise ValueError(f"Invalid value {section}.precompute_max_words")
+
+        reload_interval = data.get("reload_interval", 0)
+        if not isinstance(reload_interval, (int, float)) or reload_interval < 0:
+            raise ValueError(f"Invalid value {section}.reload_interval")
+
+        snapshot_dir = data.get("snapshot_dir", "")
+        if not isinstance(snapshot_dir, str):
+            raise ValueError(f"Invalid value {section}.snapshot_dir")
 
         return SearchConfig(
             wordlist=data["wordlist"],
             algorithm=SearchAlgorithm(algorithm),
             limit=data["limit"],
+            precompute_length=precompute_length,
+            precompute_max_words=precompute_max_words,
+            reload_interval=reload_interval,
+            snapshot_dir=snapshot_dir,
         )
 
 
+@dataclass
+class CacheConfig(ConfigLoader):
+    # Maximum number of cached results (0 to disable the cache)
+    max_entries: int = 0
+    # Lifetime of a cached result in seconds (0 for no expiration)
+    ttl: float = 0
+
+    @staticmethod
+    def load(data: dict[str, Any]) -> "CacheConfig":
+        max_entries = data.get("max_entries", 0)
+        if not isinstance(max_entries, int) or max_entries < 0:
+            raise ValueError("Invalid value cache.max_entries")
+
+        ttl = data.get("ttl", 0)
+        if not isinstance(ttl, (int, float)) or ttl < 0:
+            raise ValueError("Invalid value cache.ttl")
+
+        return CacheConfig(max_entries=max_entries, ttl=ttl)
+
+
+@dataclass
+class WritesConfig(ConfigLoader):
+    # Token required by the write endpoint (empty to disable writes)
+    token: str = ""
+    # Number of changed words after which a new delta segment is started
+    segment_size: int = 1024
+
+    @staticmethod
+    def load(data: dict[str, Any]) -> "WritesConfig":
+        token = data.get("token", "")
+        if not isinstance(token, str):
+            raise ValueError("Invalid value writes.token")
+
+        segment_size = data.get("segment_size", 1024)
+        if not isinstance(segment_size, int) or segment_size < 1:
+            raise ValueError("Invalid value writes.segment_size")
+
+        return WritesConfig(token=token, segment_size=segment_size)
+
+
 @dataclass
 class Config:
     http_server: HttpServerConfig
     search: SearchConfig
     logging: LoggingConfig
+    cache: CacheConfig = field(default_factory=CacheConfig)
+    writes: WritesConfig = field(default_factory=WritesConfig)
 
     @staticmethod
     def _load_dict(data: dict[str, Any]) -> "Config":
@@ -114,9 +256,18 @@ class Config:
             "logging": LoggingConfig,
         }
 
+        # Sections that can be omitted, in which case default values are used
+        optional_config_sections: dict[str, Type[ConfigLoader]] = {
+            "cache": CacheConfig,
+            "writes": WritesConfig,
+        }
+
         config_dict: dict[str, Any] = {}
-        for name, class_handler in config_sections.items():
+        for name, class_handler in (config_sections | optional_config_sections).items():
             if data.get(name) is None:
+                if name in optional_config_sections:
+                    config_dict[name] = class_handler.load({})
+                    continue
                 raise ValueError(f"Missing section [{name}]")
 
             if not isinstance(data[name], dict):
@@ -124,7 +275,18 @@ class Config:
 
             config_dict[name] = class_handler.load(data[name])
 
-        return Config(**config_dict)
+        config = Config(**config_dict)
+        if config.writes.token and config.http_server.workers > 1:
+            # Each worker would only see its own changes
+            raise ValueError("writes.token can not be set with http_server.workers > 1")
+
+        if config.writes.token and any(
+            search.algorithm == SearchAlgorithm.Ranked
+            for search in (config.search, *config.search.indexes.values())
+        ):
+            raise ValueError("writes.token is not supported by the ranked algorithm")
+
+        return config
 
     @staticmethod
     def _load_file(config_file: str) -> "Config":
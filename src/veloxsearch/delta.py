@@ -0,0 +1,390 @@
+from bisect import bisect_left, bisect_right, insort
+import logging
+import threading
+from typing import Callable, Optional
+
+from .fuzzy import fuzzy_complete_sorted
+from .suffix_array import substring_key
+
+# Greater than any character, used to bisect to the end of a prefix range
+_MAX_CHAR = chr(0x10FFFF)
+
+
+def _prefix_range(
+    words: list[str], prefix: str, after: Optional[str] = None
+) -> tuple[int, int]:
+    """
+    Return the range of the words of the sorted list <words> that start with
+    <prefix>, and are after <after> if provided
+    """
+    start = bisect_left(words, prefix)
+    end = bisect_left(words, prefix + _MAX_CHAR, start)
+    if after is not None:
+        start = min(max(start, bisect_right(words, after)), end)
+    return start, end
+
+
+class Segment:
+    """
+    Immutable set of changes made to the wordlist. Each word is either added
+    or removed (tombstone).
+
+    A segment is never modified once it is shared: changing a word returns a
+    new segment. Queries can thus read segments without any lock.
+    """
+
+    __slots__ = ("entries", "added", "removed")
+
+    # Whether each changed word is present
+    entries: dict[str, bool]
+    # Sorted added words
+    added: list[str]
+    # Sorted removed words
+    removed: list[str]
+
+    def __init__(self, entries: dict[str, bool]) -> None:
+        self.entries = entries
+        self.added = sorted(word for word, present in entries.items() if present)
+        self.removed = sorted(word for word, present in entries.items() if not present)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def with_change(self, word: str, present: bool) -> "Segment":
+        """
+        Return a copy of this segment with <word> added or removed
+        """
+        segment = Segment.__new__(Segment)
+        segment.entries = dict(self.entries)
+        segment.added = list(self.added)
+        segment.removed = list(self.removed)
+
+        previous = segment.entries.get(word)
+        if previous is not None:
+            (segment.added if previous else segment.removed).remove(word)
+        segment.entries[word] = present
+        insort(segment.added if present else segment.removed, word)
+        return segment
+
+
+class DeltaSegments:
+    """
+    Changes made to an immutable index, stored as a log-structured merge of
+    segments
+
+    Changes go to a small active segment. Once it holds <segment_size> words,
+    it is frozen and a new active segment is started. Frozen segments are
+    merged into a single one by a background thread, so that queries only
+    have a few segments to look into. When a word is in several segments, the
+    newest one wins.
+
+    If <contains> tells whether a word is in the index, the merged segment
+    is folded into the index: the changes the index already has (words added
+    to it, or removed from it and never in it) are dropped. So are the ones a
+    new index has, on <rebase>. The changes thus stay bounded by the
+    difference between the index and the changed wordlist.
+
+    Queries merge the segments with the results of the index.
+    """
+
+    segment_size: int
+    # Newest first, the first one is the active segment
+    segments: tuple[Segment, ...]
+    contains: Optional[Callable[[str], bool]]
+
+    def __init__(
+        self,
+        segment_size: int = 1024,
+        contains: Optional[Callable[[str], bool]] = None,
+    ) -> None:
+        self.segment_size = segment_size
+        self.contains = contains
+        self.segments = (Segment({}),)
+        self.lock = threading.Lock()
+        self.compactions = 0
+        # Incremented by <rebase>, compactions folding the changes into a
+        # previous index are dropped
+        self.rebases = 0
+        self._compacting = False
+
+    def __len__(self) -> int:
+        """
+        Number of changes, a word counting once per segment it is in
+        """
+        return sum(len(segment) for segment in self.segments)
+
+    def set(self, word: str, present: bool) -> None:
+        """
+        Add (<present>) or remove <word>
+        """
+        with self.lock:
+            active = self.segments[0].with_change(word, present)
+            if len(active) < self.segment_size:
+                self.segments = (active, *self.segments[1:])
+                return
+
+            self.segments = (Segment({}), active, *self.segments[1:])
+            if len(self.segments) > 2 and not self._compacting:
+                self._compacting = True
+                threading.Thread(target=self._compact, daemon=True).start()
+
+    def _compact(self) -> None:
+        """
+        Merge frozen segments until there is only one left
+        """
+        while True:
+            with self.lock:
+                frozen = self.segments[1:]
+                rebases = self.rebases
+                if len(frozen) < 2:
+                    self._compacting = False
+                    return
+
+            compacted = Segment(self._fold(frozen))
+
+            with self.lock:
+                if self.rebases != rebases:
+                    continue
+                # Segments frozen in the meantime are before <frozen>
+                newer = len(self.segments) - len(frozen)
+                self.segments = (*self.segments[:newer], compacted)
+                self.compactions += 1
+            logging.debug(
+                "Compacted %d segments into %d words", len(frozen), len(compacted)
+            )
+
+    def rebase(self) -> None:
+        """
+        Fold all the changes into the index, once it was replaced by a new
+        one: they are merged into a single segment, without the ones the new
+        index has.
+
+        Must be called with <lock> held, along with the replacement of the
+        index, so that no change is folded into the previous index meanwhile.
+        Writes are blocked while the changes are folded, reloads being rare.
+        """
+        self.rebases += 1
+        if self.contains is not None:
+            self.segments = (Segment(self._fold(self.segments)),)
+
+    def _fold(self, segments: tuple[Segment, ...]) -> dict[str, bool]:
+        """
+        Return the changes of <segments>, the oldest ones, merged together and
+        without the ones the index already has
+        """
+        entries: dict[str, bool] = {}
+        # Newer segments override older ones
+        for segment in reversed(segments):
+            entries.update(segment.entries)
+        contains = self.contains
+        if contains is None:
+            return entries
+        return {
+            word: present
+            for word, present in entries.items()
+            if present != contains(word)
+        }
+
+    def complete(
+        self,
+        prefix: str,
+        limit: int,
+        base: Callable[[str, int, Optional[str]], list[str]],
+        after: Optional[str] = None,
+    ) -> list[str]:
+        """
+        Return at most <limit> words starting with <prefix> in alphabetical
+        order, after <after> if provided, merging the changes with <base>,
+        which returns the words of the index starting with a prefix (and after
+        a word).
+        """
+        segments = self.segments
+        if len(segments) == 1 and not segments[0].entries:
+            return base(prefix, limit, after)
+
+        # Words of the index and of older segments can be hidden by removals,
+        # but not more than the number of removed words with this prefix
+        hidden = 0
+        for segment in segments:
+            start, end = _prefix_range(segment.removed, prefix, after)
+            hidden += end - start
+
+        ranges = [_prefix_range(segment.added, prefix, after) for segment in segments]
+        if not hidden and all(start == end for start, end in ranges):
+            # No change with this prefix
+            return base(prefix, limit, after)
+
+        # Few removed words are usually among the first results, so <count>
+        # words are first taken from each source, and more only if too many
+        # of them are hidden. <limit> + <hidden> words are always enough.
+        count = limit
+        while True:
+            count = min(count, limit + hidden)
+            index_words = base(prefix, count, after)
+            candidates = set(index_words)
+            final = count == limit + hidden
+            # Unless <final>, candidates are only complete up to <bound>, as
+            # no source with more words has been read beyond it
+            bound = None if final or len(index_words) < count else index_words[-1]
+            for segment, (start, end) in zip(segments, ranges):
+                added = segment.added[start : min(end, start + count)]
+                candidates.update(added)
+                if (
+                    not final
+                    and end - start > count
+                    and (bound is None or added[-1] < bound)
+                ):
+                    bound = added[-1]
+
+            words: list[str] = []
+            for word in sorted(candidates):
+                if bound is not None and word > bound:
+                    break
+                if self._present(segments, word):
+                    words.append(word)
+                    if len(words) == limit:
+                        return words
+
+            if bound is None:
+                return words
+            count *= 2
+
+    def count(
+        self, prefix: str, base_count: int, contains: Callable[[str], bool]
+    ) -> int:
+        """
+        Return the number of words starting with <prefix>, <base_count> being
+        the number of words of the index starting with it, and <contains>
+        telling whether a word is in the index.
+        """
+        segments = self.segments
+        if len(segments) == 1 and not segments[0].entries:
+            return base_count
+
+        # Only the newest change of each word counts
+        changes: dict[str, bool] = {}
+        for segment in reversed(segments):
+            for words in (segment.added, segment.removed):
+                start, end = _prefix_range(words, prefix)
+                for word in words[start:end]:
+                    changes[word] = segment.entries[word]
+
+        count = base_count
+        for word, present in changes.items():
+            count += present - contains(word)
+        return count
+
+    def complete_fuzzy(
+        self,
+        prefix: str,
+        max_distance: int,
+        limit: int,
+        base: Callable[[str, int, int], list[tuple[int, str]]],
+    ) -> list[str]:
+        """
+        Return at most <limit> words starting with a prefix at most
+        <max_distance> edits away from <prefix>, sorted by distance then
+        alphabetically, merging the changes with <base>, which returns the
+        (distance, word) pairs of the index.
+        """
+        segments = self.segments
+        if len(segments) == 1 and not segments[0].entries:
+            return [word for _, word in base(prefix, max_distance, limit)]
+
+        # Words of the index and of older segments can be hidden by removals,
+        # but not more than the number of matching removed words
+        hidden = sum(
+            len(
+                fuzzy_complete_sorted(
+                    segment.removed, prefix, max_distance, len(segment.removed)
+                )
+            )
+            for segment in segments
+        )
+
+        # The distance of a word does not depend on where it comes from
+        candidates = {
+            word: distance
+            for distance, word in base(prefix, max_distance, limit + hidden)
+        }
+        for segment in segments:
+            candidates.update(
+                (word, distance)
+                for distance, word in fuzzy_complete_sorted(
+                    segment.added, prefix, max_distance, limit + hidden
+                )
+            )
+
+        words: list[str] = []
+        for word in sorted(candidates, key=lambda word: (candidates[word], word)):
+            if self._present(segments, word):
+                words.append(word)
+                if len(words) == limit:
+                    break
+        return words
+
+    @staticmethod
+    def _present(segments: tuple[Segment, ...], word: str) -> bool:
+        """
+        Return whether <word> of the index or of <segments> is present
+        """
+        # The newest segment containing the word tells whether it is present,
+        # words in no segment come from the index
+        for segment in segments:
+            present = segment.entries.get(word)
+            if present is not None:
+                return present
+        return True
+
+    def complete_substring(
+        self,
+        substring: str,
+        limit: int,
+        base: Callable[[str, int], list[str]],
+    ) -> list[str]:
+        """
+        Return at most <limit> words containing <substring>, in the order of
+        <substring_key>, merging the changes with <base>, which returns the
+        words of the index containing a substring.
+        """
+        segments = self.segments
+        if len(segments) == 1 and not segments[0].entries:
+            return base(substring, limit)
+
+        # Words of the index and of older segments can be hidden by removals,
+        # but not more than the number of matching removed words
+        hidden = sum(
+            sum(1 for word in segment.removed if substring in word)
+            for segment in segments
+        )
+
+        candidates = set(base(substring, limit + hidden))
+        for segment in segments:
+            candidates.update(word for word in segment.added if substring in word)
+
+        words: list[str] = []
+        for word in sorted(
+            candidates, key=lambda word: (substring_key(word, substring), word)
+        ):
+            if self._present(segments, word):
+                words.append(word)
+                if len(words) == limit:
+                    break
+        return words
+
+    def complete_many(
+        self,
+        prefixes: list[str],
+        limit: int,
+        base: Callable[[str, int, Optional[str]], list[str]],
+        base_many: Callable[[list[str]], list[list[str]]],
+    ) -> list[list[str]]:
+        """
+        Same as <complete> for several prefixes. <base_many> returns the words
+        of the index for several prefixes at once, with the default limit.
+        """
+        segments = self.segments
+        if len(segments) == 1 and not segments[0].entries:
+            return base_many(prefixes)
+
+        return [self.complete(prefix, limit, base) for prefix in prefixes]
@@ -0,0 +1,143 @@
+from bisect import bisect_left
+import sys
+from typing import Callable, Iterable, TypeVar
+
+# Node of the tree searched by <fuzzy_complete>
+N = TypeVar("N")
+
+# Greater than any char of a word
+_MAX_CHAR = chr(sys.maxunicode)
+
+
+def fuzzy_complete(
+    prefix: str,
+    max_distance: int,
+    limit: int,
+    root: N,
+    children: Callable[[N], Iterable[tuple[str, N]]],
+    collect: Callable[[N, str, int], list[str]],
+) -> list[tuple[int, str]]:
+    """
+    Return at most <limit> words starting with a prefix at a Levenshtein
+    distance of at most <max_distance> from <prefix>, as (distance, word)
+    pairs sorted by distance then alphabetically. The distance of a word is
+    the smallest distance between <prefix> and one of its prefixes.
+
+    The words are stored in a prefix tree, possibly implicit: <children>
+    returns the (char, child) pairs of a node, and <collect> returns at most
+    <limit> words under a node whose path is given, in alphabetical order.
+
+    Each node gets one row of the edit distance matrix between <prefix> and
+    its path, computed from the row of its parent. Values of a row never
+    decrease further down the tree, so a branch is pruned as soon as all of
+    them exceed <max_distance>. Nodes are visited by increasing minimum of
+    their row: once all the nodes whose minimum is at most <d> are visited,
+    all the words at a distance of at most <d> are found, and the search
+    stops if there are already <limit> of them.
+    """
+    # Nodes to visit, by minimum value of their row
+    pending: list[list[tuple[N, str, tuple[int, ...]]]] = [
+        [] for _ in range(max_distance + 1)
+    ]
+    pending[0].append((root, "", tuple(range(len(prefix) + 1))))
+    # Row of a child by row of its parent and char
+    rows: dict[tuple[tuple[int, ...], str], tuple[tuple[int, ...], int]] = {}
+    # Nodes whose path is at most <max_distance> edits from <prefix>
+    matches: list[tuple[int, str, N]] = []
+    words: list[tuple[int, str]] = []
+    for lowest, stack in enumerate(pending):
+        while stack:
+            node, path, row = stack.pop()
+            distance = row[-1]
+            if distance <= max_distance:
+                matches.append((distance, path, node))
+            if distance == lowest:
+                # Words under this node can not be any closer to <prefix>
+                continue
+
+            for char, child in children(node):
+                # Many nodes share the same row, and the same next char
+                key = (row, char)
+                computed = rows.get(key)
+                if computed is None:
+                    # Insertion, deletion or substitution
+                    left = row[0] + 1
+                    values = [left]
+                    for prefix_char, diagonal, above in zip(prefix, row, row[1:]):
+                        left = min(
+                            left + 1, above + 1, diagonal + (prefix_char != char)
+                        )
+                        values.append(left)
+                    computed = rows[key] = (tuple(values), min(values))
+
+                child_row, child_lowest = computed
+                if child_lowest <= max_distance:
+                    # Never lower than <lowest>
+                    pending[child_lowest].append((child, path + char, child_row))
+
+        words = _collect_matches(
+            [match for match in matches if match[0] <= lowest], limit, collect
+        )
+        if len(words) >= limit:
+            break
+
+    return words
+
+
+def _collect_matches(
+    matches: list[tuple[int, str, N]],
+    limit: int,
+    collect: Callable[[N, str, int], list[str]],
+) -> list[tuple[int, str]]:
+    """
+    Return at most <limit> words under the matching nodes, as (distance, word)
+    pairs sorted by distance then alphabetically
+    """
+    # Words under several matching nodes keep the smallest distance. Matches
+    # of equal distance are either disjoint, or one is under the other and
+    # its words are a subset of the words of the other one, so the words of
+    # each distance come out in alphabetical order.
+    matches.sort(key=lambda match: (match[0], match[1]))
+    words: list[tuple[int, str]] = []
+    seen: set[str] = set()
+    for distance, path, node in matches:
+        if len(words) >= limit:
+            break
+        # At most len(<words>) of them are already seen
+        for word in collect(node, path, limit):
+            if word not in seen:
+                seen.add(word)
+                words.append((distance, word))
+                if len(words) >= limit:
+                    break
+
+    return words
+
+
+def fuzzy_complete_sorted(
+    words: list[str], prefix: str, max_distance: int, limit: int
+) -> list[tuple[int, str]]:
+    """
+    <fuzzy_complete> over a sorted and deduplicated list of words, used as an
+    implicit prefix tree: a node is the range of the words starting with its
+    path.
+    """
+
+    def children(node: tuple[int, int, int]) -> Iterable[tuple[str, tuple]]:
+        low, high, depth = node
+        if low < high and len(words[low]) == depth:
+            # The path of the node itself
+            low += 1
+        while low < high:
+            child = words[low][: depth + 1]
+            end = bisect_left(words, child + _MAX_CHAR, low, high)
+            yield child[-1], (low, end, depth + 1)
+            low = end
+
+    def collect(node: tuple[int, int, int], _path: str, limit: int) -> list[str]:
+        low, high, _depth = node
+        return words[low : min(high, low + limit)]
+
+    return fuzzy_complete(
+        prefix, max_distance, limit, (0, len(words), 0), children, collect
+    )
@@ -0,0 +1,379 @@
+from array import array
+from bisect import bisect_left
+import mmap
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Optional
+
+from .config import SearchAlgorithm
+
+if TYPE_CHECKING:
+    from .velox import Velox
+
+# Upper bounds of the buckets of the latency histograms, in seconds
+LATENCY_BUCKETS = [
+    0.00005,
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+]
+# The same bounds in nanoseconds, as measured
+_LATENCY_BUCKETS_NS = [round(bound * 1e9) for bound in LATENCY_BUCKETS]
+
+# Label of the requests to paths that are not routes
+OTHER_ROUTE = "other"
+STATUS_CLASSES = ["1xx", "2xx", "3xx", "4xx", "5xx"]
+ALGORITHMS = [str(algorithm) for algorithm in SearchAlgorithm]
+_ALGORITHM_INDEXES = {algorithm: i for i, algorithm in enumerate(ALGORITHMS)}
+# Labels of the length of the searched prefix, the last one being for the
+# searches of several prefixes at once
+PREFIX_LENGTHS = ["0", "1", "2", "3", "4", "5", "6+", "none"]
+
+# Counters of the result caches, then the number of cached entries
+CACHE_COUNTERS = ["hits", "misses", "evictions", "expirations"]
+# Seconds between two copies of the cache statistics of a worker to its slot
+CACHE_PUBLISH_INTERVAL = 1
+
+# Counters of a histogram: one per bucket, the +Inf one included, then the sum
+# of the observed values in nanoseconds
+_HISTOGRAM_SIZE = len(LATENCY_BUCKETS) + 2
+
+
+class Metrics:
+    """
+    Request counters and latency histograms of the HTTP server, in the
+    Prometheus text format
+
+    Counters live in an anonymous shared memory mapping made of one slot per
+    process: the mapping is created before the workers are forked, each
+    worker only writes to its own slot (see <select_slot>) and the metrics
+    are the sum of all the slots, so any worker can serve them for the whole
+    server. Within a process, a lock held for a few increments protects the
+    slot from concurrent threads. Reads do not take it: a scrape can see a
+    request counted in a histogram but not yet in its sum.
+    """
+
+    routes: list[str]
+    slots: int
+    # Slot written by this process
+    slot: int
+
+    def __init__(self, routes: list[str], slots: int = 1):
+        self.routes = routes + [OTHER_ROUTE]
+        self.slots = slots
+
+        # Offsets of the counters in a slot, the first one being the pid of
+        # the process writing to it
+        self._cache = 1
+        self._requests = self._cache + len(CACHE_COUNTERS) + 1
+        self._durations = self._requests + len(self.routes) * len(STATUS_CLASSES)
+        self._engine = self._durations + len(self.routes) * _HISTOGRAM_SIZE
+        self.slot_size = self._engine + (
+            len(self.routes) * len(ALGORITHMS) * len(PREFIX_LENGTHS) * _HISTOGRAM_SIZE
+        )
+
+        # Anonymous mappings are shared with the forked processes
+        self._mmap = mmap.mmap(-1, slots * self.slot_size * 8)
+        self._counters = memoryview(self._mmap).cast("Q")
+        self._lock = threading.Lock()
+        self.select_slot(0)
+
+    def select_slot(self, slot: int) -> None:
+        """
+        Write the metrics of this process to <slot>. Must be called by each
+        forked worker, with a slot of its own. The counters of the slot are
+        kept, so that they never decrease when a worker is restarted.
+        """
+        self.slot = slot
+        base = slot * self.slot_size
+        # Absolute offsets of the counters of each route, and of each engine
+        # histogram by route, algorithm and prefix length index, so that
+        # recording a request is a few lookups
+        self._route_offsets = {
+            route: (
+                base + self._requests + i * len(STATUS_CLASSES),
+                base + self._durations + i * _HISTOGRAM_SIZE,
+            )
+            for i, route in enumerate(self.routes)
+        }
+        self._engine_offsets = {
+            (route, algorithm, length_index): base
+            + self._engine
+            + (
+                (i * len(ALGORITHMS) + _ALGORITHM_INDEXES[algorithm])
+                * len(PREFIX_LENGTHS)
+                + length_index
+            )
+            * _HISTOGRAM_SIZE
+            for i, route in enumerate(self.routes)
+            for algorithm in ALGORITHMS
+            for length_index in range(len(PREFIX_LENGTHS))
+        }
+        self._cache_offset = base + self._cache
+        # Cache counters left in the slot by a previous worker, the ones of
+        # this process are added to them
+        self._cache_start = self._counters[
+            self._cache_offset : self._cache_offset + len(CACHE_COUNTERS)
+        ].tolist()
+        # The lock may have been held by another thread when forking
+        self._lock = threading.Lock()
+        self._counters[base] = os.getpid()
+
+    def release_slot(self, slot: int) -> None:
+        """
+        Forget the process of <slot>, which exited. Its counters are kept.
+        """
+        self._counters[slot * self.slot_size] = 0
+
+    def publish_cache(self, velox: "Velox") -> None:
+        """
+        Copy the statistics of the result caches of <velox> and of its named
+        indexes to the slot of this process. The caches are private to each
+        process, so their statistics are copied when the metrics are rendered
+        and, with several workers, periodically (see <publish_cache_forever>)
+        rather than counted on each lookup.
+        """
+        totals = [0] * (len(CACHE_COUNTERS) + 1)
+        for index in [velox, *velox.indexes.values()]:
+            cache = index.cache
+            if cache is not None:
+                stats = cache.stats()
+                for i, name in enumerate([*CACHE_COUNTERS, "entries"]):
+                    totals[i] += getattr(stats, name)
+        for i, start in enumerate(self._cache_start):
+            totals[i] += start
+        self._counters[self._cache_offset : self._cache_offset + len(totals)] = array(
+            "Q", totals
+        )
+
+    def publish_cache_forever(self, velox: "Velox") -> None:
+        """
+        Copy the cache statistics of this process every
+        CACHE_PUBLISH_INTERVAL seconds, so that the metrics rendered by the
+        other workers include them. Never returns.
+        """
+        while True:
+            time.sleep(CACHE_PUBLISH_INTERVAL)
+            self.publish_cache(velox)
+
+    def record(
+        self,
+        route: str,
+        status: int,
+        duration: int,
+        engine_duration: Optional[int] = None,
+        algorithm: Optional[str] = None,
+        prefix_length: Optional[int] = None,
+    ) -> None:
+        """
+        Count a request to <route> answered with <status> in <duration>
+        nanoseconds, <engine_duration> of which were spent searching the
+        index of <algorithm> for a prefix of <prefix_length> chars (None for
+        several prefixes). <algorithm> is required with <engine_duration>.
+        """
+        offsets = self._route_offsets.get(route)
+        if offsets is None:
+            route = OTHER_ROUTE
+            offsets = self._route_offsets[route]
+        requests, durations = offsets
+        # HTTP statuses are 1xx to 5xx
+        status_index = status // 100 - 1
+        bucket = bisect_left(_LATENCY_BUCKETS_NS, duration)
+
+        engine = None
+        engine_time = 0
+        if engine_duration is not None:
+            if algorithm is None:
+                raise ValueError("The algorithm of an engine duration is required")
+            if prefix_length is None:
+                length_index = len(PREFIX_LENGTHS) - 1
+            else:
+                length_index = min(prefix_length, len(PREFIX_LENGTHS) - 2)
+            engine = self._engine_offsets.get((route, algorithm, length_index))
+            engine_time = engine_duration
+            engine_bucket = bisect_left(_LATENCY_BUCKETS_NS, engine_time)
+
+        counters = self._counters
+        with self._lock:
+            counters[requests + status_index] += 1
+            counters[durations + bucket] += 1
+            counters[durations + _HISTOGRAM_SIZE - 1] += duration
+            if engine is not None:
+                counters[engine + engine_bucket] += 1
+                counters[engine + _HISTOGRAM_SIZE - 1] += engine_time
+
+    def _sum(self, offset: int, size: int) -> list[int]:
+        """
+        Return the sum over all the slots of the <size> counters at <offset>
+        """
+        totals = [0] * size
+        for slot in range(self.slots):
+            start = slot * self.slot_size + offset
+            for i, value in enumerate(self._counters[start : start + size]):
+                totals[i] += value
+        return totals
+
+    def render(self, velox: "Velox") -> str:
+        """
+        Return the metrics in the Prometheus text format, with the gauges of
+        the indexes of <velox>
+        """
+        lines: list[str] = []
+
+        lines += [
+            "# HELP velox_requests_total Requests by route and status class. "
+            "Statuses 4xx and 5xx are errors.",
+            "# TYPE velox_requests_total counter",
+        ]
+        requests = self._sum(self._requests, len(self.routes) * len(STATUS_CLASSES))
+        for route_index, route in enumerate(self.routes):
+            for status_index, status in enumerate(STATUS_CLASSES):
+                count = requests[route_index * len(STATUS_CLASSES) + status_index]
+                if count:
+                    lines.append(
+                        f'velox_requests_total{{route="{route}",status="{status}"}} {count}'
+                    )
+
+        lines += [
+            "# HELP velox_request_duration_seconds Time to handle a request, from "
+            "routing to the response",
+            "# TYPE velox_request_duration_seconds histogram",
+        ]
+        durations = self._sum(self._durations, len(self.routes) * _HISTOGRAM_SIZE)
+        for route_index, route in enumerate(self.routes):
+            start = route_index * _HISTOGRAM_SIZE
+            lines += _histogram(
+                "velox_request_duration_seconds",
+                f'route="{route}"',
+                durations[start : start + _HISTOGRAM_SIZE],
+            )
+
+        lines += [
+            "# HELP velox_engine_duration_seconds Time spent searching the index, "
+            "by algorithm and length of the prefix",
+            "# TYPE velox_engine_duration_seconds histogram",
+        ]
+        engine = self._sum(
+            self._engine,
+            len(self.routes) * len(ALGORITHMS) * len(PREFIX_LENGTHS) * _HISTOGRAM_SIZE,
+        )
+        series = 0
+        for route in self.routes:
+            for algorithm in ALGORITHMS:
+                for prefix_length in PREFIX_LENGTHS:
+                    start = series * _HISTOGRAM_SIZE
+                    series += 1
+                    lines += _histogram(
+                        "velox_engine_duration_seconds",
+                        f'route="{route}",algorithm="{algorithm}",'
+                        f'prefix_length="{prefix_length}"',
+                        engine[start : start + _HISTOGRAM_SIZE],
+                    )
+
+        self.publish_cache(velox)
+        cache = self._sum(self._cache, len(CACHE_COUNTERS) + 1)
+        for name, value in zip(CACHE_COUNTERS, cache):
+            lines += [
+                f"# HELP velox_cache_{name}_total Result cache {name}, summed "
+                "over the indexes",
+                f"# TYPE velox_cache_{name}_total counter",
+                f"velox_cache_{name}_total {value}",
+            ]
+        lines += [
+            "# HELP velox_cache_entries Cached results, summed over the indexes",
+            "# TYPE velox_cache_entries gauge",
+            f"velox_cache_entries {cache[-1]}",
+        ]
+
+        lines += _index_gauges(velox)
+
+        lines += [
+            "# HELP velox_process_resident_memory_bytes Resident memory of each "
+            "server process, shared pages included",
+            "# TYPE velox_process_resident_memory_bytes gauge",
+        ]
+        for slot in range(self.slots):
+            rss = resident_memory(self._counters[slot * self.slot_size])
+            if rss is not None:
+                lines.append(
+                    f'velox_process_resident_memory_bytes{{worker="{slot}"}} {rss}'
+                )
+
+        return "\n".join(lines) + "\n"
+
+
+def _histogram(name: str, labels: str, counters: list[int]) -> list[str]:
+    """
+    Return the lines of a histogram series, none if it is empty
+    """
+    count = sum(counters[:-1])
+    if not count:
+        return []
+    lines = []
+    cumulated = 0
+    for bound, bucket_count in zip(LATENCY_BUCKETS + ["+Inf"], counters):
+        cumulated += bucket_count
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulated}')
+    lines.append(f"{name}_sum{{{labels}}} {counters[-1] / 1e9}")
+    lines.append(f"{name}_count{{{labels}}} {count}")
+    return lines
+
+
+def _index_gauges(velox: "Velox") -> list[str]:
+    """
+    Return the size and loading time of the default index of <velox> and of
+    its named indexes
+    """
+    words = [
+        "# HELP velox_index_words Number of words of the index, if the "
+        "algorithm can count them",
+        "# TYPE velox_index_words gauge",
+    ]
+    durations = [
+        "# HELP velox_index_load_duration_seconds Time to load or build the "
+        "index from its wordlist",
+        "# TYPE velox_index_load_duration_seconds gauge",
+    ]
+    for name, index in [("default", velox), *velox.indexes.items()]:
+        labels = f'index="{_escape(name)}",algorithm="{index.config.search.algorithm}"'
+        count = index.count_words()
+        if count is not None:
+            words.append(f"velox_index_words{{{labels}}} {count}")
+        durations.append(
+            f"velox_index_load_duration_seconds{{{labels}}} "
+            f"{index.handler.load_duration}"
+        )
+    return words + durations
+
+
+def _escape(value: str) -> str:
+    """
+    Escape <value> to be used as a label value
+    """
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def resident_memory(pid: int) -> Optional[int]:
+    """
+    Return the resident memory of process <pid> in bytes, None if it is not
+    known (the process exited, or /proc is not available)
+    """
+    if not pid:
+        return None
+    try:
+        with open(f"/proc/{pid}/statm") as fd:
+            return int(fd.read().split()[1]) * mmap.PAGESIZE
+    except (OSError, IndexError, ValueError):
+        return None
@@ -0,0 +1,158 @@
+from array import array
+from bisect import bisect_left
+
+from .index import WordIndex
+
+# Values of the LCP array are capped to fit in a byte. Longer common prefixes
+# are compared again when they matter.
+MAX_LCP = 255
+
+
+def substring_key(word: str, substring: str) -> str:
+    """
+    Return the key giving the order of the words containing <substring> in the
+    results of <SuffixArray.complete>: the smallest of the ends of <word>
+    starting with <substring>, followed by the end of line separating the
+    words of the suffix array. Words of equal key are sorted alphabetically.
+    """
+    ends = []
+    position = word.find(substring)
+    while position >= 0:
+        ends.append(word[position:] + "\n")
+        position = word.find(substring, position + 1)
+    return min(ends)
+
+
+class SuffixArray:
+    """
+    Sorted suffixes of the words of a <WordIndex>, to find the words
+    containing a substring.
+
+    The words are concatenated in a single bytes buffer, each one followed by
+    an end of line. The suffix array holds the position in <text> of every
+    suffix starting a char (not in the middle of a UTF-8 sequence), sorted by
+    the text of the suffix. The suffixes starting with a substring are
+    contiguous, their range is found with a binary search, and the words they
+    belong to are found around them in <text>.
+
+    An end of line only appears at the end of a word, so comparing suffixes up
+    to the end of their word gives the same order as comparing them up to the
+    end of <text>. Suffixes of equal text are in the order of their position,
+    which is the alphabetical order of their words.
+    """
+
+    # Words, each one followed by b"\n"
+    text: bytes
+    # Position in <text> of each suffix, in sorted order
+    suffixes: array
+    # lcp[i] is the length of the common prefix of suffixes i - 1 and i (0 for
+    # the first one), up to MAX_LCP
+    lcp: array
+
+    def __init__(self, text: bytes, suffixes: array, lcp: array):
+        self.text = text
+        self.suffixes = suffixes
+        self.lcp = lcp
+
+    def __len__(self) -> int:
+        return len(self.suffixes)
+
+    @staticmethod
+    def from_index(index: WordIndex) -> "SuffixArray":
+        """
+        Build the suffix array of the words of <index>
+        """
+        text = b"\n".join(index[i] for i in range(len(index))) + b"\n"
+        find = text.find
+
+        # Suffixes are sorted by first byte, then each group on its own: only
+        # the keys of one group are in memory at the same time
+        groups: dict[int, list[int]] = {}
+        for position, byte in enumerate(text):
+            # Skip ends of line and UTF-8 continuation bytes
+            if byte != 10 and not 0x80 <= byte < 0xC0:
+                group = groups.get(byte)
+                if group is None:
+                    group = groups[byte] = []
+                group.append(position)
+
+        suffixes = array("I")
+        lcp = array("B")
+        for first_byte in sorted(groups):
+            positions = groups.pop(first_byte)
+            keys = [
+                text[position : find(b"\n", position) + 1] for position in positions
+            ]
+            # Stable, so equal keys keep the order of their position
+            order = sorted(range(len(keys)), key=keys.__getitem__)
+            suffixes.extend(map(positions.__getitem__, order))
+
+            # Many suffixes are the ending of several words. Otherwise, the
+            # first differing byte is the highest set byte of the XOR of the
+            # keys read as integers, once they are aligned on the shortest one.
+            previous = b""
+            previous_value = 0
+            for key in map(keys.__getitem__, order):
+                if key == previous:
+                    length = len(key)
+                else:
+                    value = int.from_bytes(key)
+                    shift = len(previous) - len(key)
+                    if shift > 0:
+                        difference = (previous_value >> (shift << 3)) ^ value
+                        length = len(key)
+                    else:
+                        difference = previous_value ^ (value >> (-shift << 3))
+                        length = len(previous)
+                    length -= (difference.bit_length() + 7) >> 3
+                    previous = key
+                    previous_value = value
+                lcp.append(min(length, MAX_LCP))
+
+        return SuffixArray(text, suffixes, lcp)
+
+    def complete(self, substring: str, limit: int) -> list[str]:
+        """
+        Return at most <limit> words containing <substring>, sorted by the end
+        of the word starting with it (see <substring_key>). <substring> must
+        already be normalized.
+        """
+        pattern = substring.encode()
+        if b"\n" in pattern or limit <= 0:
+            return []
+        if not pattern:
+            # Every word ends with it, and is sorted alphabetically
+            return [
+                word.decode() for word in self.text.split(b"\n", limit)[:limit] if word
+            ]
+
+        text, suffixes, lcp = self.text, self.suffixes, self.lcp
+        size = len(pattern)
+        low = bisect_left(
+            suffixes, pattern, key=lambda position: text[position : position + size]
+        )
+
+        words: list[str] = []
+        # Start of the words already found
+        seen: set[int] = set()
+        for rank in range(low, len(suffixes)):
+            position = suffixes[rank]
+            if rank == low:
+                if text[position : position + size] != pattern:
+                    break
+            elif lcp[rank] < size and (
+                # The common prefix may be longer than MAX_LCP
+                lcp[rank] < MAX_LCP
+                or text[position : position + size] != pattern
+            ):
+                # The suffixes starting with <pattern> are all before it
+                break
+
+            start = text.rfind(b"\n", 0, position) + 1
+            if start not in seen:
+                seen.add(start)
+                words.append(text[start : text.find(b"\n", position)].decode())
+                if len(words) == limit:
+                    break
+
+        return words
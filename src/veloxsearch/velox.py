@@ -1,8 +1,27 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import replace
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from typing import Optional
+
 from .algorithms import Search
 from .algorithms.bisect import BisectSearch
+from .algorithms.dawg import DawgSearch
+from .algorithms.mmap import MmapSearch
 from .algorithms.naive import NaiveSearch
+from .algorithms.numpy import NumpySearch
+from .algorithms.precomputed import PrecomputedSearch
 from .algorithms.prefix_tree import PrefixTreeSearch
-from .config import Config, SearchAlgorithm
+from .algorithms.radix_tree import RadixTreeSearch
+from .algorithms.ranked import RankedSearch
+from .algorithms.suffix_array import SuffixArraySearch
+from .cache import LRUCache
+from .config import Config, SearchAlgorithm, SearchConfig
+from .delta import DeltaSegments
+from .metrics import resident_memory
 
 
 class Velox:
@@ -16,24 +35,462 @@ class Velox:
     config: Config
     loaded: bool
     handler: Search
+    # Results by normalized prefix, if enabled
+    cache: Optional[LRUCache[str, tuple[str, ...]]]
+    # Modification time of the wordlist file when it was loaded
+    wordlist_mtime: Optional[int]
+    # Words added and removed since the wordlist was loaded. They are kept
+    # when the wordlist is reloaded.
+    delta: DeltaSegments
+    # Named indexes (search.indexes), by name
+    indexes: dict[str, "Velox"]
 
-    def __init__(self, config: Config) -> None:
+    def __init__(self, config: Config, handler: Optional[Search] = None) -> None:
+        """
+        Load the index of <config> and its named indexes, unless the already
+        loaded <handler> is provided
+        """
         self.config = config
+        self.indexes = {}
+        self.wordlist_mtime = _mtime(config.search.wordlist)
+        if handler is None:
+            handler, self.indexes = self._load_indexes(config.search)
+        self.handler = handler
+        self._reload_lock = threading.Lock()
+        self.delta = DeltaSegments(config.writes.segment_size, self._index_contains)
+        self._write_lock = threading.Lock()
+        # Incremented by each write, results computed while it changes are
+        # not cached
+        self._generation = 0
+        # Handler and generation of the last count of <count_words>, and the
+        # count (None if the algorithm can not count)
+        self._word_count: Optional[tuple[Search, int, Optional[int]]] = None
 
-        match config.search.algorithm:
+        self.cache = None
+        if config.cache.max_entries > 0:
+            self.cache = LRUCache(config.cache.max_entries, config.cache.ttl)
+
+    @staticmethod
+    def _load_handler(config: SearchConfig) -> Search:
+        """
+        Instantiate the configured search class and load the wordlist
+        """
+        handler: Search
+        match config.algorithm:
             case SearchAlgorithm.Naive:
-                self.handler = NaiveSearch(config.search)
+                handler = NaiveSearch(config)
             case SearchAlgorithm.Bisect:
-                self.handler = BisectSearch(config.search)
+                handler = BisectSearch(config)
             case SearchAlgorithm.PrefixTree:
-                self.handler = PrefixTreeSearch(config.search)
+                handler = PrefixTreeSearch(config)
+            case SearchAlgorithm.Mmap:
+                handler = MmapSearch(config)
+            case SearchAlgorithm.RadixTree:
+                handler = RadixTreeSearch(config)
+            case SearchAlgorithm.Dawg:
+                handler = DawgSearch(config)
+            case SearchAlgorithm.Ranked:
+                handler = RankedSearch(config)
+            case SearchAlgorithm.SuffixArray:
+                handler = SuffixArraySearch(config)
+            case SearchAlgorithm.Numpy:
+                handler = NumpySearch(config)
             case _:
                 raise NotImplementedError
 
-        self.handler.load_wordlist(config.search.wordlist)
+        if config.precompute_length > 0 and handler.ranked:
+            # Precomputed answers are alphabetical, and the cost of a ranked
+            # search does not depend on the length of the prefix anyway
+            logging.warning("search.precompute_length is ignored by ranked search")
+        elif config.precompute_length > 0:
+            handler = PrecomputedSearch(config, handler)
+
+        start = time.perf_counter()
+        handler.load_wordlist(config.wordlist)
+        handler.load_duration = time.perf_counter() - start
+        return handler
+
+    def _load_indexes(
+        self, search_config: SearchConfig
+    ) -> tuple[Search, dict[str, "Velox"]]:
+        """
+        Load the handler of <search_config> and its named indexes. Named
+        indexes that already exist get their new handler, and keep their
+        changes.
+        """
+        configs = [search_config, *search_config.indexes.values()]
+        # Taken before loading, so that changes made during the load are
+        # noticed
+        mtimes = [_mtime(config.wordlist) for config in configs]
+        handler, *handlers = load_handlers(configs)
+
+        indexes: dict[str, Velox] = {}
+        for (name, index_config), index_handler, mtime in zip(
+            search_config.indexes.items(), handlers, mtimes[1:]
+        ):
+            index = self.indexes.get(name)
+            if index is None:
+                index = Velox(replace(self.config, search=index_config), index_handler)
+            else:
+                index._replace_handler(index_handler, index_config)
+            index.wordlist_mtime = mtime
+            indexes[name] = index
+        return handler, indexes
+
+    def index(self, name: Optional[str]) -> "Velox":
+        """
+        Return the named index <name>, or this one if <name> is None. Raise
+        KeyError if there is no such index.
+        """
+        if name is None:
+            return self
+        return self.indexes[name]
+
+    def reload(self, search_config: Optional[SearchConfig] = None) -> bool:
+        """
+        Load the wordlist again and replace the current one. Queries keep
+        being served by the current wordlist while the new one is loaded.
+        Return False if the new wordlist could not be loaded (the current one
+        is kept) or if a reload is already in progress.
 
-    def complete_prefix(self, prefix: str) -> list[str]:
+        If <search_config> is provided, the named indexes are reloaded as well,
+        with the configs of its search.indexes. Otherwise, only this index is.
         """
-        Return a list of words matching the provided prefix
+        if not self._reload_lock.acquire(blocking=False):
+            logging.warning("A reload is already in progress")
+            return False
+
+        try:
+            start = time.perf_counter()
+            rss_before = resident_memory(os.getpid())
+            reload_indexes = search_config is not None
+            if search_config is None:
+                search_config = self.config.search
+            # Taken before loading, so that changes made during the load are
+            # noticed
+            mtime = _mtime(search_config.wordlist)
+            try:
+                if reload_indexes:
+                    handler, indexes = self._load_indexes(search_config)
+                else:
+                    handler = Velox._load_handler(search_config)
+                    indexes = self.indexes
+            except Exception as e:
+                logging.error(
+                    "Failed to reload wordlist %s, keeping the current one: %s",
+                    search_config.wordlist,
+                    e,
+                )
+                return False
+
+            self._replace_handler(handler, search_config)
+            self.indexes = indexes
+            self.wordlist_mtime = mtime
+
+            duration = time.perf_counter() - start
+            rss_after = resident_memory(os.getpid())
+            if rss_before is not None and rss_after is not None:
+                logging.info(
+                    "Reloaded wordlist %s in %.2fs (resident memory %d MiB "
+                    "before, %d MiB after)",
+                    search_config.wordlist,
+                    duration,
+                    rss_before >> 20,
+                    rss_after >> 20,
+                )
+            else:
+                logging.info(
+                    "Reloaded wordlist %s in %.2fs", search_config.wordlist, duration
+                )
+            return True
+        finally:
+            self._reload_lock.release()
+
+    def _replace_handler(self, handler: Search, search_config: SearchConfig) -> None:
         """
-        return self.handler.complete_prefix(prefix)
+        Serve the queries with <handler>, loaded with <search_config>
+        """
+        # The config and the handler are replaced before the cache, while
+        # queries read the cache first, then the handler and the limit of the
+        # config. A query that sees the new cache thus also sees the new
+        # handler and limit, so old results can not be cached in the new
+        # cache. A query that sees the old cache may mix the old and new
+        # handler and limit, but only caches its results in the old cache,
+        # which is dropped.
+        self.config = replace(self.config, search=search_config)
+        with self.delta.lock:
+            self.handler = handler
+            # The changes the new wordlist has are dropped, the results are
+            # the same
+            self.delta.rebase()
+        if self.cache is not None:
+            # The statistics are those of the index, whatever its wordlist
+            self.cache = LRUCache(
+                self.config.cache.max_entries,
+                self.config.cache.ttl,
+                stats=self.cache.stats(),
+            )
+
+    def complete_prefix(self, prefix: str, after: Optional[str] = None) -> list[str]:
+        """
+        Return a list of words matching the provided prefix. If <after> is
+        provided, return the next page of words, starting after this word.
+        """
+        # The cache is read before the handler and the config (see
+        # _replace_handler)
+        cache = self.cache
+        handler = self.handler
+        # Handlers can be shared by indexes of different limits
+        limit = self.config.search.limit
+        generation = self._generation
+        if cache is None or after is not None:
+            # Only first pages are cached
+            return self.delta.complete(
+                prefix.lower(),
+                limit,
+                handler.complete_prefix,
+                None if after is None else after.lower(),
+            )
+
+        # Search is case insensitive, so are cache keys
+        key = prefix.lower()
+        words = cache.get(key)
+        if words is None:
+            words = tuple(self.delta.complete(key, limit, handler.complete_prefix))
+            # Writes change the generation then delete the changed results
+            # under the lock, so results computed before a write can not be
+            # cached after it
+            with self._write_lock:
+                if generation == self._generation:
+                    cache.put(key, words)
+
+        # Cached results are immutable, callers get their own list
+        return list(words)
+
+    def count_prefix(self, prefix: str) -> int:
+        """
+        Return the number of words matching the provided prefix. Raise
+        NotImplementedError if the search algorithm does not support it.
+        """
+        handler = self.handler
+        key = prefix.lower()
+        return self.delta.count(
+            key,
+            handler.count_prefix(key),
+            lambda word: _contains(handler, word),
+        )
+
+    def count_words(self) -> Optional[int]:
+        """
+        Return the number of words of the index, None if the search algorithm
+        can not count them. Counting is a full scan for some algorithms, so
+        the count is kept until the next write or reload.
+        """
+        handler, generation = self.handler, self._generation
+        word_count = self._word_count
+        if word_count is None or word_count[:2] != (handler, generation):
+            try:
+                count: Optional[int] = self.count_prefix("")
+            except NotImplementedError:
+                count = None
+            word_count = self._word_count = (handler, generation, count)
+        return word_count[2]
+
+    def complete_fuzzy(self, prefix: str, max_distance: int) -> list[str]:
+        """
+        Return a list of words starting with a prefix at most <max_distance>
+        edits (insertions, deletions or substitutions) away from the provided
+        prefix, closest first. Raise NotImplementedError if the search
+        algorithm does not support it.
+        """
+        # Fuzzy queries are mostly typos, which seldom repeat, so they are not
+        # cached. Unlike exact results, a write could change the results of
+        # any of them.
+        handler = self.handler
+        limit = self.config.search.limit
+        return self.delta.complete_fuzzy(
+            prefix.lower(), max_distance, limit, handler.complete_fuzzy
+        )
+
+    def complete_substring(self, substring: str) -> list[str]:
+        """
+        Return a list of words containing the provided substring anywhere.
+        Raise NotImplementedError if the search algorithm does not support it.
+        """
+        # Not cached, like fuzzy queries: a write could change the results of
+        # any of them
+        handler = self.handler
+        limit = self.config.search.limit
+        return self.delta.complete_substring(
+            substring.lower(), limit, handler.complete_substring
+        )
+
+    def complete_prefixes(self, prefixes: list[str]) -> list[list[str]]:
+        """
+        Return the list of words matching each of the provided prefixes, in the
+        same order
+        """
+        # Search is case insensitive, so each distinct lowercase prefix is only
+        # completed once
+        keys = [prefix.lower() for prefix in prefixes]
+        words_by_key: dict[str, tuple[str, ...]] = {}
+
+        # The cache is read before the handler and the config (see
+        # _replace_handler)
+        cache = self.cache
+        handler = self.handler
+        # Handlers can be shared by indexes of different limits
+        limit = self.config.search.limit
+        generation = self._generation
+
+        missing = list(dict.fromkeys(keys))
+        if cache is not None:
+            for key in missing:
+                words = cache.get(key)
+                if words is not None:
+                    words_by_key[key] = words
+            missing = [key for key in missing if key not in words_by_key]
+
+        results = self.delta.complete_many(
+            missing,
+            limit,
+            handler.complete_prefix,
+            lambda prefixes: handler.complete_prefixes(prefixes, limit),
+        )
+        for key, words_list in zip(missing, results):
+            words_by_key[key] = tuple(words_list)
+        if cache is not None:
+            # See complete_prefix
+            with self._write_lock:
+                if generation == self._generation:
+                    for key in missing:
+                        cache.put(key, words_by_key[key])
+
+        # Each result is a distinct list, even for identical prefixes
+        return [list(words_by_key[key]) for key in keys]
+
+    def add_word(self, word: str) -> None:
+        """
+        Add <word> to the wordlist
+        """
+        self._write(word, True)
+
+    def remove_word(self, word: str) -> None:
+        """
+        Remove <word> from the wordlist
+        """
+        self._write(word, False)
+
+    def _write(self, word: str, present: bool) -> None:
+        # Words are normalized like the wordlist
+        word = word.strip().lower()
+        if not word or "\n" in word:
+            raise ValueError(f"Invalid word `{word}`")
+
+        if self.handler.ranked:
+            # Changes are merged alphabetically with the results
+            raise NotImplementedError("Live changes are not supported by ranked search")
+
+        with self._write_lock:
+            self.delta.set(word, present)
+            self._generation += 1
+            cache = self.cache
+            if cache is not None:
+                # Only the results of the prefixes of <word> change
+                for length in range(len(word) + 1):
+                    cache.delete(word[:length])
+
+    def _index_contains(self, word: str) -> bool:
+        """
+        Return whether <word> is in the current index, changes excluded
+        """
+        return _contains(self.handler, word)
+
+
+# Algorithms whose handlers are loaded by the server rather than by the pool of
+# <load_handlers>. A memory mapped index file can not be sent back by another
+# process, and is loaded at once anyway. A prefix tree is a graph of objects
+# that takes almost as long to unpickle as to build (1.5 s against 2.3 s for
+# data/french.txt), and would be held twice in memory while it is sent back.
+_SEQUENTIAL_ALGORITHMS = {SearchAlgorithm.Mmap, SearchAlgorithm.PrefixTree}
+
+
+def load_handlers(configs: list[SearchConfig]) -> list[Search]:
+    """
+    Load the handler of each of <configs>. Configs loading the same wordlist
+    the same way share a single handler, whatever their limit unless they
+    precompute answers. Handlers are loaded in parallel, by a pool of
+    processes, so that the loading time is the one of the slowest handler
+    rather than the sum of all of them.
+    """
+    keys = [_handler_key(config) for config in configs]
+    # The first config of each distinct handler
+    distinct: dict[tuple, SearchConfig] = {}
+    for key, config in zip(keys, configs):
+        distinct.setdefault(key, config)
+
+    parallel = {
+        key: config
+        for key, config in distinct.items()
+        if config.algorithm not in _SEQUENTIAL_ALGORITHMS
+    }
+    workers = min(len(parallel), os.cpu_count() or 1)
+    if workers < 2:
+        parallel = {}
+
+    pool = None
+    futures: dict[tuple, Future[Search]] = {}
+    if parallel:
+        # Spawned rather than forked, as the server may already run threads.
+        # The main module must thus be importable without side effects.
+        pool = ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context("spawn")
+        )
+        futures = {
+            key: pool.submit(Velox._load_handler, config)
+            for key, config in parallel.items()
+        }
+
+    try:
+        handlers = {
+            key: Velox._load_handler(config)
+            for key, config in distinct.items()
+            if key not in parallel
+        }
+        for key, future in futures.items():
+            handlers[key] = future.result()
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    return [handlers[key] for key in keys]
+
+
+def _handler_key(config: SearchConfig) -> tuple:
+    """
+    Return the settings of <config> the loaded handler depends on. The limit
+    is passed to each query, except to precomputed answers, which store
+    <limit> words per prefix.
+    """
+    return (
+        os.path.realpath(config.wordlist),
+        config.algorithm,
+        config.precompute_length,
+        config.precompute_max_words,
+        config.limit if config.precompute_length > 0 else None,
+    )
+
+
+def _contains(handler: Search, word: str) -> bool:
+    """
+    Return whether <word> is in the index of <handler>
+    """
+    # Results are alphabetical when there are changes
+    return handler.complete_prefix(word, 1) == [word]
+
+
+def _mtime(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
@@ -1,116 +1,541 @@
-from dataclasses import dataclass
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
 import statistics
+import tempfile
 import time
+import tracemalloc
 import utils
 import sys
 
-from veloxsearch.config import SearchAlgorithm
+from veloxsearch.config import Config, SearchAlgorithm
+from veloxsearch.index import read_wordlist
 from veloxsearch.velox import Velox
 
+# Metrics compared by `benchmark.py compare`, a backend regresses when one of
+# them grows by more than the threshold
+COMPARED_METRICS = ["build_p50", "query_p50", "query_p99", "memory"]
+
 
 @dataclass
-class TestResult:
-    # Load time, list of search time
-    tries: list[tuple[float, list[float]]]
-    load_time_average: float
-    load_time_median: float
-    search_time_average: float
-    search_time_median: float
+class BenchmarkResult:
+    dataset: str
+    algorithm: str
+    words: int
+    # Wordlist load times, in nanoseconds
+    build_p50: int
+    build_max: int
+    # Prefix completion times, in nanoseconds
+    query_p50: int
+    query_p90: int
+    query_p99: int
+    query_max: int
+    # Memory allocated by the loaded index, and at most during the load
+    # (tracemalloc), in bytes
+    memory: int
+    peak_memory: int
+    # Peak resident set size of a process only loading the index, in bytes
+    peak_rss: int
 
 
 def main():
-    benchmark(
-        "starwars_8k_2018.txt",
-        limit=10,
-        queries=["cor", "o", "tat", "da", "l"],
-        steps=100,
+    parser = argparse.ArgumentParser(description="Velox Search benchmarks")
+    subparsers = parser.add_subparsers(dest="command")
+
+    run_parser = subparsers.add_parser("run", help="Benchmark the algorithms (default)")
+    add_run_arguments(run_parser)
+
+    compare_parser = subparsers.add_parser(
+        "compare", help="Compare two JSON results, fail on regressions"
     )
-    benchmark(
-        "french.txt",
-        limit=5,
-        queries=[
-            "c",
-            "ba",
-            "tot",
-            "vinc",
-            "pourt",
-            "absolu",
-            "gentille",
-            "anti-",
-        ],
-        steps=1,
-        exclude=[],
+    compare_parser.add_argument("base", help="JSON results of the reference run")
+    compare_parser.add_argument("new", help="JSON results of the new run")
+    compare_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Relative growth of a metric counted as a regression (default: 0.1)",
     )
-    # Requires data/rockyou.txt
-    # benchmark(
-    #     "rockyou.txt",
-    #     limit=5,
-    #     queries=["c", "ba", "toto", "vince", "poutac"],
-    #     steps=1,
-    #     exclude=[],
-    # )
-
-
-def format_results(results: dict[SearchAlgorithm, TestResult]):
-    print(f"algo,load_time_avg,load_time_median,search_time_avg,search_time_median")
-    for algo, result in results.items():
-        print(
-            f"{algo},{result.load_time_average*1000}ms,{result.load_time_median*1000}ms,{result.search_time_average*1000}ms,{result.search_time_median*1000}ms"
+
+    argv = sys.argv[1:]
+    if not argv or argv[0] not in ("run", "compare", "-h", "--help"):
+        argv = ["run", *argv]
+    args = parser.parse_args(argv)
+
+    if args.command == "compare":
+        sys.exit(0 if compare(args.base, args.new, args.threshold) else 1)
+    run(args)
+
+
+def add_run_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--dataset",
+        action="append",
+        help="Wordlist of the data directory (default: starwars_8k_2018.txt and "
+        "french.txt). Can be repeated.",
+    )
+    parser.add_argument(
+        "--synthetic",
+        type=int,
+        action="append",
+        default=[],
+        metavar="SIZE",
+        help="Also benchmark a generated wordlist of SIZE words. Can be repeated.",
+    )
+    parser.add_argument(
+        "--alphabet",
+        default="abcdefghijklmnopqrstuvwxyz",
+        help="Chars of the generated words (default: a-z)",
+    )
+    parser.add_argument(
+        "--word-length",
+        type=int,
+        nargs=2,
+        default=[3, 12],
+        metavar=("MIN", "MAX"),
+        help="Length range of the generated words (default: 3 12)",
+    )
+    parser.add_argument(
+        "--algorithm",
+        action="append",
+        choices=[algorithm.value for algorithm in SearchAlgorithm],
+        help="Algorithm to benchmark (default: all). Can be repeated.",
+    )
+    parser.add_argument(
+        "--queries", type=int, default=200, help="Prefixes queried (default: 200)"
+    )
+    parser.add_argument(
+        "--rounds",
+        type=int,
+        default=5,
+        help="Timed passes over the queries (default: 5)",
+    )
+    parser.add_argument(
+        "--warmup",
+        type=int,
+        default=1,
+        help="Untimed passes over the queries first (default: 1)",
+    )
+    parser.add_argument(
+        "--builds", type=int, default=3, help="Timed wordlist loads (default: 3)"
+    )
+    parser.add_argument("--limit", type=int, default=10, help="Default: 10")
+    parser.add_argument("--seed", type=int, default=0, help="Default: 0")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument(
+        "--extras",
+        action="store_true",
+        help="Also run the batch, substring and snapshot benchmarks",
+    )
+
+
+def run(args: argparse.Namespace) -> None:
+    datasets = args.dataset or ["starwars_8k_2018.txt", "french.txt"]
+    algorithms = [SearchAlgorithm(algorithm) for algorithm in args.algorithm or []]
+    results: list[BenchmarkResult] = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.synthetic:
+            datasets.append(
+                generate_wordlist(
+                    directory, size, args.alphabet, *args.word_length, args.seed
+                )
+            )
+
+        for dataset in datasets:
+            results.extend(
+                benchmark(
+                    dataset,
+                    algorithms or list(SearchAlgorithm),
+                    args.limit,
+                    args.queries,
+                    args.rounds,
+                    args.warmup,
+                    args.builds,
+                    args.seed,
+                )
+            )
+
+    if args.output is not None:
+        with open(args.output, "w") as fd:
+            json.dump(
+                {
+                    "environment": {
+                        "python": platform.python_version(),
+                        "platform": platform.platform(),
+                        "processor": platform.processor(),
+                        "cpu_count": os.cpu_count(),
+                    },
+                    "results": [asdict(result) for result in results],
+                },
+                fd,
+                indent=2,
+            )
+
+    if args.extras:
+        benchmark_batch("french.txt", limit=5, batch_size=2000, exclude=["naive"])
+        benchmark_substring(
+            "french.txt",
+            limit=5,
+            queries=["e", "ball", "tion", "anti", "oeu", "xyz"],
+            steps=5,
         )
+        benchmark_snapshot("french.txt", limit=5, steps=3)
+
+
+def generate_wordlist(
+    directory: str,
+    size: int,
+    alphabet: str,
+    min_length: int,
+    max_length: int,
+    seed: int,
+) -> str:
+    """
+    Write a wordlist of <size> random words made of the chars of <alphabet>
+    to <directory>, and return its path
+    """
+    generator = random.Random(seed)
+    path = os.path.join(directory, f"synthetic-{size}.txt")
+    with open(path, "w") as fd:
+        for _ in range(size):
+            length = generator.randint(min_length, max_length)
+            fd.write("".join(generator.choices(alphabet, k=length)))
+            fd.write("\n")
+    return path
+
+
+def generate_queries(wordlist: str, count: int, seed: int) -> list[str]:
+    """
+    Return <count> prefixes of 1 to 6 chars of random words of <wordlist>.
+    One in ten is the prefix of a word with its last char changed, which
+    often starts no word.
+    """
+    generator = random.Random(seed)
+    words = list(read_wordlist(wordlist))
+    queries = []
+    for word in generator.choices(words, k=count):
+        prefix = word[: generator.randint(1, 6)]
+        if generator.random() < 0.1:
+            prefix = prefix[:-1] + generator.choice(words)[-1]
+        queries.append(prefix)
+    return queries
+
+
+def percentile(samples: list[int], percent: int) -> int:
+    """
+    Return the <percent>-th percentile of <samples>, interpolated between the
+    two closest samples
+    """
+    if len(samples) == 1:
+        return samples[0]
+    return round(statistics.quantiles(samples, n=100, method="inclusive")[percent - 1])
+
+
+def format_results(results: list[BenchmarkResult]) -> None:
+    columns = [
+        ("algorithm", lambda result: result.algorithm),
+        ("words", lambda result: str(result.words)),
+        ("build p50", lambda result: f"{result.build_p50 / 1e6:.1f} ms"),
+        ("query p50", lambda result: f"{result.query_p50 / 1e3:.1f} µs"),
+        ("query p90", lambda result: f"{result.query_p90 / 1e3:.1f} µs"),
+        ("query p99", lambda result: f"{result.query_p99 / 1e3:.1f} µs"),
+        ("query max", lambda result: f"{result.query_max / 1e3:.1f} µs"),
+        ("memory", lambda result: f"{result.memory / 2**20:.1f} MiB"),
+        ("peak memory", lambda result: f"{result.peak_memory / 2**20:.1f} MiB"),
+        ("peak rss", lambda result: f"{result.peak_rss / 2**20:.1f} MiB"),
+    ]
+    print_table(
+        [name for name, _ in columns],
+        [[value(result) for _, value in columns] for result in results],
+    )
+
+
+def print_table(header: list[str], rows: list[list[str]]) -> None:
+    """
+    Print rows of cells as right aligned columns
+    """
+    rows = [header, *rows]
+    widths = [max(len(row[column]) for row in rows) for column in range(len(header))]
+    for row in rows:
+        print("  ".join(cell.rjust(width) for cell, width in zip(row, widths)).rstrip())
+
+
+def measure_memory(config: Config):
+    """
+    Return the memory allocated by a loaded index, and at most while loading
+    it. Allocations are traced, which slows the load down, so it is not
+    timed.
+    """
+    tracemalloc.start()
+    try:
+        velox = Velox(config)
+        memory, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del velox
+    return memory, peak_memory
+
 
+def _load_peak_rss(config: Config) -> int:
+    """
+    Load the index and return the peak resident set size of the process, in
+    bytes
+    """
+    Velox(config)
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # In bytes on macOS, in KiB elsewhere
+    return peak_rss if sys.platform == "darwin" else peak_rss * 1024
 
-def benchmark(wordlist: str, limit: int, queries: list[str], steps: int, exclude=[]):
-    print(f"# wordlist:{wordlist};limit:{limit};queries:{queries};test steps:{steps}")
-    results = {}
+
+def measure_peak_rss(config: Config) -> int:
+    """
+    Return the peak resident set size of a new process loading the index, so
+    that it does not depend on the previous benchmarks
+    """
+    with ProcessPoolExecutor(
+        1, mp_context=multiprocessing.get_context("spawn")
+    ) as pool:
+        return pool.submit(_load_peak_rss, config).result()
+
+
+def benchmark(
+    wordlist: str,
+    algorithms: list[SearchAlgorithm],
+    limit: int,
+    queries: int,
+    rounds: int,
+    warmup: int,
+    builds: int,
+    seed: int,
+) -> list[BenchmarkResult]:
+    dataset = os.path.basename(wordlist)
+    path = os.path.join(os.path.dirname(__file__), "../data", wordlist)
+    words = len(set(read_wordlist(path)))
+    prefixes = generate_queries(path, queries, seed)
+    print(f"# wordlist:{dataset};limit:{limit};queries:{len(prefixes)};rounds:{rounds}")
+
+    results = []
+    for algorithm in algorithms:
+        print(f"+ Benchmarking {algorithm}", file=sys.stderr)
+        config = utils.get_config(wordlist, algorithm, limit)
+        config.search.wordlist = path
+
+        build_times = []
+        try:
+            for _ in range(builds):
+                start = time.perf_counter_ns()
+                velox = Velox(config)
+                build_times.append(time.perf_counter_ns() - start)
+        except NotImplementedError:
+            continue
+
+        for _ in range(warmup):
+            for prefix in prefixes:
+                velox.complete_prefix(prefix)
+
+        query_times = []
+        for _ in range(rounds):
+            for prefix in prefixes:
+                start = time.perf_counter_ns()
+                velox.complete_prefix(prefix)
+                query_times.append(time.perf_counter_ns() - start)
+
+        del velox
+        memory, peak_memory = measure_memory(config)
+        results.append(
+            BenchmarkResult(
+                dataset=dataset,
+                algorithm=algorithm.value,
+                words=words,
+                build_p50=percentile(build_times, 50),
+                build_max=max(build_times),
+                query_p50=percentile(query_times, 50),
+                query_p90=percentile(query_times, 90),
+                query_p99=percentile(query_times, 99),
+                query_max=max(query_times),
+                memory=memory,
+                peak_memory=peak_memory,
+                peak_rss=measure_peak_rss(config),
+            )
+        )
+
+    format_results(results)
+    return results
+
+
+def compare(base_path: str, new_path: str, threshold: float) -> bool:
+    """
+    Print the change of the compared metrics of each backend between two
+    runs, and return False if one of them grows by more than <threshold>, or
+    if a backend of the base run is missing from the new one
+    """
+    runs = []
+    for path in (base_path, new_path):
+        with open(path) as fd:
+            runs.append(
+                {
+                    (result["dataset"], result["algorithm"]): result
+                    for result in json.load(fd)["results"]
+                }
+            )
+    base, new = runs
+
+    success = True
+    rows = []
+    for key, result in new.items():
+        if key not in base:
+            continue
+        for metric in COMPARED_METRICS:
+            change = result[metric] / max(base[key][metric], 1) - 1
+            regression = change > threshold
+            success &= not regression
+            rows.append(
+                [
+                    *key,
+                    metric,
+                    str(base[key][metric]),
+                    str(result[metric]),
+                    f"{change:+.1%}",
+                    "REGRESSION" if regression else "",
+                ]
+            )
+    print_table(["dataset", "algorithm", "metric", "base", "new", "change", ""], rows)
+
+    # A backend failing or skipped in the new run would hide its regressions
+    missing = [key for key in base if key not in new]
+    for dataset, algorithm in missing:
+        print(f"MISSING: {algorithm} on {dataset} is not in {new_path}")
+    return success and not missing
+
+
+def benchmark_batch(wordlist: str, limit: int, batch_size: int, exclude=[]):
+    """
+    Compare the completion of a batch of prefixes with one call per prefix
+    """
+    # Prefixes of 1 to 4 chars of random words of the wordlist
+    generator = random.Random(0)
+    with open(
+        os.path.join(os.path.dirname(__file__), f"../data/{wordlist}"),
+        errors="replace",
+    ) as fd:
+        words = [line.strip() for line in fd if line.strip()]
+    prefixes = [
+        word[: generator.randint(1, 4)]
+        for word in generator.sample(words, min(batch_size, len(words)))
+    ]
+
+    print(f"# wordlist:{wordlist};limit:{limit};batch size:{len(prefixes)}")
+    print("algo,loop_time,batch_time,speedup")
     for algorithm in SearchAlgorithm:
         if algorithm in exclude:
             continue
 
-        print(f"+ Benchmarking {algorithm}", file=sys.stderr)
-
-        not_implemented = False
-        tries = []
+        print(f"+ Benchmarking batch {algorithm}", file=sys.stderr)
+        try:
+            velox = Velox(utils.get_config(wordlist, algorithm, limit))
+        except NotImplementedError:
+            continue
 
-        for i in range(steps):
-            start = time.time()
-            try:
-                velox = Velox(utils.get_config(wordlist, algorithm, limit))
-            except NotImplementedError:
-                not_implemented = True
-                continue
+        # Best of several runs, the first one also warms up
+        loop_times = []
+        batch_times = []
+        for _ in range(5):
+            start = time.perf_counter()
+            for prefix in prefixes:
+                velox.complete_prefix(prefix)
+            loop_times.append(time.perf_counter() - start)
 
-            if not_implemented:
-                break
+            start = time.perf_counter()
+            velox.complete_prefixes(prefixes)
+            batch_times.append(time.perf_counter() - start)
 
-            end = time.time()
-            load_time = end - start
+        loop_time = min(loop_times)
+        batch_time = min(batch_times)
+        print(
+            f"{algorithm},{loop_time*1000}ms,{batch_time*1000}ms,{loop_time/batch_time:.2f}"
+        )
 
-            search_times = []
-            for query in queries:
-                start = time.time()
-                velox.complete_prefix(query)
-                end = time.time()
-                search_times.append(end - start)
 
-            tries.append((load_time, search_times))
+def benchmark_substring(
+    wordlist: str, limit: int, queries: list[str], steps: int, exclude=[]
+):
+    """
+    Compare the algorithms supporting substring queries, the naive one being a
+    scan of all the words
+    """
+    print(f"# wordlist:{wordlist};limit:{limit};substring queries:{queries}")
+    print("algo,load_time,memory,peak_memory,substring_time_avg,substring_time_max")
+    for algorithm in SearchAlgorithm:
+        if algorithm in exclude:
+            continue
 
-        if not_implemented:
+        print(f"+ Benchmarking substrings {algorithm}", file=sys.stderr)
+        start = time.perf_counter()
+        try:
+            velox = Velox(utils.get_config(wordlist, algorithm, limit))
+            load_time = time.perf_counter() - start
+            velox.complete_substring(queries[0])
+        except NotImplementedError:
             continue
 
-        result = TestResult(
-            tries=tries,
-            load_time_average=statistics.mean(load for (load, _search) in tries),
-            load_time_median=statistics.median(load for (load, _search) in tries),
-            search_time_average=statistics.mean(
-                search for (_load, search_times) in tries for search in search_times
-            ),
-            search_time_median=statistics.median(
-                search for (_load, search_times) in tries for search in search_times
-            ),
+        # Best of several runs of each query
+        search_times = []
+        for query in queries:
+            query_times = []
+            for _ in range(steps):
+                start = time.perf_counter()
+                velox.complete_substring(query)
+                query_times.append(time.perf_counter() - start)
+            search_times.append(min(query_times))
+
+        del velox
+        memory, peak_memory = measure_memory(
+            utils.get_config(wordlist, algorithm, limit)
+        )
+        print(
+            f"{algorithm},{load_time*1000}ms,{memory/2**20:.1f}MiB,{peak_memory/2**20:.1f}MiB,{statistics.mean(search_times)*1000}ms,{max(search_times)*1000}ms"
         )
-        results[algorithm] = result
 
-    format_results(results)
+
+def benchmark_snapshot(wordlist: str, limit: int, steps: int):
+    """
+    Compare the startup time of the prefix tree built from the wordlist and
+    restored from a snapshot
+    """
+    print(f"# wordlist:{wordlist};limit:{limit};prefix tree snapshot")
+    print("startup,load_time_avg,load_time_median,first_query_time")
+    with tempfile.TemporaryDirectory() as directory:
+        config = utils.get_config(wordlist, SearchAlgorithm.PrefixTree, limit)
+        # Written by the first load
+        config.search.snapshot_dir = directory
+        Velox(config)
+
+        for name, snapshot_dir in [("build", ""), ("snapshot", directory)]:
+            print(f"+ Benchmarking prefixtree {name}", file=sys.stderr)
+            config.search.snapshot_dir = snapshot_dir
+            load_times = []
+            query_times = []
+            for _ in range(steps):
+                start = time.perf_counter()
+                velox = Velox(config)
+                load_times.append(time.perf_counter() - start)
+
+                # Nodes of a restored tree are created on their first visit
+                start = time.perf_counter()
+                velox.complete_prefix("a")
+                query_times.append(time.perf_counter() - start)
+                del velox
+
+            print(
+                f"{name},{statistics.mean(load_times)*1000}ms,{statistics.median(load_times)*1000}ms,{statistics.mean(query_times)*1000}ms"
+            )
 
 
 if __name__ == "__main__":
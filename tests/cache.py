@@ -0,0 +1,88 @@
+import threading
+import time
+import unittest
+
+from veloxsearch.cache import CacheStats, LRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_get_put(self):
+        cache: LRUCache[str, int] = LRUCache(10)
+        self.assertIsNone(cache.get("a"))
+        cache.put("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+
+        stats = cache.stats()
+        self.assertEqual(stats.hits, 1)
+        self.assertEqual(stats.misses, 1)
+        self.assertEqual(stats.entries, 1)
+
+    def test_eviction(self):
+        # A single shard, so that the LRU order is global
+        cache: LRUCache[str, int] = LRUCache(2, shards=1)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        # "a" becomes the most recently used entry
+        cache.get("a")
+        cache.put("c", 3)
+
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.stats().evictions, 1)
+
+    def test_max_entries(self):
+        cache: LRUCache[int, int] = LRUCache(100)
+        for i in range(1000):
+            cache.put(i, i)
+
+        stats = cache.stats()
+        self.assertEqual(stats.entries, 100)
+        self.assertEqual(stats.evictions, 900)
+
+    def test_ttl(self):
+        cache: LRUCache[str, int] = LRUCache(10, ttl=0.05)
+        cache.put("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        time.sleep(0.1)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats().expirations, 1)
+
+    def test_previous_stats(self):
+        cache: LRUCache[str, int] = LRUCache(
+            10, stats=CacheStats(hits=3, misses=2, evictions=1, entries=5)
+        )
+        cache.get("a")
+        cache.put("a", 1)
+        self.assertEqual(
+            cache.stats(), CacheStats(hits=3, misses=3, evictions=1, entries=1)
+        )
+
+    def test_clear(self):
+        cache: LRUCache[str, int] = LRUCache(10)
+        cache.put("a", 1)
+        cache.clear()
+        self.assertIsNone(cache.get("a"))
+
+    def test_threads(self):
+        cache: LRUCache[int, int] = LRUCache(50)
+
+        def worker(offset: int):
+            for i in range(2000):
+                key = (i + offset) % 200
+                if cache.get(key) is None:
+                    cache.put(key, key)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stats = cache.stats()
+        self.assertEqual(stats.hits + stats.misses, 8 * 2000)
+        self.assertLessEqual(stats.entries, 50)
+
+
+if __name__ == "__main__":
+    unittest.main()
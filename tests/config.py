@@ -30,7 +30,10 @@ class TestConfig(unittest.TestCase):
         self.assertEqual(config.search.wordlist, "data/eff_large_wordlist.txt")
         self.assertEqual(config.search.algorithm, "naive")
         self.assertEqual(config.search.limit, 10)
+        self.assertEqual(config.search.precompute_length, 0)
         self.assertEqual(config.logging.level, "DEBUG")
+        # The [cache] section is optional
+        self.assertEqual(config.cache.max_entries, 0)
 
     def test_invalid_http_server_listen_addr(self):
         # Missing http_server.listen_addr
@@ -71,6 +74,162 @@ class TestConfig(unittest.TestCase):
             config = Config._load_dict(data)
         self.assertEqual(str(error.exception), "Invalid section [http_server]")
 
+    def test_invalid_search_precompute_length(self):
+        invalid_config = """
+        [http_server]
+        listen_addr = "localhost"
+        listen_port = 10000
+
+        [search]
+        wordlist = "data/eff_large_wordlist.txt"
+        algorithm = "bisect"
+        limit = 10
+        precompute_length = -1
+
+        [logging]
+        level = "debug"
+        """
+        data = tomllib.loads(invalid_config)
+
+        with self.assertRaises(ValueError) as error:
+            Config._load_dict(data)
+        self.assertEqual(str(error.exception), "Invalid value search.precompute_length")
+
+    def test_cache(self):
+        valid_config = """
+        [http_server]
+        listen_addr = "localhost"
+        listen_port = 10000
+
+        [search]
+        wordlist = "data/eff_large_wordlist.txt"
+        algorithm = "bisect"
+        limit = 10
+
+        [logging]
+        level = "debug"
+
+        [cache]
+        max_entries = 1000
+        ttl = 30
+        """
+        data = tomllib.loads(valid_config)
+
+        config = Config._load_dict(data)
+
+        self.assertEqual(config.cache.max_entries, 1000)
+        self.assertEqual(config.cache.ttl, 30)
+
+    def test_http_server_mode(self):
+        config = """
+        [http_server]
+        listen_addr = "localhost"
+        listen_port = 10000
+        mode = "{mode}"
+        keep_alive_timeout = 2.5
+
+        [search]
+        wordlist = "data/eff_large_wordlist.txt"
+        algorithm = "bisect"
+        limit = 10
+
+        [logging]
+        level = "debug"
+        """
+        data = tomllib.loads(config.format(mode="Asyncio"))
+
+        http_server = Config._load_dict(data).http_server
+
+        self.assertEqual(http_server.mode, "asyncio")
+        self.assertEqual(http_server.max_connections, 1024)
+        self.assertEqual(http_server.keep_alive_timeout, 2.5)
+        self.assertEqual(http_server.workers, 1)
+
+        data = tomllib.loads(config.format(mode="forking"))
+        with self.assertRaises(ValueError):
+            Config._load_dict(data)
+
+        # Connections would be closed before their request is read
+        for timeout in ["0", "-1", "true"]:
+            data = tomllib.loads(config.format(mode="asyncio").replace("2.5", timeout))
+            with self.assertRaises(ValueError) as error:
+                Config._load_dict(data)
+            self.assertEqual(
+                str(error.exception), "Invalid value http_server.keep_alive_timeout"
+            )
+
+    def test_writes(self):
+        config = """
+        [http_server]
+        listen_addr = "localhost"
+        listen_port = 10000
+        workers = {workers}
+
+        [search]
+        wordlist = "data/eff_large_wordlist.txt"
+        algorithm = "bisect"
+        limit = 10
+
+        [logging]
+        level = "debug"
+
+        [writes]
+        token = "secret"
+        """
+        writes = Config._load_dict(tomllib.loads(config.format(workers=1))).writes
+        self.assertEqual(writes.token, "secret")
+        self.assertEqual(writes.segment_size, 1024)
+
+        # Each worker would have its own changes
+        with self.assertRaises(ValueError):
+            Config._load_dict(tomllib.loads(config.format(workers=2)))
+
+    def test_search_indexes(self):
+        config = """
+        [http_server]
+        listen_addr = "localhost"
+        listen_port = 10000
+
+        [search]
+        wordlist = "data/french.txt"
+        algorithm = "bisect"
+        limit = 10
+
+        [search.indexes.starwars]
+        wordlist = "data/starwars_8k_2018.txt"
+        limit = 5
+
+        [search.indexes.{name}]
+        wordlist = "data/gameofthrones_8k-2018.txt"
+        algorithm = "{algorithm}"
+
+        [logging]
+        level = "debug"
+        """
+        search = Config._load_dict(
+            tomllib.loads(config.format(name="got", algorithm="prefixtree"))
+        ).search
+        self.assertEqual(search.wordlist, "data/french.txt")
+        self.assertEqual(list(search.indexes), ["starwars", "got"])
+
+        # Named indexes default to the values of [search]
+        starwars = search.indexes["starwars"]
+        self.assertEqual(starwars.wordlist, "data/starwars_8k_2018.txt")
+        self.assertEqual(starwars.algorithm, "bisect")
+        self.assertEqual(starwars.limit, 5)
+        self.assertEqual(search.indexes["got"].algorithm, "prefixtree")
+        self.assertEqual(search.indexes["got"].limit, 10)
+
+        with self.assertRaises(ValueError) as error:
+            Config._load_dict(
+                tomllib.loads(config.format(name="got", algorithm="unknown"))
+            )
+        self.assertTrue(
+            str(error.exception).startswith(
+                "Invalid search.indexes.got.algorithm `unknown`"
+            )
+        )
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,202 @@
+import random
+import time
+from typing import Optional
+import unittest
+
+from veloxsearch.delta import DeltaSegments
+from veloxsearch.fuzzy import fuzzy_complete_sorted
+from veloxsearch.suffix_array import substring_key
+
+
+class TestDeltaSegments(unittest.TestCase):
+    base_words = ["apple", "apricot", "banana", "blueberry", "cherry"]
+
+    def _base(self, prefix: str, limit: int, after: Optional[str] = None) -> list[str]:
+        return [
+            word
+            for word in self.base_words
+            if word.startswith(prefix) and (after is None or word > after)
+        ][:limit]
+
+    def test_empty(self):
+        delta = DeltaSegments()
+        self.assertEqual(delta.complete("ap", 10, self._base), ["apple", "apricot"])
+
+    def test_add_remove(self):
+        delta = DeltaSegments()
+        delta.set("apex", True)
+        delta.set("apple", False)
+
+        self.assertEqual(delta.complete("ap", 10, self._base), ["apex", "apricot"])
+        self.assertEqual(delta.complete("", 2, self._base), ["apex", "apricot"])
+        self.assertEqual(
+            delta.complete("", 10, self._base),
+            ["apex", "apricot", "banana", "blueberry", "cherry"],
+        )
+
+        # The last change wins
+        delta.set("apple", True)
+        delta.set("apex", False)
+        self.assertEqual(delta.complete("ap", 10, self._base), ["apple", "apricot"])
+
+    def test_after(self):
+        delta = DeltaSegments()
+        delta.set("apex", True)
+        delta.set("apple", False)
+        delta.set("blue", True)
+
+        self.assertEqual(
+            delta.complete("", 2, self._base, "apex"), ["apricot", "banana"]
+        )
+        self.assertEqual(
+            delta.complete("", 2, self._base, "banana"), ["blue", "blueberry"]
+        )
+        self.assertEqual(delta.complete("ap", 2, self._base, "b"), [])
+        self.assertEqual(delta.complete("b", 2, self._base, "a"), ["banana", "blue"])
+
+    def test_removals_beyond_limit(self):
+        delta = DeltaSegments()
+        for word in ["apple", "apricot", "banana"]:
+            delta.set(word, False)
+
+        self.assertEqual(delta.complete("", 1, self._base), ["blueberry"])
+
+    def test_segments(self):
+        delta = DeltaSegments(segment_size=2)
+        delta.set("apex", True)
+        delta.set("banana", False)
+        # The first segment is frozen
+        delta.set("apex", False)
+        delta.set("cherry", False)
+        delta.set("banana", True)
+        self.assertGreaterEqual(len(delta.segments), 2)
+
+        self.assertEqual(
+            delta.complete("", 10, self._base),
+            ["apple", "apricot", "banana", "blueberry"],
+        )
+
+    def test_compaction(self):
+        delta = DeltaSegments(segment_size=4)
+        reference = set(self.base_words)
+        rng = random.Random(42)
+        for _ in range(200):
+            word = "".join(rng.choice("abc") for _ in range(rng.randint(1, 4)))
+            present = rng.random() < 0.6
+            delta.set(word, present)
+            if present:
+                reference.add(word)
+            else:
+                reference.discard(word)
+
+            for prefix in ["", "a", "ab", "b", "c"]:
+                self.assertEqual(
+                    delta.complete(prefix, 5, self._base),
+                    sorted(word for word in reference if word.startswith(prefix))[:5],
+                )
+
+        # Segments are merged in the background
+        for _ in range(50):
+            if len(delta.segments) <= 3:
+                break
+            time.sleep(0.1)
+        self.assertLessEqual(len(delta.segments), 3)
+        self.assertGreater(delta.compactions, 0)
+        self.assertEqual(delta.complete("", 1000, self._base), sorted(reference)[:1000])
+
+    def test_fold(self):
+        delta = DeltaSegments(
+            segment_size=2, contains=lambda word: word in self.base_words
+        )
+        reference = set(self.base_words)
+        rng = random.Random(42)
+        for _ in range(200):
+            # Added then removed words leave no tombstone once compacted
+            word = rng.choice(["apex", "apple", "kiwi", "lime", "mango"])
+            present = rng.random() < 0.5
+            delta.set(word, present)
+            if present:
+                reference.add(word)
+            else:
+                reference.discard(word)
+        for _ in range(50):
+            if not delta._compacting:
+                break
+            time.sleep(0.1)
+        self.assertLessEqual(len(delta.segments[-1]), 5)
+        self.assertEqual(delta.complete("", 100, self._base), sorted(reference))
+
+        # The new index has the changes, so none is left
+        self.base_words = sorted(reference)
+        with delta.lock:
+            delta.rebase()
+        self.assertEqual(len(delta), 0)
+        self.assertEqual(delta.complete("", 100, self._base), sorted(reference))
+
+        # Unless it does not
+        delta.set("apex", True)
+        delta.set("apple", True)
+        self.base_words = ["apple", "banana"]
+        with delta.lock:
+            delta.rebase()
+        self.assertEqual(delta.segments[0].entries, {"apex": True})
+        self.assertEqual(
+            delta.complete("", 100, self._base), ["apex", "apple", "banana"]
+        )
+
+    def test_count(self):
+        def count(delta: DeltaSegments, prefix: str) -> int:
+            return delta.count(
+                prefix, len(self._base(prefix, 100)), self.base_words.__contains__
+            )
+
+        delta = DeltaSegments(segment_size=2)
+        self.assertEqual(count(delta, "ap"), 2)
+
+        delta.set("apex", True)
+        delta.set("apple", False)
+        # Already in the index
+        delta.set("apricot", True)
+        delta.set("apex", False)
+        delta.set("banana", True)
+        self.assertEqual(count(delta, "ap"), 1)
+        self.assertEqual(count(delta, ""), 4)
+
+    def test_fuzzy(self):
+        def base(prefix: str, max_distance: int, limit: int):
+            return fuzzy_complete_sorted(self.base_words, prefix, max_distance, limit)
+
+        delta = DeltaSegments()
+        self.assertEqual(delta.complete_fuzzy("bpp", 1, 10, base), ["apple"])
+
+        delta.set("apple", False)
+        delta.set("bapple", True)
+        self.assertEqual(delta.complete_fuzzy("bpp", 1, 10, base), ["bapple"])
+        self.assertEqual(
+            delta.complete_fuzzy("bpp", 2, 10, base),
+            ["bapple", "apricot", "banana", "blueberry"],
+        )
+
+    def test_substring(self):
+        def base(substring: str, limit: int) -> list[str]:
+            return sorted(
+                (word for word in self.base_words if substring in word),
+                key=lambda word: (substring_key(word, substring), word),
+            )[:limit]
+
+        delta = DeltaSegments()
+        self.assertEqual(delta.complete_substring("an", 10, base), ["banana"])
+
+        delta.set("banana", False)
+        delta.set("mango", True)
+        delta.set("anchovy", True)
+        self.assertEqual(delta.complete_substring("an", 10, base), ["anchovy", "mango"])
+        self.assertEqual(delta.complete_substring("an", 1, base), ["anchovy"])
+        # Words of equal end are sorted alphabetically
+        self.assertEqual(
+            delta.complete_substring("rr", 10, base), ["blueberry", "cherry"]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
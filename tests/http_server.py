@@ -1,24 +1,55 @@
-from http.client import HTTPResponse
+from http.client import HTTPConnection, HTTPResponse
 import json
 import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
 import logging
 import unittest
 import threading
 import time
 import random
+from typing import Optional
 import urllib.parse
 import urllib.request
 import urllib.error
 
+from veloxsearch.bin.bench_http import (
+    QueryDistribution,
+    format_report,
+    port_in_use,
+    random_prefixes,
+    request_path,
+    run_load,
+    wait_for_port,
+)
+from veloxsearch.bin.async_server import AsyncHTTPServer
 from veloxsearch.bin.http_server import http_server
 from veloxsearch.config import (
     Config,
     HttpServerConfig,
+    HttpServerMode,
     LoggingConfig,
     SearchAlgorithm,
     SearchConfig,
+    WritesConfig,
 )
 from veloxsearch.velox import Velox
+import veloxsearch
+
+
+def parse_metrics(text: str) -> dict[str, float]:
+    """
+    Return the value of each series of metrics in the Prometheus text format
+    """
+    return {
+        series: float(value)
+        for series, _, value in (
+            line.rpartition(" ") for line in text.splitlines() if line[:1] != "#"
+        )
+    }
 
 
 class TestHTTPServer(unittest.TestCase):
@@ -26,6 +57,8 @@ class TestHTTPServer(unittest.TestCase):
     Integration tests of Velox Search HTTP Server
     """
 
+    mode = HttpServerMode.Threaded
+
     @classmethod
     def setUpClass(cls):
         """
@@ -34,7 +67,7 @@ class TestHTTPServer(unittest.TestCase):
         cls.listen_port = random.randint(11000, 13000)
         config = Config(
             http_server=HttpServerConfig(
-                listen_addr="127.0.0.1", listen_port=cls.listen_port
+                listen_addr="127.0.0.1", listen_port=cls.listen_port, mode=cls.mode
             ),
             search=SearchConfig(
                 wordlist=os.path.join(
@@ -42,12 +75,22 @@ class TestHTTPServer(unittest.TestCase):
                 ),
                 algorithm=SearchAlgorithm.Naive,
                 limit=10,
+                indexes={
+                    "starwars": SearchConfig(
+                        wordlist=os.path.join(
+                            os.path.dirname(__file__), "../data/starwars_8k_2018.txt"
+                        ),
+                        algorithm=SearchAlgorithm.Bisect,
+                        limit=3,
+                    )
+                },
             ),
             logging=LoggingConfig(level="INFO"),
+            writes=WritesConfig(token="secret"),
         )
-        velox = Velox(config)
+        cls.velox = Velox(config)
         cls.base_url = f"http://127.0.0.1:{cls.listen_port}"
-        cls.httpd = http_server(config, velox)
+        cls.httpd = http_server(config, cls.velox)
 
         cls.http_server_thread = threading.Thread(target=cls.httpd.serve_forever)
         # Force the thread to stop when main thread exits
@@ -109,12 +152,225 @@ class TestHTTPServer(unittest.TestCase):
             ],
         )
 
+    def test_autocomplete_fuzzy(self):
+        response = self._make_request("/autocomplete?query=crypt&fuzzy=0")
+        self.assertEqual(json.load(response), ["cryptic"])
+
+        # Naive search does not support fuzzy completion
+        with self.assertRaises(urllib.error.HTTPError) as error:
+            self._make_request("/autocomplete?query=crypt&fuzzy=1")
+        self.assertEqual(error.exception.code, 501)
+
+        for fuzzy in ["3", "-1", "one", "1&fuzzy=2"]:
+            with self.assertRaises(urllib.error.HTTPError) as error:
+                self._make_request(f"/autocomplete?query=crypt&fuzzy={fuzzy}")
+            self.assertEqual(error.exception.code, 422)
+
+    def test_autocomplete_substring(self):
+        response = self._make_request("/autocomplete?query=BALL&mode=substring")
+        # Words ending with the substring first
+        self.assertEqual(
+            json.load(response),
+            [
+                "cornball",
+                "fastball",
+                "football",
+                "goofball",
+                "gumball",
+                "handball",
+                "mothball",
+                "verbally",
+            ],
+        )
+
+        response = self._make_request("/autocomplete?query=cry&mode=prefix")
+        self.assertEqual(json.load(response), ["crying", "cryptic", "crystal"])
+
+        for params in [
+            "mode=infix",
+            "mode=substring&fuzzy=1",
+            "mode=substring&cursor=",
+        ]:
+            with self.assertRaises(urllib.error.HTTPError) as error:
+                self._make_request(f"/autocomplete?query=ball&{params}")
+            self.assertEqual(error.exception.code, 422)
+
+    def test_autocomplete_index(self):
+        response = self._make_request("/autocomplete?query=dar&index=starwars")
+        self.assertEqual(json.load(response), ["dark", "dark-side", "darklighter"])
+        response = self._make_request("/count?query=dar&index=starwars")
+        self.assertEqual(json.load(response), {"count": 6})
+
+        with self.assertRaises(urllib.error.HTTPError) as error:
+            self._make_request("/autocomplete?query=dar&index=unknown")
+        self.assertEqual(error.exception.code, 404)
+
+        with self.assertRaises(urllib.error.HTTPError) as error:
+            self._make_request("/autocomplete?query=dar&index=starwars&index=starwars")
+        self.assertEqual(error.exception.code, 422)
+
+    def test_autocomplete_cursor(self):
+        words = []
+        cursor = ""
+        while cursor is not None:
+            response = self._make_request(
+                f"/autocomplete?query=cr&cursor={urllib.parse.quote(cursor)}"
+            )
+            content = json.load(response)
+            words.extend(content["words"])
+            cursor = content["next_cursor"]
+
+        self.assertEqual(len(words), 107)
+        self.assertEqual(words[:2], ["crabbing", "crabgrass"])
+        self.assertEqual(words, sorted(words))
+
+        for cursor in ["!!!", "gA", "a&cursor=b"]:
+            with self.assertRaises(urllib.error.HTTPError) as error:
+                self._make_request(f"/autocomplete?query=cr&cursor={cursor}")
+            self.assertEqual(error.exception.code, 422)
+
+    def test_count(self):
+        response = self._make_request("/count?query=Cr")
+        self.assertEqual(response.status, 200)
+        self.assertEqual(json.load(response), {"count": 107})
+
+        response = self._make_request("/count?query=zzzz")
+        self.assertEqual(json.load(response), {"count": 0})
+
+        with self.assertRaises(urllib.error.HTTPError) as error:
+            self._make_request("/count")
+        self.assertEqual(error.exception.code, 422)
+
+    def _make_post_request(
+        self, path: str, body: bytes, token: Optional[str] = None
+    ) -> HTTPResponse:
+        """
+        A helper to make a POST request with a JSON body
+        """
+        url = f"{self.base_url}{path}"
+        headers = {"Content-Type": "application/json"}
+        if token is not None:
+            headers["Authorization"] = f"Bearer {token}"
+        request = urllib.request.Request(url, data=body, headers=headers)
+        return urllib.request.urlopen(request, timeout=2)
+
+    def test_autocomplete_batch(self):
+        url = "/autocomplete/batch"
+        response = self._make_post_request(url, json.dumps(["crypt", "abac"]).encode())
+
+        self.assertEqual(response.status, 200)
+        content = json.load(response)
+
+        self.assertEqual(content, {"crypt": ["cryptic"], "abac": ["abacus"]})
+
+    def test_autocomplete_batch_invalid(self):
+        url = "/autocomplete/batch"
+        with self.assertRaises(urllib.error.HTTPError) as error:
+            self._make_post_request(url, b"[crypt")
+        self.assertEqual(error.exception.code, 400)
+
+        with self.assertRaises(urllib.error.HTTPError) as error:
+            self._make_post_request(url, json.dumps({"query": "crypt"}).encode())
+        self.assertEqual(error.exception.code, 422)
+
+    def test_words(self):
+        url = "/words"
+        body = json.dumps({"add": ["cryptid"], "remove": ["cryptic"]}).encode()
+        with self.assertRaises(urllib.error.HTTPError) as error:
+            self._make_post_request(url, body)
+        self.assertEqual(error.exception.code, 401)
+
+        with self.assertRaises(urllib.error.HTTPError) as error:
+            self._make_post_request(url, body, "wrong")
+        self.assertEqual(error.exception.code, 401)
+
+        with self.assertRaises(urllib.error.HTTPError) as error:
+            self._make_post_request(
+                url, json.dumps({"add": "cryptid"}).encode(), "secret"
+            )
+        self.assertEqual(error.exception.code, 422)
+
+        response = self._make_post_request(url, body, "secret")
+        self.assertEqual(response.status, 204)
+        self.assertEqual(
+            json.load(self._make_request("/autocomplete?query=crypt")), ["cryptid"]
+        )
+
+        body = json.dumps({"add": ["cryptic"], "remove": ["cryptid"]}).encode()
+        response = self._make_post_request(url, body, "secret")
+        self.assertEqual(response.status, 204)
+        self.assertEqual(
+            json.load(self._make_request("/autocomplete?query=crypt")), ["cryptic"]
+        )
+
     def test_404(self):
         url = "/unknown"
         with self.assertRaises(urllib.error.HTTPError) as error:
             self._make_request(url)
         self.assertEqual(error.exception.code, 404)
 
+    def test_metrics(self):
+        def scrape() -> dict[str, float]:
+            response = self._make_request("/metrics")
+            self.assertEqual(
+                response.headers["Content-Type"],
+                "text/plain; version=0.0.4; charset=utf-8",
+            )
+            return parse_metrics(response.read().decode())
+
+        before = scrape()
+        self._make_request("/autocomplete?query=cr")
+        self._make_request("/autocomplete?query=obi&index=starwars")
+        with self.assertRaises(urllib.error.HTTPError):
+            self._make_request("/unknown")
+        after = scrape()
+
+        def increase(series: str) -> float:
+            return after.get(series, 0) - before.get(series, 0)
+
+        self.assertEqual(
+            increase('velox_requests_total{route="/autocomplete",status="2xx"}'), 2
+        )
+        self.assertEqual(
+            increase('velox_requests_total{route="other",status="4xx"}'), 1
+        )
+        # The first scrape is counted by the second one
+        self.assertEqual(
+            increase('velox_requests_total{route="/metrics",status="2xx"}'), 1
+        )
+        self.assertEqual(
+            increase('velox_request_duration_seconds_count{route="/autocomplete"}'), 2
+        )
+        self.assertEqual(
+            increase(
+                "velox_engine_duration_seconds_count"
+                '{route="/autocomplete",algorithm="naive",prefix_length="2"}'
+            ),
+            1,
+        )
+        self.assertEqual(
+            increase(
+                "velox_engine_duration_seconds_bucket"
+                '{route="/autocomplete",algorithm="bisect",prefix_length="3",le="+Inf"}'
+            ),
+            1,
+        )
+
+        self.assertEqual(
+            after['velox_index_words{index="starwars",algorithm="bisect"}'],
+            self.velox.index("starwars").count_prefix(""),
+        )
+        self.assertGreater(
+            after[
+                'velox_index_load_duration_seconds{index="default",algorithm="naive"}'
+            ],
+            0,
+        )
+        self.assertGreater(after['velox_process_resident_memory_bytes{worker="0"}'], 0)
+        # The test server has no result cache
+        self.assertEqual(after["velox_cache_hits_total"], 0)
+        self.assertEqual(after["velox_cache_entries"], 0)
+
     def test_emoji(self):
         url = "/autocomplete?query=cr" + urllib.parse.quote("😁")
         response = self._make_request(url)
@@ -127,6 +383,272 @@ class TestHTTPServer(unittest.TestCase):
             [],
         )
 
+    def test_load_generator(self):
+        paths = [
+            request_path("/autocomplete", prefix, {"index": "starwars"})
+            for prefix in random_prefixes(
+                os.path.join(os.path.dirname(__file__), "../data/starwars_8k_2018.txt"),
+                20,
+                random.Random(0),
+            )
+        ] + ["/unknown"]
+        result = run_load(
+            "127.0.0.1",
+            self.listen_port,
+            QueryDistribution.zipf(paths, 1.1),
+            clients=3,
+            requests=60,
+        )
+
+        self.assertEqual(result.requests, 60)
+        self.assertEqual(result.failures.total(), 0)
+        self.assertEqual(result.errors, result.statuses[404])
+        self.assertEqual(result.statuses[200] + result.statuses[404], 60)
+
+        report = result.report()
+        self.assertEqual(sum(count for _, count in report["histogram_ms"]), 60)
+        self.assertIn("req/s", format_report(report, 3))
+
+        self.assertTrue(port_in_use("127.0.0.1", self.listen_port))
+        # A server failing at startup is not waited for
+        process = subprocess.Popen([sys.executable, "-c", "raise SystemExit(3)"])
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        with self.assertRaisesRegex(RuntimeError, "status 3"):
+            wait_for_port("127.0.0.1", port, 60, process)
+
+
+class TestAsyncHTTPServer(TestHTTPServer):
+    """
+    Integration tests of Velox Search HTTP Server in asyncio mode
+    """
+
+    mode = HttpServerMode.Asyncio
+
+    def test_keep_alive(self):
+        connection = HTTPConnection("127.0.0.1", self.listen_port, timeout=2)
+        for prefix, words in (("crypt", ["cryptic"]), ("abac", ["abacus"])):
+            connection.request("GET", f"/autocomplete?query={prefix}")
+            response = connection.getresponse()
+            self.assertEqual(response.status, 200)
+            self.assertEqual(response.getheader("Connection"), "keep-alive")
+            self.assertEqual(json.load(response), words)
+        # Both requests were served on the same connection
+        self.assertIsNotNone(connection.sock)
+        connection.close()
+
+    def test_pipelining(self):
+        with socket.create_connection(("127.0.0.1", self.listen_port), 2) as sock:
+            sock.sendall(
+                b"GET /autocomplete?query=crypt HTTP/1.1\r\nHost: velox\r\n\r\n"
+                b"GET /unknown HTTP/1.1\r\nHost: velox\r\n\r\n"
+                b"GET /autocomplete?query=abac HTTP/1.1\r\nConnection: close\r\n\r\n"
+            )
+            data = b""
+            while chunk := sock.recv(4096):
+                data += chunk
+
+        responses = data.split(b"HTTP/1.1 ")[1:]
+        self.assertEqual(len(responses), 3)
+        self.assertTrue(responses[0].startswith(b"200 "))
+        self.assertTrue(responses[0].endswith(b'["cryptic"]'))
+        self.assertTrue(responses[1].startswith(b"404 "))
+        self.assertTrue(responses[2].startswith(b"200 "))
+        self.assertIn(b"Connection: close", responses[2])
+        self.assertTrue(responses[2].endswith(b'["abacus"]'))
+
+    def test_timeouts(self):
+        httpd = AsyncHTTPServer(
+            self.velox, ("127.0.0.1", 0), max_connections=1, keep_alive_timeout=0.3
+        )
+        thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+        thread.start()
+        try:
+            address = httpd.server_address
+            with socket.create_connection(address, 2) as slow:
+                # Headers never completed: closed once the timeout is over,
+                # rather than waiting for the rest of the request
+                slow.sendall(b"GET /autocomplete?query=crypt HTTP/1.1\r\nHost:")
+                with socket.create_connection(address, 2) as waiting:
+                    # No slot is free: closed without a response
+                    waiting.sendall(b"GET /autocomplete?query=crypt HTTP/1.1\r\n\r\n")
+                    self.assertEqual(waiting.recv(4096), b"")
+                self.assertEqual(slow.recv(4096), b"")
+
+            # The slots are released
+            connection = HTTPConnection(*address, timeout=2)
+            connection.request("GET", "/autocomplete?query=crypt")
+            self.assertEqual(json.load(connection.getresponse()), ["cryptic"])
+            connection.close()
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+            thread.join()
+
+    def test_chunked_body(self):
+        connection = HTTPConnection("127.0.0.1", self.listen_port, timeout=2)
+        connection.request(
+            "POST",
+            "/autocomplete/batch",
+            body=iter([b'["crypt"]']),
+            encode_chunked=True,
+        )
+        self.assertEqual(connection.getresponse().status, 501)
+        connection.close()
+
+
+class TestPreforkHTTPServer(unittest.TestCase):
+    """
+    Integration tests of Velox Search HTTP Server with several worker processes
+    """
+
+    def setUp(self):
+        """
+        Start VeloxSearch HTTP Server with 2 workers in a subprocess
+        """
+        self.listen_port = random.randint(13000, 15000)
+        self.config_file = tempfile.NamedTemporaryFile("w", suffix=".toml")
+        self._write_config("eff_large_wordlist.txt")
+
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.path.dirname(os.path.dirname(veloxsearch.__file__))
+        self.process = subprocess.Popen(
+            [
+                sys.executable,
+                "-c",
+                "from veloxsearch.bin.http_server import main; main()",
+                "--config",
+                self.config_file.name,
+            ],
+            env=env,
+        )
+        self._wait_for_workers(2)
+
+    def _write_config(self, wordlist: str) -> None:
+        path = os.path.join(os.path.dirname(__file__), f"../data/{wordlist}")
+        self.config_file.seek(0)
+        self.config_file.truncate()
+        self.config_file.write(f"""
+            [http_server]
+            listen_addr = "127.0.0.1"
+            listen_port = {self.listen_port}
+            workers = 2
+
+            [search]
+            wordlist = "{path}"
+            algorithm = "bisect"
+            limit = 10
+
+            [logging]
+            level = "warning"
+            """)
+        self.config_file.flush()
+
+    def tearDown(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
+        self.config_file.close()
+
+    def _workers(self) -> list[int]:
+        path = f"/proc/{self.process.pid}/task/{self.process.pid}/children"
+        try:
+            with open(path) as fd:
+                return [int(pid) for pid in fd.read().split()]
+        except FileNotFoundError:
+            self.skipTest("Worker processes can not be listed")
+
+    def _wait_for_workers(self, count: int) -> None:
+        for _ in range(100):
+            if len(self._workers()) == count:
+                try:
+                    self._autocomplete("crypt")
+                    return
+                except OSError:
+                    pass
+            time.sleep(0.1)
+        self.fail("Workers did not start")
+
+    def _autocomplete(self, prefix: str) -> list[str]:
+        url = f"http://127.0.0.1:{self.listen_port}/autocomplete?query={prefix}"
+        return json.load(urllib.request.urlopen(url, timeout=2))
+
+    def test_autocomplete(self):
+        for _ in range(10):
+            self.assertEqual(self._autocomplete("crypt"), ["cryptic"])
+
+    def test_restart_crashed_worker(self):
+        crashed, other = self._workers()
+        os.kill(crashed, signal.SIGKILL)
+
+        for _ in range(50):
+            workers = self._workers()
+            if len(workers) == 2 and crashed not in workers:
+                break
+            time.sleep(0.1)
+
+        self.assertEqual(len(workers), 2)
+        self.assertIn(other, workers)
+        self.assertNotIn(crashed, workers)
+        self.assertEqual(self._autocomplete("abac"), ["abacus"])
+
+    def test_reload(self):
+        workers = self._workers()
+        self.assertEqual(self._autocomplete("obi-"), [])
+        self._write_config("starwars_8k_2018.txt")
+        self.process.send_signal(signal.SIGHUP)
+
+        # Queries are served during the reload and the rolling restart
+        for _ in range(50):
+            self._autocomplete("obi-")
+            new_workers = self._workers()
+            if len(new_workers) == 2 and not set(workers) & set(new_workers):
+                break
+            time.sleep(0.1)
+        # Both workers were replaced by workers sharing the reloaded index of
+        # the supervisor
+        self.assertEqual(len(new_workers), 2)
+        self.assertFalse(set(workers) & set(new_workers))
+        for _ in range(10):
+            self.assertEqual(self._autocomplete("obi-"), ["obi-wan"])
+
+        # So has the supervisor, for the workers it restarts
+        for pid in self._workers():
+            os.kill(pid, signal.SIGKILL)
+        time.sleep(1.5)
+        self._wait_for_workers(2)
+        self.assertEqual(self._autocomplete("obi-"), ["obi-wan"])
+
+    def test_metrics(self):
+        for _ in range(10):
+            self._autocomplete("crypt")
+
+        # Whichever worker serves them, the metrics are the ones of all the
+        # workers. One more query was sent by setUp.
+        for _ in range(4):
+            url = f"http://127.0.0.1:{self.listen_port}/metrics"
+            metrics = parse_metrics(
+                urllib.request.urlopen(url, timeout=2).read().decode()
+            )
+            self.assertEqual(
+                metrics['velox_requests_total{route="/autocomplete",status="2xx"}'],
+                11,
+            )
+            for worker in ["0", "1"]:
+                self.assertIn(
+                    f'velox_process_resident_memory_bytes{{worker="{worker}"}}',
+                    metrics,
+                )
+
+    def test_stop(self):
+        workers = self._workers()
+        self.process.send_signal(signal.SIGTERM)
+        self.assertEqual(self.process.wait(timeout=5), 0)
+        for pid in workers:
+            with self.assertRaises(ProcessLookupError):
+                os.kill(pid, 0)
+
 
 # Pour lancer les tests depuis la ligne de commande: python -m unittest test_integration.py
 if __name__ == "__main__":
@@ -0,0 +1,137 @@
+import os
+import tempfile
+import unittest
+
+from .utils import get_config
+from veloxsearch.config import SearchAlgorithm
+from veloxsearch.index import (
+    WordIndex,
+    build_index,
+    is_index_file,
+    read_weighted_wordlist,
+    read_wordlist,
+)
+from veloxsearch.velox import Velox
+
+
+class TestIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.index_path = os.path.join(self.tmp_dir.name, "index.vlx")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_build_and_open(self):
+        wordlist = get_config("french.txt", SearchAlgorithm.Mmap, 3).search.wordlist
+        built = build_index(wordlist, self.index_path)
+
+        self.assertTrue(is_index_file(self.index_path))
+        self.assertFalse(is_index_file(wordlist))
+
+        index = WordIndex.open(self.index_path)
+        self.assertEqual(len(index), len(built))
+        self.assertEqual(
+            index.complete("abâ", 3), ["abâtardi", "abâtardie", "abâtardies"]
+        )
+        self.assertEqual(index.complete("zzzzz", 3), [])
+
+    def test_deduplicated_and_sorted(self):
+        index = WordIndex.from_words(["b", "a", "ab", "b", "été", "z"])
+        self.assertEqual(
+            [index[i] for i in range(len(index))],
+            [b"a", b"ab", b"b", b"z", "été".encode()],
+        )
+
+    def test_buckets(self):
+        words = ["a", "ab", "abc", "b", "ba", "été", "z", "zz"]
+        index = WordIndex.from_words(words)
+
+        self.assertEqual(index.prefix_range(b""), (0, 8))
+        self.assertEqual(index.prefix_range(b"a"), (0, 3))
+        self.assertEqual(index.prefix_range(b"ab"), (1, 3))
+        self.assertEqual(index.prefix_range(b"abcd"), (1, 3))
+        self.assertEqual(index.prefix_range("é".encode()), (7, 8))
+        # Unknown prefixes have an empty range
+        self.assertEqual(index.prefix_range(b"c")[0], index.prefix_range(b"c")[1])
+        self.assertEqual(index.prefix_range(b"ac")[0], index.prefix_range(b"ac")[1])
+
+        for prefix in words + ["", "aa", "abd", "bb", "c", "é", "zzz", "\U0010ffff"]:
+            self.assertEqual(
+                index.complete(prefix, 2),
+                [word for word in sorted(words) if word.startswith(prefix)][:2],
+                msg=f"Prefix `{prefix}`",
+            )
+        self.assertEqual(
+            index.complete_many(["zzz", "ab", "", "c", "zz"], 2),
+            [[], ["ab", "abc"], ["a", "ab"], [], ["zz"]],
+        )
+        self.assertEqual(WordIndex.from_words([]).complete("a", 2), [])
+
+    def test_corrupted_index(self):
+        wordlist = get_config(
+            "starwars_8k_2018.txt", SearchAlgorithm.Mmap, 3
+        ).search.wordlist
+        build_index(wordlist, self.index_path)
+
+        with open(self.index_path, "r+b") as fd:
+            fd.seek(-1, os.SEEK_END)
+            fd.write(b"!")
+
+        with self.assertRaises(ValueError) as error:
+            WordIndex.open(self.index_path)
+        self.assertIn("checksum mismatch", str(error.exception))
+
+    def test_mmap_search_on_index_file(self):
+        config = get_config("starwars_8k_2018.txt", SearchAlgorithm.Mmap, 3)
+        build_index(config.search.wordlist, self.index_path)
+        config.search.wordlist = self.index_path
+
+        velox = Velox(config)
+        self.assertEqual(velox.complete_prefix("OBI"), ["obi-wan"])
+
+    def test_weighted_wordlist(self):
+        wordlist = os.path.join(self.tmp_dir.name, "wordlist.txt")
+        with open(wordlist, "w") as fd:
+            fd.write("Pomme\t12\nporte\n\npoire\t0.5\n")
+
+        self.assertEqual(list(read_wordlist(wordlist)), ["pomme", "porte", "poire"])
+        self.assertEqual(
+            list(read_weighted_wordlist(wordlist)),
+            [("pomme", 12), ("porte", 0), ("poire", 0.5)],
+        )
+
+        with open(wordlist, "a") as fd:
+            fd.write("prune\theavy\n")
+        with self.assertRaises(ValueError) as error:
+            list(read_weighted_wordlist(wordlist))
+        self.assertIn("line 5", str(error.exception))
+
+    def test_chunked_wordlist(self):
+        wordlist = os.path.join(self.tmp_dir.name, "wordlist.txt")
+        with open(wordlist, "wb") as fd:
+            fd.write(
+                b"Zeta\r\nalpha\t3\n\nbeta\rgamma\n  Alpha \n\xff\xfe\n"
+                + "été\tété\ndelta\nBETA\nzeta".encode()
+            )
+        expected = WordIndex.from_words(read_wordlist(wordlist))
+
+        for chunk_size in [1, 5, 16, 1 << 20]:
+            for workers in [1, 2]:
+                index = WordIndex.from_wordlist(wordlist, workers, chunk_size)
+                self.assertEqual(index.blob, expected.blob)
+                self.assertEqual(list(index.offsets), list(expected.offsets))
+
+        # Chunks of a wordlist sorted by bytes are only concatenated
+        with open(wordlist, "w") as fd:
+            fd.write("a\nb\nc\nd\n")
+        index = WordIndex.from_wordlist(wordlist, 1, 2)
+        self.assertEqual(list(index.iter_words()), ["a", "b", "c", "d"])
+
+        with open(wordlist, "w") as fd:
+            pass
+        self.assertEqual(len(WordIndex.from_wordlist(wordlist)), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
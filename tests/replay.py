@@ -0,0 +1,104 @@
+import os
+import tempfile
+import unittest
+
+from .utils import get_config
+from veloxsearch.bin.replay import (
+    LatencyHistogram,
+    LFUSimulator,
+    LRUSimulator,
+    PrecomputedSimulator,
+    count_prefixes,
+    iter_queries,
+    replay,
+    simulate,
+)
+from veloxsearch.cache import LRUCache
+from veloxsearch.config import SearchAlgorithm
+from veloxsearch.velox import Velox
+
+
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.log = os.path.join(self.tmp_dir.name, "queries.log")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_iter_queries(self):
+        with open(self.log, "w") as fd:
+            fd.write(
+                '127.0.0.1 - - [17/Oct/2026 10:00:00] "GET /autocomplete?query=Obi HTTP/1.1" 200 -\n'
+                '127.0.0.1 - - [17/Oct/2026 10:00:01] "GET /autocomplete?query=ob&fuzzy=1 HTTP/1.1" 200 -\n'
+                '127.0.0.1 - - [17/Oct/2026 10:00:02] "GET /autocomplete?query=ob&cursor= HTTP/1.1" 200 -\n'
+                '127.0.0.1 - - [17/Oct/2026 10:00:03] "GET /count?query=ob HTTP/1.1" 200 -\n'
+                '127.0.0.1 - - [17/Oct/2026 10:00:04] "GET /autocomplete?query=yo&index=starwars HTTP/1.1" 200 -\n'
+                '127.0.0.1 - - [17/Oct/2026 10:00:05] "POST /autocomplete HTTP/1.1" 200 -\n'
+                "127.0.0.1 - - [17/Oct/2026 10:00:06] code 400, message Bad request syntax ('GET /')\n"
+                '127.0.0.1 - - [17/Oct/2026 10:00:06] "GET /" 400 -\n'
+                "\n"
+                "truncated line\n"
+            )
+
+        self.assertEqual(list(iter_queries(self.log)), ["Obi"])
+        self.assertEqual(list(iter_queries(self.log, "starwars")), ["yo"])
+        self.assertEqual(len(list(iter_queries(self.log, log_format="prefixes"))), 9)
+
+        with open(self.log, "w") as fd:
+            fd.write("\n  lu  \n%C3%A9t\n")
+        self.assertEqual(list(iter_queries(self.log)), ["lu", "%C3%A9t"])
+        self.assertEqual(list(iter_queries(self.log, log_format="access")), [])
+
+    def test_latency_histogram(self):
+        histogram = LatencyHistogram()
+        for latency in range(1, 1001):
+            histogram.add(latency * 1000)
+
+        self.assertEqual(histogram.count, 1000)
+        self.assertEqual(histogram.max, 1_000_000)
+        # Exact to within 1/32
+        for percent in [50, 90, 99]:
+            self.assertAlmostEqual(
+                histogram.percentile(percent),
+                percent * 10_000,
+                delta=percent * 10_000 / 32,
+            )
+        # 32 buckets per power of two
+        self.assertLessEqual(len(histogram.buckets), 32 * 10)
+
+    def test_simulators(self):
+        queries = ["a", "b", "a", "c", "a", "d", "b", "ab", "a"]
+        lru = LRUSimulator(2)
+        # A single shard, so that the LRU order is global
+        lru.cache = LRUCache(2, shards=1)
+        lfu = LFUSimulator(2)
+        precomputed = PrecomputedSimulator(1)
+        simulate([lru, lfu, precomputed], iter(queries))
+
+        # "a" is evicted by "d" then "ab" from the LRU cache, but stays in the
+        # LFU one as the most frequent key
+        self.assertEqual(lru.hits, 2)
+        self.assertEqual(lfu.hits, 3)
+        self.assertEqual(precomputed.hits, 8)
+        self.assertEqual(lfu.report()["hit_ratio"], 3 / 9)
+        self.assertLessEqual(len(lfu.frequencies), 2)
+
+        self.assertEqual(LFUSimulator(0).report()["hits"], 0)
+
+    def test_replay(self):
+        config = get_config("starwars_8k_2018.txt", SearchAlgorithm.Bisect, 3)
+        with open(self.log, "w") as fd:
+            fd.write("obi\nlu\nzzzzz\n")
+
+        histogram = replay(Velox(config), iter_queries(self.log))
+        self.assertEqual(histogram.count, 3)
+        self.assertEqual(replay(Velox(config), iter_queries(self.log), 2).count, 2)
+
+        counts = count_prefixes(config.search.wordlist, 2)
+        self.assertEqual(counts[0], 1)
+        self.assertLess(counts[1], counts[2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import random
+import unittest
+
+from veloxsearch.index import WordIndex
+from veloxsearch.suffix_array import MAX_LCP, SuffixArray, substring_key
+
+
+class TestSuffixArray(unittest.TestCase):
+    def _expected(self, words: list[str], substring: str, limit: int) -> list[str]:
+        return sorted(
+            (word for word in set(words) if substring in word),
+            key=lambda word: (substring_key(word, substring), word),
+        )[:limit]
+
+    def test_complete(self):
+        words = ["football", "ball", "balle", "baseball", "allé", "été", "a"]
+        suffix_array = SuffixArray.from_index(WordIndex.from_words(words))
+
+        self.assertEqual(
+            suffix_array.complete("ball", 10),
+            ["ball", "baseball", "football", "balle"],
+        )
+        self.assertEqual(suffix_array.complete("ball", 2), ["ball", "baseball"])
+        # Words containing the substring several times are returned once
+        self.assertEqual(suffix_array.complete("l", 10), self._expected(words, "l", 10))
+        self.assertEqual(suffix_array.complete("é", 10), ["allé", "été"])
+        self.assertEqual(suffix_array.complete("", 3), ["a", "allé", "ball"])
+        self.assertEqual(suffix_array.complete("zz", 10), [])
+        self.assertEqual(suffix_array.complete("l\nb", 10), [])
+
+    def test_suffixes_sorted(self):
+        rng = random.Random(42)
+        words = [
+            "".join(rng.choice("abé-") for _ in range(rng.randint(1, 8)))
+            for _ in range(500)
+        ]
+        suffix_array = SuffixArray.from_index(WordIndex.from_words(words))
+        text = suffix_array.text
+
+        def suffix(rank: int) -> bytes:
+            position = suffix_array.suffixes[rank]
+            return text[position : text.index(b"\n", position) + 1]
+
+        for rank in range(1, len(suffix_array)):
+            previous, current = suffix(rank - 1), suffix(rank)
+            self.assertLessEqual(previous, current)
+            length = 0
+            while length < len(previous) and previous[length] == current[length]:
+                length += 1
+            self.assertEqual(suffix_array.lcp[rank], length)
+
+        for substring in ["a", "bé", "-", "é-a", "aaa", "ab-é"]:
+            self.assertEqual(
+                suffix_array.complete(substring, 20),
+                self._expected(words, substring, 20),
+                msg=f"Substring `{substring}`",
+            )
+
+    def test_long_common_prefix(self):
+        # Longer common prefixes than the LCP array can hold
+        common = "x" * (MAX_LCP + 10)
+        words = [common + "a", common + "b", "y" + common + "c", common]
+        suffix_array = SuffixArray.from_index(WordIndex.from_words(words))
+
+        self.assertEqual(suffix_array.complete(common + "b", 10), [common + "b"])
+        self.assertEqual(
+            suffix_array.complete("x" * (MAX_LCP + 5), 10),
+            self._expected(words, "x" * (MAX_LCP + 5), 10),
+        )
+        self.assertEqual(suffix_array.complete(common + "c", 10), ["y" + common + "c"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,15 @@
+from dataclasses import replace
 import logging
+import os
+import random
+import shutil
+import tempfile
+import threading
 import unittest
 
 from .utils import get_config
+from veloxsearch.algorithms.numpy import np as numpy
+from veloxsearch.algorithms.prefix_tree import SnapshotNode
 from veloxsearch.config import (
     SearchAlgorithm,
 )
@@ -201,6 +209,13 @@ class TestVelox(unittest.TestCase):
                 ["zython", "zythons", "zythum", "zythums"],
                 msg=f"Algorithm {algorithm} failed",
             )
+            # Prefixes sorting after the last word
+            for prefix in ["zythumss", "zz", "\U0010ffff"]:
+                self.assertEqual(
+                    velox.complete_prefix(prefix),
+                    [],
+                    msg=f"Algorithm {algorithm} failed",
+                )
 
     def test_search_french_start_of_list(self):
         for algorithm in SearchAlgorithm:
@@ -225,3 +240,530 @@ class TestVelox(unittest.TestCase):
                 ],
                 msg=f"Algorithm {algorithm} failed",
             )
+
+    def test_search_precomputed_french(self):
+        for algorithm in SearchAlgorithm:
+            config = get_config("french.txt", algorithm, 5)
+            try:
+                velox = Velox(config)
+            except NotImplementedError:
+                continue
+
+            config.search.precompute_length = 2
+            precomputed = Velox(config)
+
+            # Precomputed prefixes, unknown precomputed prefix and prefixes
+            # answered by the algorithm itself
+            for prefix in ["", "a", "Zy", "ç", "qz", "pia", "abâ", "bladiboulgou"]:
+                self.assertEqual(
+                    precomputed.complete_prefix(prefix),
+                    velox.complete_prefix(prefix),
+                    msg=f"Algorithm {algorithm} failed with prefix `{prefix}`",
+                )
+
+    def test_search_precomputed_max_words(self):
+        config = get_config("french.txt", SearchAlgorithm.Bisect, 5)
+        config.search.precompute_length = 3
+        # Enough for prefixes of length 0 and 1, but not for length 2
+        config.search.precompute_max_words = 200
+
+        velox = Velox(config)
+
+        self.assertEqual(getattr(velox.handler, "length"), 1)
+        self.assertEqual(
+            velox.complete_prefix("zyth"), ["zython", "zythons", "zythum", "zythums"]
+        )
+
+    def test_search_cache(self):
+        config = get_config("starwars_8k_2018.txt", SearchAlgorithm.Bisect, 3)
+        config.cache.max_entries = 10
+        velox = Velox(config)
+
+        self.assertEqual(velox.complete_prefix("obi"), ["obi-wan"])
+        self.assertEqual(velox.complete_prefix("OBI"), ["obi-wan"])
+        assert velox.cache is not None
+        stats = velox.cache.stats()
+        self.assertEqual(stats.misses, 1)
+        self.assertEqual(stats.hits, 1)
+
+    def test_search_batch(self):
+        prefixes = ["cor", "OBI", "co", "", "obi", "zzz", "c", "corn", "o"]
+        for algorithm in SearchAlgorithm:
+            try:
+                velox = Velox(get_config("starwars_8k_2018.txt", algorithm, 5))
+            except NotImplementedError:
+                continue
+
+            self.assertEqual(
+                velox.complete_prefixes(prefixes),
+                [velox.complete_prefix(prefix) for prefix in prefixes],
+                msg=f"Algorithm {algorithm} failed",
+            )
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_search_numpy(self):
+        bisect = Velox(get_config("french.txt", SearchAlgorithm.Bisect, 5))
+        velox = Velox(get_config("french.txt", SearchAlgorithm.Numpy, 5))
+
+        rng = random.Random(42)
+        words = rng.sample(list(bisect.handler.index.iter_words()), 1000)
+        prefixes = [word[: rng.randint(0, 6)] for word in words] + [
+            "Abâ",
+            # Longer than the longest word
+            "anticonstitutionnellementtttttt",
+            "zythums",
+            "\U0010ffff",
+        ]
+        self.assertEqual(
+            velox.complete_prefixes(prefixes), bisect.complete_prefixes(prefixes)
+        )
+        for prefix in prefixes[-4:]:
+            self.assertEqual(
+                velox.count_prefix(prefix), bisect.count_prefix(prefix), prefix
+            )
+        self.assertEqual(
+            velox.complete_prefix("abâ", "abâtardi"),
+            bisect.complete_prefix("abâ", "abâtardi"),
+        )
+
+    def test_search_batch_cache(self):
+        config = get_config("starwars_8k_2018.txt", SearchAlgorithm.Bisect, 3)
+        config.cache.max_entries = 10
+        config.search.precompute_length = 1
+        velox = Velox(config)
+
+        self.assertEqual(velox.complete_prefix("obi"), ["obi-wan"])
+        self.assertEqual(
+            velox.complete_prefixes(["cor", "obi", "o"]),
+            [["core", "corellia", "cornered"], ["obi-wan"], velox.complete_prefix("o")],
+        )
+        assert velox.cache is not None
+        self.assertEqual(velox.cache.stats().hits, 2)
+
+    def test_reload(self):
+        with tempfile.TemporaryDirectory() as directory:
+            wordlist = os.path.join(directory, "wordlist.txt")
+            with open(wordlist, "w") as fd:
+                fd.write("apple\napricot\nbanana\n")
+
+            config = get_config("eff_large_wordlist.txt", SearchAlgorithm.Bisect, 10)
+            config.search.wordlist = wordlist
+            config.cache.max_entries = 10
+            velox = Velox(config)
+            self.assertEqual(velox.complete_prefix("ap"), ["apple", "apricot"])
+
+            # Queries served during the reload get either the old or the new
+            # results, never an error
+            results = []
+            stop = threading.Event()
+
+            def query():
+                while not stop.is_set():
+                    results.append(tuple(velox.complete_prefix("ap")))
+
+            thread = threading.Thread(target=query)
+            thread.start()
+            with open(wordlist + ".new", "w") as fd:
+                fd.write("apple\napron\nbanana\n" * 1000)
+            os.replace(wordlist + ".new", wordlist)
+            self.assertTrue(velox.reload())
+            stop.set()
+            thread.join()
+
+            self.assertLessEqual(
+                set(results), {("apple", "apricot"), ("apple", "apron")}
+            )
+            # Old results are not served from the cache
+            self.assertEqual(velox.complete_prefix("ap"), ["apple", "apron"])
+            self.assertEqual(velox.wordlist_mtime, os.stat(wordlist).st_mtime_ns)
+
+            # Cache statistics are kept, only the entries are dropped
+            assert velox.cache is not None
+            stats = velox.cache.stats()
+            self.assertTrue(velox.reload())
+            self.assertEqual(velox.cache.stats(), replace(stats, entries=0))
+
+            # The current wordlist is kept if the new one can not be loaded
+            config = get_config("eff_large_wordlist.txt", SearchAlgorithm.Bisect, 10)
+            config.search.wordlist = os.path.join(directory, "missing.txt")
+            self.assertFalse(velox.reload(config.search))
+            self.assertEqual(velox.complete_prefix("ap"), ["apple", "apron"])
+            self.assertEqual(velox.config.search.wordlist, wordlist)
+
+    def test_prefix_tree_snapshot(self):
+        with tempfile.TemporaryDirectory() as directory:
+            config = get_config("starwars_8k_2018.txt", SearchAlgorithm.PrefixTree, 5)
+            wordlist = os.path.join(directory, "wordlist.txt")
+            shutil.copyfile(config.search.wordlist, wordlist)
+            config.search.wordlist = wordlist
+            config.search.snapshot_dir = os.path.join(directory, "snapshots")
+
+            built = Velox(config)
+            restored = Velox(config)
+            self.assertNotIsInstance(built.handler.tree.root, SnapshotNode)
+            self.assertIsInstance(restored.handler.tree.root, SnapshotNode)
+
+            for prefix in ["", "d", "Obi", "dark-", "zzz"]:
+                self.assertEqual(
+                    restored.complete_prefix(prefix), built.complete_prefix(prefix)
+                )
+                self.assertEqual(
+                    restored.count_prefix(prefix), built.count_prefix(prefix)
+                )
+                self.assertEqual(
+                    restored.complete_fuzzy(prefix, 1),
+                    built.complete_fuzzy(prefix, 1),
+                )
+            self.assertEqual(
+                restored.complete_prefix("d", "dark"),
+                built.complete_prefix("d", "dark"),
+            )
+
+            # A changed wordlist gets a new snapshot
+            with open(wordlist, "a") as fd:
+                fd.write("obi-two\n")
+            velox = Velox(config)
+            self.assertNotIsInstance(velox.handler.tree.root, SnapshotNode)
+            self.assertEqual(velox.complete_prefix("obi"), ["obi-two", "obi-wan"])
+            snapshots = os.listdir(config.search.snapshot_dir)
+            self.assertEqual(len(snapshots), 2)
+
+            # An invalid snapshot is replaced
+            for snapshot in snapshots:
+                with open(
+                    os.path.join(config.search.snapshot_dir, snapshot), "r+b"
+                ) as fd:
+                    fd.seek(-1, os.SEEK_END)
+                    fd.write(b"!")
+            with self.assertLogs(level="WARNING") as logs:
+                velox = Velox(config)
+            self.assertIn("checksum mismatch", logs.output[0])
+            self.assertNotIsInstance(velox.handler.tree.root, SnapshotNode)
+            velox = Velox(config)
+            self.assertIsInstance(velox.handler.tree.root, SnapshotNode)
+            self.assertEqual(velox.complete_prefix("obi"), ["obi-two", "obi-wan"])
+
+    def test_indexes(self):
+        config = get_config("eff_large_wordlist.txt", SearchAlgorithm.Bisect, 10)
+        starwars = get_config("starwars_8k_2018.txt", SearchAlgorithm.PrefixTree, 3)
+        config.search.indexes = {
+            "starwars": starwars.search,
+            "eff": replace(config.search, limit=2),
+        }
+        velox = Velox(config)
+
+        self.assertIs(velox.index(None), velox)
+        self.assertEqual(velox.complete_prefix("cr")[:2], ["crabbing", "crabgrass"])
+        self.assertEqual(
+            velox.index("starwars").complete_prefix("obi"),
+            Velox(starwars).complete_prefix("obi"),
+        )
+        self.assertEqual(len(velox.index("starwars").complete_prefix("a")), 3)
+        with self.assertRaises(KeyError):
+            velox.index("unknown")
+
+        # The same wordlist is only loaded once, whatever the limit
+        self.assertIs(velox.index("eff").handler, velox.handler)
+        self.assertEqual(
+            velox.index("eff").complete_prefix("cr"), ["crabbing", "crabgrass"]
+        )
+        self.assertEqual(
+            velox.index("eff").complete_prefixes(["cr"]), [["crabbing", "crabgrass"]]
+        )
+
+        # Each index has its own changes, kept when reloading
+        velox.index("eff").add_word("crab")
+        self.assertEqual(velox.index("eff").complete_prefix("cr"), ["crab", "crabbing"])
+        self.assertEqual(velox.complete_prefix("cr")[:2], ["crabbing", "crabgrass"])
+
+        index = velox.index("eff")
+        self.assertTrue(velox.reload(config.search))
+        self.assertIs(velox.index("eff"), index)
+        self.assertIs(velox.index("eff").handler, velox.handler)
+        self.assertEqual(velox.index("eff").complete_prefix("cr"), ["crab", "crabbing"])
+
+        # Removed named indexes are dropped
+        self.assertTrue(velox.reload(replace(config.search, indexes={})))
+        self.assertEqual(velox.indexes, {})
+
+        # Precomputed answers hold <limit> words, so they are not shared
+        # between limits
+        precomputed = replace(config.search, precompute_length=1)
+        config.search = replace(
+            precomputed, indexes={"eff": replace(precomputed, limit=20)}
+        )
+        velox = Velox(config)
+        self.assertIsNot(velox.index("eff").handler, velox.handler)
+        self.assertEqual(len(velox.index("eff").complete_prefix("c")), 20)
+
+    def test_add_remove_word(self):
+        for algorithm in SearchAlgorithm:
+            if algorithm == SearchAlgorithm.Ranked:
+                # Live changes are not supported by ranked search
+                continue
+            config = get_config("starwars_8k_2018.txt", algorithm, 3)
+            config.cache.max_entries = 10
+            config.search.precompute_length = 2
+            try:
+                velox = Velox(config)
+            except NotImplementedError:
+                continue
+
+            self.assertEqual(velox.complete_prefix("obi"), ["obi-wan"])
+            self.assertEqual(
+                velox.complete_prefix("co"), ["co-pilot", "coaxium", "cobalt"]
+            )
+            words = velox.count_words()
+
+            velox.add_word("Obi")
+            velox.remove_word("obi-wan")
+            velox.remove_word("coaxium")
+            velox.add_word("coa")
+
+            self.assertEqual(
+                velox.complete_prefix("obi"), ["obi"], msg=f"Algorithm {algorithm}"
+            )
+            self.assertEqual(
+                velox.complete_prefixes(["co", "c"]),
+                [["co-pilot", "coa", "cobalt"], velox.complete_prefix("c")],
+                msg=f"Algorithm {algorithm}",
+            )
+            if words is not None:
+                self.assertEqual(velox.count_words(), words)
+                velox.remove_word("cobalt")
+                self.assertEqual(velox.count_words(), words - 1)
+
+            # Changes are kept when the wordlist is reloaded
+            self.assertTrue(velox.reload())
+            self.assertEqual(velox.complete_prefix("obi"), ["obi"])
+
+            with self.assertRaises(ValueError):
+                velox.add_word(" ")
+
+    def test_search_ranked(self):
+        rng = random.Random(42)
+        with open(
+            get_config("french.txt", SearchAlgorithm.Naive, 0).search.wordlist
+        ) as fd:
+            words = [line.strip() for line in fd][::10]
+        weights = {word: rng.choice([0, 1, 2.5, rng.random() * 100]) for word in words}
+
+        with tempfile.TemporaryDirectory() as directory:
+            wordlist = os.path.join(directory, "wordlist.txt")
+            with open(wordlist, "w") as fd:
+                for word, weight in weights.items():
+                    fd.write(f"{word.upper()}\t{weight}\n")
+                # Words without a weight weigh 0, duplicates keep the highest
+                # weight
+                fd.write("zzzz\n\n")
+                fd.write(f"{words[0]}\t1000\n")
+            weights["zzzz"] = 0
+            weights[words[0]] = 1000
+
+            config = get_config("french.txt", SearchAlgorithm.Ranked, 10)
+            config.search.wordlist = wordlist
+            velox = Velox(config)
+
+        for prefix in ["", "a", "pou", "z", "zzzz", "zzzzz"] + [
+            word[: rng.randint(1, 4)] for word in rng.sample(words, 50)
+        ]:
+            expected = sorted(
+                (word for word in weights if word.startswith(prefix)),
+                key=lambda word: (-weights[word], word),
+            )[:10]
+            self.assertEqual(
+                velox.complete_prefix(prefix.upper()),
+                expected,
+                msg=f"Prefix `{prefix}`",
+            )
+
+        with self.assertRaises(NotImplementedError):
+            velox.add_word("pomme")
+
+    def test_search_fuzzy(self):
+        def distance(prefix: str, word: str) -> int:
+            # Smallest edit distance between <prefix> and a prefix of <word>
+            row = list(range(len(prefix) + 1))
+            best = row[-1]
+            for char in word:
+                previous, row = row, [row[0] + 1]
+                for position, prefix_char in enumerate(prefix):
+                    row.append(
+                        min(
+                            row[position] + 1,
+                            previous[position + 1] + 1,
+                            previous[position] + (prefix_char != char),
+                        )
+                    )
+                best = min(best, row[-1])
+            return best
+
+        config = get_config("starwars_8k_2018.txt", SearchAlgorithm.Naive, 0)
+        with open(config.search.wordlist) as fd:
+            words = set(line.strip().lower() for line in fd) - {""}
+
+        rng = random.Random(42)
+        prefixes = ["", "o", "obu-", "kyber", "ykber", "zzzzzz", "éwok"] + [
+            word[: rng.randint(2, 6)] + rng.choice("aeiz")
+            for word in sorted(words)[::400]
+        ]
+        expected = {
+            (prefix, max_distance): sorted(
+                (distance(prefix, word), word)
+                for word in words
+                if distance(prefix, word) <= max_distance
+            )[:10]
+            for prefix in prefixes
+            for max_distance in (1, 2)
+        }
+
+        for algorithm in SearchAlgorithm:
+            config = get_config("starwars_8k_2018.txt", algorithm, 10)
+            config.search.precompute_length = 2
+            try:
+                velox = Velox(config)
+                velox.complete_fuzzy("obi", 1)
+            except NotImplementedError:
+                continue
+
+            for (prefix, max_distance), pairs in expected.items():
+                self.assertEqual(
+                    velox.complete_fuzzy(prefix.upper(), max_distance),
+                    [word for _, word in pairs],
+                    msg=f"Algorithm {algorithm}, prefix `{prefix}`",
+                )
+
+            # Live changes are taken into account
+            self.assertEqual(velox.complete_fuzzy("obu-wan", 1), ["obi-wan"])
+            velox.remove_word("obi-wan")
+            velox.add_word("obu-wan kenobi")
+            self.assertEqual(velox.complete_fuzzy("obu-wan", 1), ["obu-wan kenobi"])
+
+    def test_search_substring(self):
+        config = get_config("starwars_8k_2018.txt", SearchAlgorithm.Naive, 0)
+        with open(config.search.wordlist) as fd:
+            words = set(line.strip().lower() for line in fd) - {""}
+
+        def expected(substring: str) -> list[str]:
+            # By the smallest end of the word starting with the substring
+            keys = {
+                word: min(
+                    word[position:] + "\n"
+                    for position in range(len(word) + 1)
+                    if word.startswith(substring, position)
+                )
+                for word in words
+                if substring in word
+            }
+            return sorted(keys, key=lambda word: (keys[word], word))[:10]
+
+        substrings = ["", "a", "ob", "-wa", "kenobi", "é", "zzzzzz", " "] + [
+            word[len(word) // 3 : len(word) // 3 + 3] for word in sorted(words)[::300]
+        ]
+        for algorithm in SearchAlgorithm:
+            config = get_config("starwars_8k_2018.txt", algorithm, 10)
+            config.search.precompute_length = 2
+            try:
+                velox = Velox(config)
+                velox.complete_substring("obi")
+            except NotImplementedError:
+                continue
+
+            for substring in substrings:
+                self.assertEqual(
+                    velox.complete_substring(substring.upper()),
+                    expected(substring),
+                    msg=f"Algorithm {algorithm}, substring `{substring}`",
+                )
+
+            # Live changes are taken into account
+            velox.remove_word("obi-wan")
+            velox.add_word("kenobi-wan")
+            words.remove("obi-wan")
+            words.add("kenobi-wan")
+            self.assertEqual(velox.complete_substring("i-wa"), expected("i-wa"))
+            words.add("obi-wan")
+            words.remove("kenobi-wan")
+
+    def test_count_prefix(self):
+        config = get_config("french.txt", SearchAlgorithm.Naive, 0)
+        with open(config.search.wordlist) as fd:
+            words = set(line.strip().lower() for line in fd) - {""}
+        prefixes = ["", "a", "ab", "abâ", "pomm", "zyth", "zythums", "zz", "é", "-"]
+
+        for algorithm in SearchAlgorithm:
+            config = get_config("french.txt", algorithm, 10)
+            config.search.precompute_length = 2
+            try:
+                velox = Velox(config)
+            except NotImplementedError:
+                continue
+
+            for prefix in prefixes:
+                self.assertEqual(
+                    velox.count_prefix(prefix.upper()),
+                    sum(1 for word in words if word.startswith(prefix)),
+                    msg=f"Algorithm {algorithm}, prefix `{prefix}`",
+                )
+
+            if algorithm == SearchAlgorithm.Ranked:
+                # Live changes are not supported by ranked search
+                continue
+            count = velox.count_prefix("pomm")
+            velox.add_word("pommeau")
+            velox.add_word("pommx")
+            velox.add_word("pommy")
+            velox.remove_word("pommy")
+            velox.remove_word("pomme")
+            velox.remove_word("pommeau")
+            # Not in the wordlist
+            velox.remove_word("pommeraie")
+            self.assertEqual(
+                velox.count_prefix("pomm"), count - 1, msg=f"Algorithm {algorithm}"
+            )
+
+    def test_pagination(self):
+        config = get_config("french.txt", SearchAlgorithm.Naive, 0)
+        with open(config.search.wordlist) as fd:
+            words = sorted(set(line.strip().lower() for line in fd) - {""})
+
+        for algorithm in SearchAlgorithm:
+            config = get_config("french.txt", algorithm, 7)
+            config.search.precompute_length = 2
+            config.cache.max_entries = 10
+            try:
+                velox = Velox(config)
+            except NotImplementedError:
+                continue
+
+            if algorithm == SearchAlgorithm.Ranked:
+                with self.assertRaises(NotImplementedError):
+                    velox.complete_prefix("po", "pomme")
+                continue
+
+            velox.add_word("pommz")
+            velox.remove_word("pommeau")
+            expected = [
+                word
+                for word in words + ["pommz"]
+                if word.startswith("pomm") and word != "pommeau"
+            ]
+            pages = [velox.complete_prefix("Pomm")]
+            while len(pages[-1]) == 7:
+                pages.append(velox.complete_prefix("Pomm", pages[-1][-1]))
+            self.assertEqual(
+                [word for page in pages for word in page],
+                sorted(expected),
+                msg=f"Algorithm {algorithm}",
+            )
+
+            # The word of the cursor does not need to exist
+            self.assertEqual(
+                velox.complete_prefix("a", "abaissa "),
+                [word for word in words if word > "abaissa "][:7],
+                msg=f"Algorithm {algorithm}",
+            )
+            self.assertEqual(velox.complete_prefix("a", "b"), [])
+            self.assertEqual(
+                velox.complete_prefix("zyth", "a"), velox.complete_prefix("zyth")
+            )